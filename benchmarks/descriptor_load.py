@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Time loading a descriptor with 10,000 grants.
+
+Compares yaml.load with the pure Python loader on a descriptor in the old
+!!python/object format against repopy.descriptor.load on the same
+descriptor in both formats, and against descriptor.load_file reading the
+binary sidecar.
+
+usage: python benchmarks/descriptor_load.py [GRANTS]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from repopy import descriptor
+from repopy.repository import Repository, Group, Auth
+
+
+def make_repository(grants):
+    repo = Repository('bench', 'monorepo')
+    repo.groups.append(Group('devs', ['user%d' % i for i in range(50)]))
+    repo.authorizations = [Auth('/project%d/trunk' % (i / 10), 'user%d' % i,
+                                (i % 3) and Auth.READ_ONLY or Auth.READ_WRITE)
+                           for i in range(grants)]
+    return repo
+
+
+def best_of(fun, arg, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        fun(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    grants = 10000
+    if len(sys.argv) > 1:
+        grants = int(sys.argv[1])
+
+    repo = make_repository(grants)
+    legacy = yaml.dump(repo)
+    tagged = descriptor.dump(repo)
+
+    print 'Descriptor with %d grants (%d bytes).' % (grants, len(tagged))
+    print 'libyaml available: %s' % yaml.__with_libyaml__
+    print '%-40s %8.3fs' % ('yaml.load, legacy tags:',
+                            best_of(lambda s: yaml.load(s, Loader=yaml.Loader), legacy))
+    print '%-40s %8.3fs' % ('descriptor.load, legacy tags:',
+                            best_of(descriptor.load, legacy))
+    print '%-40s %8.3fs' % ('descriptor.load, descriptor tags:',
+                            best_of(descriptor.load, tagged))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        yaml_path = os.path.join(tmpdir, 'monorepo.yaml')
+        descriptor.dump_file(repo, yaml_path)
+        print '%-40s %8.3fs' % ('descriptor.load_file, sidecar:',
+                                best_of(descriptor.load_file, yaml_path))
+    finally:
+        shutil.rmtree(tmpdir)
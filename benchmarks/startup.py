@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Measure how long svnsh takes to start and fail if it's over budget.
+
+Each run starts a new interpreter that imports the shell and builds the
+Shell object, which is what every svnsh invocation pays before running a
+command. The median of the runs is compared with the budget.
+
+usage: python benchmarks/startup.py [-n RUNS] [-b BUDGET_SECONDS]
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = 'import repopy.shell; repopy.shell.Shell()'
+
+
+def measure(runs):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', SCRIPT], cwd=ROOT, env=env)
+        times.append(time.time() - start)
+    times.sort()
+    return times
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [-n RUNS] [-b BUDGET]')
+    parser.add_option('-n', '--runs', type='int', default=20,
+                      help='Number of interpreters to start.')
+    parser.add_option('-b', '--budget', type='float', default=0.2,
+                      help='Largest acceptable median start up time in seconds.')
+    (options, args) = parser.parse_args()
+
+    times = measure(options.runs)
+    median = times[len(times) / 2]
+    print 'Start up over %d runs: min %.3fs median %.3fs max %.3fs (budget %.3fs)' % \
+                    (len(times), times[0], median, times[-1], options.budget)
+    if median > options.budget:
+        print 'FAILED: start up is over budget.'
+        sys.exit(1)
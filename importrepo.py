@@ -8,19 +8,37 @@ Created by Erik Froese on 2006-09-25.
 
 import sys
 import os
-import yaml
+import sets
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 from optparse import OptionParser, make_option
 
 from repopy.repository import Repository, Auth, Group
-from repopy.svn import Client
+from repopy.catalog import Catalog
+from repopy import descriptor
+from repopy import config
 
 help_message = '''
 importrepo.py
 Import an existing authz file into our yaml representation.
-usage: import.py -d department repository
+usage: import.py [-q] -d department repository
+       import.py --all [-d department] [-j WORKERS] [-r REPORT] DIR
+
+With --all every .authz file under DIR is imported. Files in a
+subdirectory of DIR use the subdirectory as the department, the others
+use -d. The repository name is the file name without .authz and without
+a leading department_, so DIR/its/its_sakai.authz becomes its/sakai.
 '''
 
+# Appended to the repository name to name its authz file.
+AUTHZ_SUFFIX = '.authz'
+
+# The section holding the group definitions.
+GROUPS_SECTION = 'groups'
 
 
 class Usage(Exception):
@@ -35,6 +53,27 @@ def get_params(argv=None):
                             dest='department',
                             default='its',
                             help='Department the repo belings to.'),
+                make_option('-q', '--quiet',
+                            action='store_true',
+                            dest='quiet',
+                            default=False,
+                            help="Don't print the groups and authorizations as they're read."),
+                make_option('-a', '--all',
+                            action='store_true',
+                            dest='all',
+                            default=False,
+                            help='Import every authz file in a directory.'),
+                make_option('-j', '--workers',
+                            type='int',
+                            dest='workers',
+                            default=None,
+                            help='How many files to import at once with --all.'),
+                make_option('-r', '--report',
+                            type='string',
+                            dest='report',
+                            default=None,
+                            help='Write a JSON report of an --all import to this file '
+                                 'instead of stdout.'),
                             ]
 
     parser = OptionParser(usage=help_message,
@@ -45,135 +84,292 @@ def get_params(argv=None):
     if not len(args) == 1:
         raise Usage('Incorrect number of arguments.')
 
-    return(args[0], options.department)
-
-
-def _get_chunks(lines):
-    chunk_indexes = []
-
-    i = 0
-    while i < len(lines):
-        if lines[i].startswith("["):
-            chunk_indexes.append(i)
-        i += 1
-
-    chunks = []
-    for i in range(len(chunk_indexes)):
-        if i == len(chunk_indexes) - 1:
-            chunks.append(lines[chunk_indexes[i]:])
-        else:
-            chunks.append(lines[chunk_indexes[i]:chunk_indexes[i+1]])
-
-    return chunks
-
-
-def _read_authorizations(repo):
-    if repo == None:
-        raise exception('No repository.')
+    return(args[0], options)
+
+
+def parse_authz(lines, repo_name=None):
+    '''
+    Read an authz file in one pass. lines is any iterable of lines, like
+    an open file, and is read one line at a time.
+
+    Yields (lineno, kind, value) tuples where kind is 'group' and value a
+    Group, kind is 'auth' and value an Auth, or kind is 'error' and value
+    a message about a line that couldn't be read.
+
+    Blank lines and lines starting with # or ; are skipped. Sections can
+    be [groups], [/path] or [repository:/path]. Sections naming another
+    repository than repo_name are reported and their rules skipped.
+
+    >>> for entry in parse_authz(['[groups]', 'devs = neil, amy',
+    ...                           '# a comment', '[sakai:/trunk]', '@devs = rw',
+    ...                           'neil = x']):
+    ...     print entry
+    (2, 'group', Group(devs, ['neil', 'amy']))
+    (5, 'auth', Auth(/trunk, @devs, rw))
+    (6, 'error', 'Invalid mode: x.')
+    '''
+    section = None
+    lineno = 0
+    for line in lines:
+        lineno += 1
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
 
-    try:
-        lines = open( repo.apache_authz, 'r').readlines()
-    except IOError:
-        raise Exception('_read_authz(): No configuration file found at %s' % repo.apache_authz)
+        if line.startswith('['):
+            if not line.endswith(']'):
+                section = None
+                yield lineno, 'error', 'Malformed section header: %s' % line
+                continue
+            section = line[1:-1].strip()
+            if section == GROUPS_SECTION:
+                continue
+            if ':' in section:
+                repo, section = section.split(':', 1)
+                if repo_name is not None and repo.strip() != repo_name:
+                    section = None
+                    yield lineno, 'error', 'Skipping the section for repository %s.' % repo
+                    continue
+            if not section.startswith('/'):
+                section = None
+                yield lineno, 'error', 'Unsupported section: %s' % line
+            continue
 
-    lines = filter(lambda l: not l.strip() == '', lines)
-    chunks = _get_chunks(lines)
+        if section is None:
+            continue
 
-    authorizations = []
-    print 'Authorizations:'
-    for chunk in chunks:
-        if chunk[0] == '[groups]':
+        try:
+            key, value = line.split('=', 1)
+        except ValueError:
+            yield lineno, 'error', 'Expected name = value: %s' % line
             continue
+        key = key.strip()
+        value = value.strip()
 
-        path = chunk[0]
-        path = path.replace('[','')
-        path = path.replace(']','')
-        path = path.strip()
-        for line in chunk[1:]:
-            try:
-                user, mode = line.split('=')
-                user = user.strip()
-                mode = mode.strip()
-            except ValueError:
-                print 'Malformed permission at %s. %s' % (line, e)
-                continue
+        if section == GROUPS_SECTION:
+            yield lineno, 'group', Group(key, [u.strip() for u in value.split(',')
+                                               if u.strip()])
+        else:
             try:
-                print 'Add Auth( %s, %s, %s )' % (path, user, mode)
-                authorizations.append( Auth(path, user, mode) )
+                yield lineno, 'auth', Auth(section, key, value)
             except ValueError, e:
-                print 'Malformed permission: %s. %s' % (line, e)
-
-    print ''
-
-    return authorizations
-
+                yield lineno, 'error', str(e)
 
-def _read_groups(repo):
-    if repo == None:
-        raise exception('No repository.')
 
+def read_authz(repo, filename=None, quiet=False):
+    '''
+    Set the groups and authorizations of repo from an authz file, by
+    default repo.apache_authz. Returns a list of (lineno, message) for
+    the lines that couldn't be read.
+    '''
+    if filename is None:
+        filename = repo.apache_authz
     try:
-        lines = open( repo.apache_authz, 'r').readlines()
+        f = open(filename, 'r')
     except IOError:
-        raise Exception('_read_authz(): No configuration file found at %s' % repo.apache_authz )
+        raise Exception('No configuration file found at %s' % filename)
 
     groups = []
+    authorizations = []
+    errors = []
+    try:
+        for lineno, kind, value in parse_authz(f, repo.name):
+            if kind == 'group':
+                if not quiet: print 'Group %s: %s' % (value.name, ', '.join(value.members))
+                groups.append(value)
+            elif kind == 'auth':
+                if not quiet: print 'Add Auth( %s, %s, %s )' % (value.path, value.user, value.mode)
+                authorizations.append(value)
+            else:
+                print >>sys.stderr, '%s:%d: %s' % (filename, lineno, value)
+                errors.append((lineno, value))
+    finally:
+        f.close()
 
-    lines = filter(lambda l: not l.strip() == '', lines)
-    chunks = _get_chunks(lines)
-
-    for chunk in chunks:
-        if chunk[0] == '[groups]':
-            print 'Groups:'
-            for line in chunk[1:]:
-                try:
-                    groupname, users = line.split("=")
-                except ValueError:
-                    continue
-                groupname = groupname.strip()
-                g_users = []
-                for u in users.split(","):
-                    u = u.strip()
-                    if not u == '': g_users.append(u)
-
-                print '%s: %s' % (groupname,  ', '.join(g_users))
-                groups.append(Group(groupname, g_users))
-            print ''
-
-    return groups
-
-if __name__ == "__main__":
-    name = None
-    department = None
+    repo.groups = groups
+    # Assign them all at once so the indexes are only built once.
+    repo.authorizations = authorizations
+    return errors
+
+
+def find_authz_files(directory, department):
+    """
+    Return a sorted list of (department, name, filename) for the authz
+    files in directory and its subdirectories.
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        if os.path.samefile(dirpath, directory):
+            prefix = department
+        else:
+            prefix = os.path.relpath(dirpath, directory).replace(os.sep, '/')
+        apache_prefix = prefix.replace('/', '_') + '_'
+        for filename in filenames:
+            if not filename.endswith(AUTHZ_SUFFIX):
+                continue
+            name = filename[:-len(AUTHZ_SUFFIX)]
+            if name.startswith(apache_prefix) and len(name) > len(apache_prefix):
+                name = name[len(apache_prefix):]
+            found.append((prefix, name, os.path.join(dirpath, filename)))
+    found.sort()
+    return found
+
+
+def _import_worker_init():
+    """Failures are collected in the report, keep the workers quiet."""
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+
+
+def _import_worker(job):
+    """
+    Import one authz file in a worker process and write its descriptor.
+    Returns the entry for the report and the Repository, or None if the
+    import failed.
+    """
+    prefix, name, filename = job
+    entry = {'repository': '%s/%s' % (prefix, name), 'file': filename}
     try:
-        name, department = get_params(sys.argv)
+        repo = Repository(prefix, name)
+        if os.path.exists(repo.yaml_path):
+            raise Exception('%s already has a descriptor.' % repo.path)
+        errors = read_authz(repo, filename, quiet=True)
+        descriptor.dump_file(repo, repo.yaml_path)
     except Exception, e:
-        print e
-        print help_message
-        sys.exit(1)
+        entry['error'] = str(e)
+        return entry, None
+
+    entry['groups'] = len(repo.groups)
+    entry['authorizations'] = len(repo.authorizations)
+    entry['skipped'] = [{'line': lineno, 'error': message} for lineno, message in errors]
+    return entry, repo
+
+
+def import_all(directory, department, workers=None, svn_client=None):
+    """
+    Import every authz file under directory with a pool of worker
+    processes, then add and commit all of the descriptors in one
+    revision. Returns the report as a dictionary.
+    """
+    import multiprocessing
+
+    jobs = find_authz_files(directory, department)
+    report = {'imported': [], 'failed': [], 'revision': None}
+    if not jobs:
+        return report
+
+    # The workers write into the department directories. Make them and
+    # add them to svn while they're still empty, so the sidecars the
+    # workers write next to the descriptors aren't added too.
+    if svn_client is None:
+        from repopy.svn import Client
+        svn_client = Client()
+    new_dirs = []
+    for prefix in sets.Set([prefix for prefix, name, filename in jobs]):
+        yaml_dir = os.path.join(config.YAML_ROOT, prefix)
+        if not os.path.exists(yaml_dir):
+            os.makedirs(yaml_dir)
+            svn_client.add(yaml_dir)
+            new_dirs.append(yaml_dir)
+
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(jobs)))
+    print >>sys.stderr, 'Importing %d authz files with %d workers.' % (len(jobs), workers)
+
+    repos = []
+    pool = multiprocessing.Pool(workers, _import_worker_init)
+    try:
+        for entry, repo in pool.imap_unordered(_import_worker, jobs):
+            if repo is None:
+                print >>sys.stderr, 'FAILED %s: %s' % (entry['file'], entry['error'])
+                report['failed'].append(entry)
+            else:
+                report['imported'].append(entry)
+                repos.append(repo)
+        pool.close()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.join()
+
+    report['imported'].sort(key=lambda entry: entry['repository'])
+    report['failed'].sort(key=lambda entry: entry['file'])
+    if not repos:
+        return report
+
+    repos.sort(key=lambda repo: repo.path)
+    paths = new_dirs[:]
+    for repo in repos:
+        # Adding a directory doesn't add files written into it later.
+        svn_client.add(repo.yaml_path)
+        paths.append(repo.yaml_path)
+    try:
+        rev = svn_client.checkin(paths, 'Add yaml descriptors after importing %d repositories.'
+                                        % len(repos))
+        if rev:
+            report['revision'] = rev.number
+    except Exception, e:
+        # The descriptors are written, so still catalog them. They can
+        # be committed by hand.
+        print >>sys.stderr, 'Unable to commit the yaml descriptors to SVN: %s' % e
+        report['commit_error'] = str(e)
+
+    Catalog().update(repos)
+    return report
 
-    repo = Repository(name, department)
-    repo.groups = _read_groups(repo)
-    repo.authorizations = _read_authorizations(repo)
+
+def import_one(name, department, quiet=False):
+    """Import the authz file of one repository and commit its descriptor."""
+    repo = Repository(department, name)
+    errors = read_authz(repo, quiet=quiet)
 
     try:
-        f = file(repo.yaml_path, 'w')
-        yaml.dump(repo, f)
-        f.close()
+        descriptor.dump_file(repo, repo.yaml_path)
     except Exception, e:
         raise Exception('Unable to dump %s to yaml: %s'  % (repo.name, e))
 
     try:
+        from repopy.svn import Client
         svn_client = Client()
         svn_client.add(repo.yaml_path)
         svn_client.checkin([repo.yaml_path], 'Add yaml descriptor after importing %s' % repo.name)
     except Exception, e:
         raise Exception('Unable to commit yaml descriptor to SVN: %s' % e)
 
+    Catalog().add(repo)
+
     print 'Import complete.'
     print 'Name: %s ' % repo.name
-    print 'Department: %s ' % repo.department
+    print 'Department: %s ' % repo.prefix
     print 'Authorizations imported: %d' % len(repo.authorizations)
     print 'Groups imported: %d' % len(repo.groups)
+    print 'Lines skipped: %d' % len(errors)
+
 
-    sys.exit(0)
+if __name__ == "__main__":
+    try:
+        arg, options = get_params(sys.argv)
+    except Exception, e:
+        print e
+        print help_message
+        sys.exit(1)
+
+    if not options.all:
+        import_one(arg, options.department, options.quiet)
+        sys.exit(0)
+
+    report = import_all(arg, options.department, options.workers)
+    if options.report:
+        f = open(options.report, 'w')
+    else:
+        f = sys.stdout
+    try:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    print >>sys.stderr, 'Imported %d repositories, %d failed.' % (len(report['imported']),
+                                                                 len(report['failed']))
+    sys.exit((report['failed'] or 'commit_error' in report) and 1 or 0)
@@ -0,0 +1,171 @@
+"""
+Answer "can USER read or write PATH?" for a repository without Apache.
+
+The authorizations and groups of a repository are compiled into a trie
+of path components. Groups are expanded to their members when the trie
+is built so a check is one walk down the trie with a dictionary lookup
+per level.
+
+The rules are the ones mod_authz_svn uses. Starting at the path being
+checked and moving towards /, the first section with a rule that
+matches the user decides. A rule matches if it names the user, a group
+the user is a member of, or *. If several rules in that section match
+the permissions are combined. If no section matches access is denied.
+"""
+
+READ = 1
+WRITE = 2
+
+# Permission bits to authz modes and back.
+_MODE_BITS = {'r': READ, 'rw': READ | WRITE, '': 0}
+_BITS_MODE = {0: '', READ: 'r', READ | WRITE: 'rw', WRITE: 'rw'}
+
+EVERYONE = '*'
+
+
+def split_path(path):
+    """
+    Split a path in a repository into its components.
+
+    >>> split_path('/')
+    []
+    >>> split_path('/trunk/src/')
+    ['trunk', 'src']
+    """
+    return [c for c in path.split('/') if c]
+
+
+class _Node(object):
+    """A section of the authz file."""
+
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        # user -> permission bits. None until the section has a rule.
+        self.rules = None
+
+
+class AccessChecker(object):
+    """A compiled set of authz rules for one repository."""
+
+    def __init__(self, authorizations, groups):
+        """
+        Compile authorizations, a list of Auth objects, and groups, a list
+        of Group objects, into a trie.
+        """
+        members = expand_groups(groups)
+        self.root = _Node()
+        for auth in authorizations:
+            node = self.root
+            for component in split_path(auth.path):
+                child = node.children.get(component)
+                if child is None:
+                    child = node.children[component] = _Node()
+                node = child
+
+            if node.rules is None:
+                node.rules = {}
+            bits = _MODE_BITS[auth.mode]
+            if auth.user.startswith('@'):
+                users = members.get(auth.user[1:], ())
+            else:
+                users = (auth.user,)
+            for user in users:
+                node.rules[user] = node.rules.get(user, 0) | bits
+
+    def bits(self, user, path):
+        """The permission bits user has on path."""
+        node = self.root
+        decided = self._match(node, user)
+        for component in split_path(path):
+            node = node.children.get(component)
+            if node is None:
+                break
+            matched = self._match(node, user)
+            if matched is not None:
+                decided = matched
+        return decided or 0
+
+    def _match(self, node, user):
+        rules = node.rules
+        if rules is None:
+            return None
+        user_bits = rules.get(user)
+        everyone_bits = rules.get(EVERYONE)
+        if user_bits is None:
+            return everyone_bits
+        if everyone_bits is None:
+            return user_bits
+        return user_bits | everyone_bits
+
+    def access(self, user, path):
+        """
+        The authz mode user has on path: 'rw', 'r' or '' for no access.
+        """
+        return _BITS_MODE[self.bits(user, path)]
+
+    def can_read(self, user, path):
+        return bool(self.bits(user, path) & READ)
+
+    def can_write(self, user, path):
+        return bool(self.bits(user, path) & WRITE)
+
+    def check_many(self, queries):
+        """
+        Check a batch of (user, path) queries. Returns a list with the
+        authz mode for each query in the same order.
+        """
+        results = []
+        seen = {}
+        for query in queries:
+            mode = seen.get(query)
+            if mode is None:
+                mode = seen[query] = self.access(*query)
+            results.append(mode)
+        return results
+
+
+def expand_groups(groups):
+    """
+    Map each group name to the users in it. Members of the form @name
+    are groups nested in the group.
+
+    >>> from repopy.repository import Group
+    >>> members = expand_groups([Group('a', ['u1', '@b']), Group('b', ['u2'])])
+    >>> members['a']
+    ['u1', 'u2']
+    """
+    by_name = dict([(g.name, g) for g in groups])
+    expanded = {}
+
+    def expand(name, seen):
+        if name in expanded:
+            return expanded[name]
+        users = []
+        group = by_name.get(name)
+        if group is not None:
+            for member in group.members:
+                if member.startswith('@'):
+                    if member[1:] not in seen:
+                        users.extend(expand(member[1:], seen + (member[1:],)))
+                elif member not in users:
+                    users.append(member)
+        return users
+
+    for name in by_name:
+        expanded[name] = expand(name, (name,))
+    return expanded
+
+
+def checker_for(repo):
+    """Compile the authorizations and groups of a Repository."""
+    return AccessChecker(repo.authorizations, repo.groups)
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
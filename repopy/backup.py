@@ -0,0 +1,234 @@
+"""
+Compressed backups of repositories.
+
+svnadmin dump is streamed straight through gzip or bzip2 into the backup
+file, so there is never an uncompressed copy of the dump on disk. The
+backup is written under a temporary name and renamed when it's complete,
+so a backup file that exists is always whole.
+
+Backups go in config.BACKUP_ROOT, one directory per prefix:
+
+    BACKUP_ROOT/its/sakai-20240101120000.svndump.gz
+    BACKUP_ROOT/its/sakai-20240101120000-r100-200.svndump.gz
+
+Reading a large repository as fast as possible can starve Apache of
+disk. config.BACKUP_RATE_LIMIT caps how many bytes per second of dump
+are read. backup_many shares the limit between its workers.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+import config
+
+from repository import _make_path
+
+def _open_gzip(path):
+    import gzip
+    return gzip.GzipFile(path, 'wb')
+
+def _open_bz2(path):
+    import bz2
+    return bz2.BZ2File(path, 'wb')
+
+# Compression name -> (file suffix, opener)
+COMPRESSION = {'gz': ('.svndump.gz', _open_gzip),
+               'bz2': ('.svndump.bz2', _open_bz2)}
+
+# How much of the dump is read at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+class BackupError(Exception):
+    pass
+
+
+class Throttle(object):
+    """Keeps a stream of bytes under a rate in bytes per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.time()
+        self.count = 0
+
+    def __call__(self, count):
+        """Account for count more bytes, sleeping if they came too fast."""
+        if not self.rate:
+            return
+        self.count += count
+        ahead = self.count / float(self.rate) - (time.time() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def parse_revision(revision):
+    """
+    Check a revision range for svnadmin dump -r: N or N:M.
+
+    >>> parse_revision('10:20')
+    '10:20'
+    >>> parse_revision('x')
+    Traceback (most recent call last):
+    ...
+    BackupError: Invalid revision range: x. Use N or N:M.
+    """
+    parts = revision.split(':')
+    if not (1 <= len(parts) <= 2 and [p for p in parts if p.isdigit()] == parts):
+        raise BackupError('Invalid revision range: %s. Use N or N:M.' % revision)
+    return revision
+
+
+def backup_path(repo, revision=None, compression='gz', when=None):
+    """Where the backup of repo taken at when is written."""
+    if when is None:
+        when = time.time()
+    filename = '%s-%s' % (repo.name, time.strftime('%Y%m%d%H%M%S', time.localtime(when)))
+    if revision:
+        filename += '-r' + revision.replace(':', '-')
+    return os.path.join(config.BACKUP_ROOT, repo.prefix,
+                        filename + COMPRESSION[compression][0])
+
+
+def backup(repo, revision=None, incremental=False, compression=None, rate=None):
+    """
+    Dump repo into a new compressed backup. revision is N or N:M to dump
+    only those revisions and incremental dumps the first of them as a
+    change from the one before instead of in full. rate defaults to
+    config.BACKUP_RATE_LIMIT.
+
+    Returns (path, bytes dumped, bytes written).
+    """
+    if compression is None:
+        compression = config.BACKUP_COMPRESSION
+    if compression not in COMPRESSION:
+        raise BackupError('Unknown compression: %s.' % compression)
+    if rate is None:
+        rate = config.BACKUP_RATE_LIMIT
+    if not os.path.isdir(repo.path_to_repo):
+        raise BackupError('There is no repository at %s.' % repo.path_to_repo)
+
+    args = [config.svnadmin(), 'dump', '--quiet']
+    if revision:
+        args += ['-r', parse_revision(revision)]
+    if incremental:
+        args.append('--incremental')
+    args.append(repo.path_to_repo)
+
+    path = backup_path(repo, revision, compression)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    # Don't replace a backup taken in the same second.
+    suffix = COMPRESSION[compression][0]
+    base, count = path[:-len(suffix)], 1
+    while os.path.exists(path):
+        path = '%s.%d%s' % (base, count, suffix)
+        count += 1
+    partial = path + '.partial'
+
+    throttle = Throttle(rate)
+    dumped = 0
+    # svnadmin's warnings go to a file, a pipe nobody reads until the
+    # dump is done could fill up and stall it.
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=errors,
+                               close_fds=True)
+    try:
+        out = COMPRESSION[compression][1](partial)
+        try:
+            while True:
+                data = process.stdout.read(CHUNK_SIZE)
+                if not data:
+                    break
+                out.write(data)
+                dumped += len(data)
+                throttle(len(data))
+        finally:
+            out.close()
+        if process.wait() != 0:
+            errors.seek(0)
+            error = errors.read()
+            raise BackupError('svnadmin dump of %s failed: %s' % (repo.path, error.strip()))
+        os.rename(partial, path)
+    except:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        errors.close()
+
+    return path, dumped, os.path.getsize(path)
+
+
+def _backup_worker_init(rate, compression):
+    global _worker_options
+    _worker_options = (rate, compression)
+
+def _backup_worker(repo_key):
+    """
+    Back up one repository in a worker process. Returns
+    (path, backup path, error).
+    """
+    from repository import Repository
+
+    prefix, name = repo_key
+    rate, compression = _worker_options
+    try:
+        path, dumped, written = backup(Repository(prefix, name),
+                                       compression=compression, rate=rate)
+    except Exception, e:
+        return _make_path(prefix, name), None, str(e).replace('\n', ' ')
+    return _make_path(prefix, name), path, None
+
+
+def backup_many(repo_keys, workers=None, compression=None, out=None):
+    """
+    Back up a list of (prefix, name) with a pool of worker processes,
+    printing progress to out as they finish. Returns a list of
+    (path, error) for the backups that failed.
+    """
+    import multiprocessing
+
+    if out is None:
+        out = sys.stdout
+    if not workers:
+        workers = config.BACKUP_WORKERS or multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(repo_keys)))
+    rate = config.BACKUP_RATE_LIMIT
+    if rate:
+        rate = rate / workers
+
+    print >>out, 'Backing up %d repositor%s with %d worker%s.' % \
+                (len(repo_keys), (len(repo_keys) == 1) and 'y' or 'ies',
+                 workers, (workers != 1) and 's' or '')
+    failures = []
+    pool = multiprocessing.Pool(workers, _backup_worker_init, (rate, compression))
+    try:
+        done = 0
+        for repo_path, path, error in pool.imap_unordered(_backup_worker, repo_keys):
+            done += 1
+            if error is None:
+                print >>out, '[%d/%d] %s -> %s' % (done, len(repo_keys), repo_path, path)
+            else:
+                print >>out, '[%d/%d] %s FAILED: %s' % (done, len(repo_keys), repo_path, error)
+                failures.append((repo_path, error))
+        pool.close()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.join()
+    return failures
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,111 @@
+"""
+An in-process cache of loaded repository descriptors.
+
+Entries are keyed by the path of the YAML descriptor and remember the
+mtime, size and inode the file had when it was read. A lookup stats the
+file and only returns the cached Repository if none of those changed, so
+an edit made by another session is always picked up.
+
+Memory is bounded by the total size of the cached YAML files. When the
+bound is exceeded the least recently used descriptors are dropped.
+"""
+
+import os
+import threading
+
+from collections import OrderedDict
+
+import config
+
+
+def _signature(path):
+    """What we check to see if a descriptor changed on disk."""
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+class DescriptorCache(object):
+    """A least recently used cache of Repository objects."""
+
+    def __init__(self, max_bytes=None):
+        """
+        Create a cache holding up to max_bytes of descriptors, measured by
+        the size of their YAML files. The default is
+        config.DESCRIPTOR_CACHE_BYTES. A bound of 0 disables the cache.
+        """
+        if max_bytes is None:
+            max_bytes = config.DESCRIPTOR_CACHE_BYTES
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.RLock()
+        # path -> (signature, repo). The most recently used is last.
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path):
+        """
+        Return the cached Repository for the descriptor at path or None if
+        it isn't cached or the file changed since it was cached.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(path, None)
+            if entry is None:
+                return None
+
+            signature, repo = entry
+            try:
+                current = _signature(path)
+            except OSError:
+                current = None
+            if current != signature:
+                self.size -= signature[1]
+                return None
+
+            self._entries[path] = entry
+            return repo
+        finally:
+            self._lock.release()
+
+    def put(self, path, repo):
+        """
+        Cache repo as the contents of the descriptor at path. Call this
+        right after the descriptor is read or written.
+        """
+        self._lock.acquire()
+        try:
+            self.discard(path)
+            try:
+                signature = _signature(path)
+            except OSError:
+                return
+            if signature[1] > self.max_bytes:
+                return
+
+            self._entries[path] = (signature, repo)
+            self.size += signature[1]
+            while self.size > self.max_bytes:
+                oldest, (oldest_signature, oldest_repo) = self._entries.popitem(last=False)
+                self.size -= oldest_signature[1]
+        finally:
+            self._lock.release()
+
+    def discard(self, path):
+        """Forget the descriptor at path."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.size -= entry[0][1]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
@@ -0,0 +1,257 @@
+"""
+An on-disk index of the repositories managed by svnsh.
+
+Listing repositories by walking REPO_ROOT means one listdir per prefix
+and another per repository. The catalog keeps the same information in a
+small SQLite database under YAML_ROOT so ls and info never have to touch
+the repository tree. create, delete and importrepo.py keep it current
+and the reindex command rebuilds it from disk.
+
+The catalog also keeps the authorizations and group members of every
+repository, indexed by user, so questions like "what can this user
+access?" or "who can write to this path?" don't have to load every
+descriptor. They're refreshed whenever a descriptor is saved.
+
+The database records the version of its schema. A catalog written by an
+older svnsh is rebuilt from disk the first time it's opened, so its
+tables are never trusted while they're missing information.
+"""
+
+import os
+import threading
+
+import config
+
+from repository import Repository, Auth, Group
+from access import EVERYONE
+
+# Directories under REPO_ROOT that never hold repositories.
+IGNORED_DIRS = ('bin', 'yaml', 'backup', '.svn')
+
+
+class Catalog(object):
+    """The repository catalog."""
+
+    # Bump this when SCHEMA or what's indexed changes.
+    SCHEMA_VERSION = 2
+
+    # Everything in the catalog can be rebuilt from disk.
+    DROP = """
+        DROP TABLE IF EXISTS users;
+        DROP TABLE IF EXISTS members;
+        DROP TABLE IF EXISTS grants;
+        DROP TABLE IF EXISTS repositories;
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS repositories (
+            prefix TEXT NOT NULL,
+            name TEXT NOT NULL,
+            fisheye INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (prefix, name)
+        );
+        CREATE TABLE IF NOT EXISTS grants (
+            prefix TEXT NOT NULL,
+            name TEXT NOT NULL,
+            path TEXT NOT NULL,
+            principal TEXT NOT NULL,
+            mode TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS grants_by_repository ON grants (prefix, name);
+        CREATE INDEX IF NOT EXISTS grants_by_principal ON grants (principal);
+        CREATE TABLE IF NOT EXISTS members (
+            prefix TEXT NOT NULL,
+            name TEXT NOT NULL,
+            grp TEXT NOT NULL,
+            user TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS members_by_repository ON members (prefix, name);
+        CREATE INDEX IF NOT EXISTS members_by_user ON members (user);
+    """
+
+    def __init__(self, path=None):
+        """
+        Create a catalog stored at path. The default is config.CATALOG_PATH.
+        The database is opened on first use. If it doesn't exist yet, or
+        an older svnsh wrote it, it is built from the repositories on
+        disk. Each thread gets its own connection to the database.
+        """
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            path = self.path or config.CATALOG_PATH
+            conn = self._local.conn = sqlite3.connect(path)
+            conn.text_factory = str
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                # New or written by an older svnsh.
+                conn.executescript(self.DROP + self.SCHEMA)
+                self.rebuild()
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def add(self, repo):
+        """Add or update a repository."""
+        self.update([repo])
+
+    def update(self, repos):
+        """Add or update several repositories at once."""
+        conn = self._connect()
+        for repo in repos:
+            self._add(conn, repo)
+        conn.commit()
+
+    def _add(self, conn, repo):
+        conn.execute('INSERT OR REPLACE INTO repositories VALUES (?, ?, ?)',
+                     (repo.prefix, repo.name, int(bool(repo.fisheye))))
+        for table in ('grants', 'members'):
+            conn.execute('DELETE FROM %s WHERE prefix = ? AND name = ?' % table,
+                         (repo.prefix, repo.name))
+        conn.executemany('INSERT INTO grants VALUES (?, ?, ?, ?, ?)',
+                         [(repo.prefix, repo.name, a.path, a.user, a.mode)
+                          for a in repo.authorizations])
+        conn.executemany('INSERT INTO members VALUES (?, ?, ?, ?)',
+                         [(repo.prefix, repo.name, g.name, member)
+                          for g in repo.groups for member in g.members])
+
+    def remove(self, prefix, name):
+        """Remove a repository. Unknown repositories are ignored."""
+        conn = self._connect()
+        for table in ('repositories', 'grants', 'members'):
+            conn.execute('DELETE FROM %s WHERE prefix = ? AND name = ?' % table,
+                         (prefix or '', name))
+        conn.commit()
+
+    def repositories_for_user(self, user):
+        """
+        A sorted list of (prefix, name) for the repositories user appears
+        in, directly or through a group.
+        """
+        rows = self._connect().execute(
+                'SELECT prefix, name FROM grants WHERE principal = ? '
+                'UNION SELECT prefix, name FROM members WHERE user = ? '
+                'ORDER BY 1, 2', (user, user))
+        return [tuple(row) for row in rows]
+
+    def repositories_visible_to(self, user):
+        """
+        A sorted list of (prefix, name) for the repositories where user
+        might have access: those they appear in and those with a rule
+        for everyone.
+        """
+        rows = self._connect().execute(
+                'SELECT prefix, name FROM grants WHERE principal IN (?, ?) '
+                'UNION SELECT prefix, name FROM members WHERE user = ? '
+                'ORDER BY 1, 2', (user, EVERYONE, user))
+        return [tuple(row) for row in rows]
+
+    def rules(self, prefix, name):
+        """
+        The authorizations and groups of a repository as they were when
+        it was last saved, as a tuple of a list of Auths and a list of
+        Groups.
+        """
+        conn = self._connect()
+        authorizations = [Auth(path, principal, mode) for path, principal, mode in
+                          conn.execute('SELECT path, principal, mode FROM grants '
+                                       'WHERE prefix = ? AND name = ?',
+                                       (prefix or '', name))]
+        groups = {}
+        for grp, user in conn.execute('SELECT grp, user FROM members '
+                                      'WHERE prefix = ? AND name = ?',
+                                      (prefix or '', name)):
+            groups.setdefault(grp, []).append(user)
+        return authorizations, [Group(grp, users) for grp, users in groups.items()]
+
+    def get(self, prefix, name):
+        """
+        Return (prefix, name, fisheye) for a repository or None if it
+        isn't in the catalog.
+        """
+        row = self._connect().execute(
+                'SELECT prefix, name, fisheye FROM repositories '
+                'WHERE prefix = ? AND name = ?', (prefix or '', name)).fetchone()
+        if row is None:
+            return None
+        return (row[0], row[1], bool(row[2]))
+
+    def prefixes(self):
+        """A sorted list of the prefixes in use."""
+        rows = self._connect().execute(
+                'SELECT DISTINCT prefix FROM repositories ORDER BY prefix')
+        return [row[0] for row in rows]
+
+    def repositories(self, prefix=None):
+        """
+        A sorted list of (prefix, name, fisheye) tuples for all
+        repositories or only those with the given prefix.
+        """
+        conn = self._connect()
+        if prefix is None:
+            rows = conn.execute('SELECT prefix, name, fisheye FROM repositories '
+                                'ORDER BY prefix, name')
+        else:
+            rows = conn.execute('SELECT prefix, name, fisheye FROM repositories '
+                                'WHERE prefix = ? ORDER BY name',
+                                (prefix.strip('/'),))
+        return [(p, n, bool(f)) for p, n, f in rows]
+
+    def rebuild(self, root=None):
+        """
+        Replace the contents of the catalog with the repositories found
+        under root (config.REPO_ROOT by default). The descriptor of each
+        repository is loaded to index its authorizations and groups.
+        Returns the number of repositories found.
+        """
+        import descriptor
+
+        conn = self._connect()
+        for table in ('repositories', 'grants', 'members'):
+            conn.execute('DELETE FROM %s' % table)
+        count = 0
+        for prefix, name, fisheye in scan(root):
+            repo = Repository(prefix, name, bool(fisheye))
+            if os.path.exists(repo.yaml_path):
+                try:
+                    repo = descriptor.load_file(repo.yaml_path)
+                except Exception, e:
+                    print 'Unable to load the descriptor for %s: %s' % (repo.path, e)
+            self._add(conn, repo)
+            count += 1
+        conn.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+        conn.commit()
+        return count
+
+
+def scan(root=None):
+    """
+    Walk the repository tree and yield (prefix, name, fisheye) for every
+    repository one level below a prefix directory. A repository has
+    fisheye turned on if its fisheye auth file exists.
+    """
+    if root is None:
+        root = config.REPO_ROOT
+    if not os.path.isdir(root):
+        return
+
+    prefixes = [p for p in os.listdir(root) if p not in IGNORED_DIRS]
+    prefixes.sort()
+    for prefix in prefixes:
+        prefix_dir = os.path.join(root, prefix)
+        if not os.path.isdir(prefix_dir):
+            continue
+        names = os.listdir(prefix_dir)
+        names.sort()
+        for name in names:
+            if Repository.exists(os.path.join(prefix_dir, name)):
+                repo = Repository(prefix, name)
+                yield (prefix, name, int(os.path.exists(repo.fisheye_auth_path)))
@@ -2,24 +2,24 @@ import sys
 import optparse
 import new
 import exceptions
-import logging
 import os
-import shutil
-import tarfile
 import operator
+import csv
+import sets
+import time
+import copy
 
-import yaml
-
-from getpass import getpass
 from optparse import OptionParser, make_option
 
 import config
+import fileio
 
-from repository import Repository, Auth, Group
+from repository import Repository, Auth, Group, _make_path
+from catalog import Catalog
+from cache import DescriptorCache
+from access import AccessChecker, checker_for, split_path
 from templates import apache_conf
 from utils import addauth_email
-from svn import Client
-from fisheye import FisheyeAdmin
 from errors import CommandError, CommandArgumentError, CommandOptionError
 
 class CommandOptionParser(OptionParser):
@@ -74,9 +74,12 @@ def __check_path_dir(repo):
 
 def __write_repository_yaml(repo):
     try:
-        f = file(repo.yaml_path, 'w')
-        yaml.dump(repo, f)
-        f.close()
+        import descriptor
+        descriptor.dump_file(repo, repo.yaml_path)
+        # Inside a batch the file isn't in place yet, the old entry is
+        # already wrong and the new one has to wait.
+        descriptor_cache.discard(repo.yaml_path)
+        fileio.after_commit(descriptor_cache.put, repo.yaml_path, repo)
         print 'Wrote yaml descriptor for %s.' % repo.name
     except Exception, e:
         raise CommandError('Unable to dump %s to yaml: %s.'  % (repo.name, e))
@@ -105,9 +108,7 @@ def __write_repository_fisheyeauth(repo):
                 users.append(auth.user)
 
     try:
-        f = file(repo.fisheye_auth_path, 'w')
-        f.write('\n'.join(users) + '\n')
-        f.close()
+        fileio.write_file(repo.fisheye_auth_path, '\n'.join(users) + '\n')
         print 'Wrote fisheye auth file for %s.' % repo.name
     except Exception, e:
         raise CommandError('Unable to save fisheye auth: %s.'  % (e))
@@ -122,10 +123,97 @@ def __write_authz(repo):
     except Error, e:
         raise CommandError( "Error writing the authz file: %s." % e)
 
+def __apache_conf_data(repo):
+    return {'repopath' : repo.path,
+            'users' : ', '.join(repo.users()),
+            'apache_authz_path' : repo.apache_authz}
+
+def __write_apache_conf(repo):
+    """Write the apache conf for repo. Returns True if it changed."""
+    return apache_conf.process_to_file(repo.apache_conf, __apache_conf_data(repo))
+
+def __write_artifacts(repo, force=False, apache=False):
+    """
+    Write out the descriptor, fisheye auth and authz for repo, and the
+    apache conf too with apache, skipping the ones whose inputs haven't
+    changed since they were last written. force writes them all. See
+    repopy.manifest. Returns the names of the files that were written:
+    yaml, fisheyeauth, authz and conf.
+    """
+    import manifest as manifests
+
+    manifest = manifests.Manifest(repo.yaml_path)
+    digests = manifests.digests(repo)
+    artifacts = [('yaml', repo.yaml_path, __write_repository_yaml),
+                 ('fisheyeauth', repo.fisheye_auth_path, __write_repository_fisheyeauth),
+                 ('authz', repo.apache_authz, __write_authz)]
+    if apache:
+        digests['conf'] = manifests.template_digest(apache_conf, __apache_conf_data(repo))
+        artifacts.append(('conf', repo.apache_conf, __write_apache_conf))
+
+    written = []
+    # The files go in place together once they're all written.
+    fileio.begin()
+    try:
+        try:
+            for name, path, write in artifacts:
+                if name == 'fisheyeauth' and not repo.fisheye:
+                    manifest.forget(name)
+                    continue
+                if force or manifest.stale(name, digests[name], path):
+                    # The apache conf is only rewritten if its text changed.
+                    if write(repo) is not False:
+                        written.append(name)
+                    manifest.record(name, digests[name])
+        finally:
+            try:
+                manifest.save()
+            except (IOError, OSError), e:
+                print 'Unable to save the manifest for %s: %s' % (repo.path, e)
+    except:
+        fileio.abort()
+        raise
+    fileio.commit()
+    return written
+
+def __reload_apache(changed):
+    """
+    Gracefully reload apache if any apache confs changed. The authz files
+    are read on each request, so they don't need a reload.
+    """
+    if not changed:
+        return
+    if not config.APACHE_RELOAD:
+        print 'Reload apache to pick up %d changed conf%s.' % \
+                    (len(changed), (len(changed) != 1) and 's' or '')
+        return
+    from repository import _run_args
+    try:
+        _run_args(config.APACHE_RELOAD)
+        print 'Reloaded apache.'
+    except Exception, e:
+        print 'Unable to reload apache, please do it by hand: %s' % \
+                    (str(e).strip() or '%s failed' % ' '.join(config.APACHE_RELOAD))
+
 
 ###############################################################################
 # SVN YAML functions.
-svn_client = Client()
+
+class _LazyClient(object):
+    """
+    Stands in for the svn Client until it's used. Importing pysvn and
+    creating the client is left until a command needs it.
+    """
+    def __init__(self):
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            from svn import Client
+            self._client = Client()
+        return getattr(self._client, name)
+
+svn_client = _LazyClient()
 
 def __add_yaml(repo):
     """Add a YAML file to the SVN repository that logs our transactions."""
@@ -137,16 +225,149 @@ def __add_yaml(repo):
 
 def __checkin_yaml(repo, message):
     """Commit the YAML to the SVN repository that logs our transactions."""
+    __checkin_yamls([repo], message)
+
+
+def __checkin_yamls(repos, message, dirs=()):
+    """
+    Commit the YAML for several repositories in one revision, along with
+    any newly added directories they're in.
+    """
+    paths = list(dirs) + [repo.yaml_path for repo in repos]
     try:
-        rev = svn_client.checkin([repo.yaml_path], message)
+        rev = svn_client.checkin(paths, message)
         if not rev:
-            print 'Nothing to commit for %s.' % repo.yaml_path
+            print 'Nothing to commit for %s.' % ', '.join(paths)
         else:
-            print 'Descriptor for %s commited. Repository at revision %d.' % \
-                                                    (repo.path, rev.number)
+            print 'Descriptor%s for %s commited. Repository at revision %d.' % \
+                            ((len(repos) > 1) and 's' or '',
+                             ', '.join([repo.path for repo in repos]), rev.number)
     except Exception, e:
         raise CommandError('Error committing the yaml descriptor: %s.' % e)
 
+###############################################################################
+# Transactions.
+#
+# Between begin and commit the mutating commands edit the repositories in
+# memory. Each touched repository is written out once when the transaction
+# is committed and all of the descriptors are checked in together. A
+# command that fails leaves the transaction as it was before it ran.
+
+class Transaction(object):
+    """The repositories changed since begin and what was done to them."""
+
+    def __init__(self):
+        # yaml path -> Repository
+        self.repositories = {}
+        self.messages = []
+        # (user, repo, path, mode) for addauth_email once committed.
+        self.emails = []
+        # What the transaction was before the running command, see undo.
+        self.saved = ({}, 0, 0)
+        # yaml path -> copy of a repository before the running command
+        # changed it.
+        self.before = {}
+
+    def add(self, repo, message):
+        self.repositories[repo.yaml_path] = repo
+        self.messages.append(message)
+
+    def start(self):
+        """Note where the transaction is as a command starts."""
+        self.saved = (dict(self.repositories), len(self.messages), len(self.emails))
+        self.before = {}
+
+    def get(self, yaml_path):
+        """
+        The repository at yaml_path changed by the transaction, or None.
+        A copy is kept the first time each command gets it so a failed
+        command can be undone.
+        """
+        repo = self.repositories.get(yaml_path)
+        if repo is not None and yaml_path not in self.before:
+            self.before[yaml_path] = copy.deepcopy(repo)
+        return repo
+
+    def undo(self):
+        """Throw away what the command that's failed did."""
+        repositories, messages, emails = self.saved
+        self.repositories = repositories
+        for yaml_path, repo in self.before.items():
+            if yaml_path in repositories:
+                repositories[yaml_path] = repo
+        del self.messages[messages:]
+        del self.emails[emails:]
+        self.before = {}
+
+    def repos(self):
+        repos = self.repositories.values()
+        repos.sort(key=operator.attrgetter('path'))
+        return repos
+
+__transaction = None
+
+def in_transaction():
+    """Is there an open transaction?"""
+    return __transaction is not None
+
+def current_transaction():
+    """The open Transaction or None."""
+    return __transaction
+
+def __save_repository(repo, message):
+    """
+    Write out the descriptor, fisheye auth and authz for a repository and
+    commit the descriptor. Inside a transaction the repository is only
+    recorded and written when the transaction is committed.
+    """
+    if __transaction is not None:
+        __transaction.add(repo, message)
+        print 'Recorded in the transaction: %s' % message
+        return
+
+    __write_artifacts(repo)
+    __update_catalog([repo])
+    __checkin_yaml(repo, message)
+
+def __save_repositories(repos, message):
+    """Write out several repositories and commit them in one revision."""
+    # Sync the files once for all of the repositories.
+    fileio.begin()
+    try:
+        for repo in repos:
+            __write_artifacts(repo)
+    except:
+        fileio.abort()
+        raise
+    fileio.commit()
+    __update_catalog(repos)
+    __checkin_yamls(repos, message)
+
+def __update_catalog(repos):
+    """
+    Record the saved repositories in the catalog. The descriptors are
+    already written so a failure here is only reported.
+    """
+    try:
+        catalog.update(repos)
+    except Exception, e:
+        print 'Unable to update the catalog: %s. Run reindex to fix it.' % e
+
+def __notify_addauth(user, repo, path, mode):
+    """Send the addauth email now or when the transaction is committed."""
+    if __transaction is not None:
+        __transaction.emails.append((user, repo, path, mode))
+    else:
+        addauth_email(user, repo, path, mode)
+
+###############################################################################
+# The repository catalog used by ls and info.
+catalog = Catalog()
+
+# Descriptors loaded in this session. Commands edit the cached objects in
+# place so the cache is cleared whenever a command fails part way.
+descriptor_cache = DescriptorCache()
+
 ###############################################################################
 # Functions that deal with reading in YAML and parsing args.
 def __parse_prefix_name(path):
@@ -174,16 +395,29 @@ def __parse_prefix_name(path):
 
 def __load_repository_from_yaml(prefix, name):
     """
-    Load a repository given the name and prefix.
+    Load a repository given the name and prefix. Inside a transaction
+    the repository already changed by the transaction is returned.
+    Otherwise the cached repository is used if the descriptor hasn't
+    changed since it was loaded.
     Raises a CommandError exception if an error occurs.
     """
+    yaml_path = os.path.join(config.YAML_ROOT, prefix, name + '.yaml')
+    if __transaction is not None:
+        repo = __transaction.get(yaml_path)
+        if repo is not None:
+            return repo
+
+    repo = descriptor_cache.get(yaml_path)
+    if repo is not None:
+        return repo
+
     try:
-        repo = yaml.load( open(os.path.join(config.YAML_ROOT,
-                                      prefix,
-                                      name + '.yaml'), 'r').read() )
+        import descriptor
+        repo = descriptor.load_file(yaml_path)
     except Exception, e:
         raise CommandError('There was an error loading the repository description.',
                            'The original error was: %s' % e)
+    descriptor_cache.put(yaml_path, repo)
     return repo
 
 ###############################################################################
@@ -241,15 +475,213 @@ class Command (object):
         (options, args) = self.parser.parse_args(args=argv)
         if self.arg_count and not self.arg_count.validate(args):
             raise CommandArgumentError('Incorrect number of arguments.\n')
-        self._run(options, args)
+        transaction = current_transaction()
+        if transaction is not None:
+            transaction.start()
+        try:
+            self._run(options, args)
+        except:
+            # The command may have changed cached repositories, or ones in
+            # the transaction, before it failed.
+            descriptor_cache.clear()
+            if transaction is not None and current_transaction() is transaction:
+                transaction.undo()
+            raise
 
 ###############################################################################
+def __read_create_batch(filename, fisheye):
+    """
+    Read repo[,fisheye[,description]] rows from filename, or stdin if
+    filename is -. fisheye is yes or no and defaults to the -f option.
+    Blank lines and lines starting with # are skipped.
+
+    Returns a list of (lineno, Repository, description) and a list of
+    (line number, error) for rows that couldn't be used.
+    """
+    if filename == '-':
+        f = sys.stdin
+    else:
+        try:
+            f = open(filename, 'rb')
+        except IOError, e:
+            raise CommandError('Unable to open %s: %s.' % (filename, e))
+
+    entries = []
+    errors = []
+    seen = sets.Set()
+    try:
+        reader = csv.reader(f, skipinitialspace=True)
+        try:
+            for row in reader:
+                lineno = reader.line_num
+                row = [field.strip() for field in row]
+                if not row or not row[0] or row[0].startswith('#'):
+                    continue
+                if len(row) > 3:
+                    errors.append((lineno, 'Expected repo[,fisheye[,description]] '
+                                           'but found %d fields.' % len(row)))
+                    continue
+                row += [''] * (3 - len(row))
+                repo_name, repo_fisheye, description = row
+
+                if not repo_fisheye:
+                    repo_fisheye = fisheye
+                elif repo_fisheye.lower() in ('yes', 'y', 'true', '1'):
+                    repo_fisheye = True
+                elif repo_fisheye.lower() in ('no', 'n', 'false', '0'):
+                    repo_fisheye = False
+                else:
+                    errors.append((lineno, 'Expected yes or no for fisheye: %s.' % repo_fisheye))
+                    continue
+
+                prefix, name = __parse_prefix_name(repo_name)
+                repo = Repository(prefix, name, repo_fisheye)
+                if repo.path in seen:
+                    errors.append((lineno, '%s is listed more than once.' % repo.path))
+                    continue
+                seen.add(repo.path)
+                if Repository.exists(repo.path_to_repo):
+                    errors.append((lineno, 'A repository named "%s" already exists.' % repo.path))
+                    continue
+                entries.append((lineno, repo, description or repo.path))
+        except csv.Error, e:
+            errors.append((reader.line_num, 'Unable to parse the line: %s.' % e))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    return entries, errors
+
+def __create_timed(repo):
+    """Create a repository on disk. Returns (repo, seconds, error)."""
+    start = time.time()
+    try:
+        repo.create()
+    except Exception, e:
+        return repo, time.time() - start, str(e).strip()
+    return repo, time.time() - start, None
+
+def __create_many(filename, fisheye, workers):
+    """
+    Create the repositories listed in filename. The svnadmin create and
+    ownership fix up for each repository run on a bounded pool of
+    threads. The descriptors, apache configs and catalog are then
+    written one repository at a time and all of the descriptors are
+    committed in one revision.
+
+    Returns the number of rows that failed.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    entries, errors = __read_create_batch(filename, fisheye)
+    if not entries:
+        for lineno, error in errors:
+            print 'Line %d: %s' % (lineno, error)
+        return len(errors)
+
+    # Make the directories up front so the workers don't race to. New
+    # YAML directories are added now, while empty, so the sidecars aren't
+    # added with them, and committed with the descriptors.
+    new_dirs = []
+    for lineno, repo, description in entries:
+        yaml_dir = os.path.dirname(repo.yaml_path)
+        repo_dir = os.path.dirname(repo.path_to_repo)
+        try:
+            if not os.path.exists(yaml_dir):
+                os.makedirs(yaml_dir)
+                svn_client.add(yaml_dir)
+                new_dirs.append(yaml_dir)
+            if not os.path.exists(repo_dir):
+                os.makedirs(repo_dir)
+        except Exception, e:
+            raise CommandError('Error creating directories for %s: %s' % (repo.path, e))
+    # Find svnadmin once, before the workers start.
+    config.svnadmin()
+
+    if not workers:
+        workers = config.CREATE_WORKERS
+    workers = max(1, min(workers, len(entries)))
+    print 'Creating %d repositor%s with %d worker%s.' % \
+                (len(entries), (len(entries) == 1) and 'y' or 'ies',
+                 workers, (workers != 1) and 's' or '')
+
+    descriptions = dict([(repo.path, (lineno, description))
+                         for lineno, repo, description in entries])
+    created = []
+    start = time.time()
+    pool = ThreadPool(workers)
+    try:
+        for repo, seconds, error in pool.imap_unordered(__create_timed,
+                                                        [repo for l, repo, d in entries]):
+            if error is None:
+                print '%s created in %.2fs.' % (repo.path, seconds)
+                created.append(repo)
+            else:
+                print '%s FAILED after %.2fs: %s' % (repo.path, seconds, error)
+                errors.append((descriptions[repo.path][0], error))
+        pool.close()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.join()
+
+    created.sort(key=operator.attrgetter('path'))
+    fileio.begin()
+    try:
+        changed = apache_conf.render_many([(repo.apache_conf, __apache_conf_data(repo))
+                                           for repo in created])
+        for repo in created:
+            __write_repository_yaml(repo)
+            if repo.fisheye:
+                __write_repository_fisheyeauth(repo)
+    except:
+        fileio.abort()
+        raise
+    fileio.commit()
+
+    for repo in created:
+        if repo.fisheye:
+            try:
+                from fisheye import admin
+                admin().create_repository(repo, descriptions[repo.path][1])
+            except Exception, e:
+                print 'Unable to create a fisheye instance for %s: %s' % (repo.path, e)
+
+    if created:
+        __update_catalog(created)
+        # Adding a directory doesn't add files written into it later.
+        for repo in created:
+            __add_yaml(repo)
+        __checkin_yamls(created, 'Create repositories from %s: %s.' %
+                                    (filename, ', '.join([repo.path for repo in created])),
+                        new_dirs)
+    __reload_apache(changed)
+
+    errors.sort()
+    for lineno, error in errors:
+        print 'Line %d: %s' % (lineno, error)
+    print 'Created %d repositor%s in %.2fs.' % (len(created), (len(created) == 1) and 'y' or 'ies',
+                                                time.time() - start)
+    return len(errors)
+
 def _run_create(self, options, args):
     """
     Create the repository.
     Save the yaml descriptor.
     """
 
+    if options.batch:
+        if args:
+            raise CommandArgumentError('create --batch takes no other arguments.\n')
+        errors = __create_many(options.batch, options.fisheye, options.workers)
+        if errors:
+            raise CommandError('%d row%s of %s could not be created.' %
+                               (errors, (errors != 1) and 's' or '', options.batch))
+        return
+
+    if len(args) != 1:
+        raise CommandArgumentError('Incorrect number of arguments.\n')
     prefix, name = __parse_prefix_name(args[0])
     print "Name = %s" % name
     if prefix:
@@ -262,44 +694,65 @@ def _run_create(self, options, args):
     try:
         __check_path_dir(repo)
         print 'Creating the repository ...'
+        start = time.time()
         repo.create()
-        print 'Created the repository'
+        print 'Created the repository in %.2fs.' % (time.time() - start)
         print repo.apache_conf
-        apache_conf.process_to_file(repo.apache_conf,
-                                    {'repopath' : repo.path,
-                                     'users' : ', '.join(repo.users()),
-                                     'apache_authz_path' : repo.apache_authz})
+        __write_apache_conf(repo)
         print "Created apache conf"
         __write_repository_yaml(repo)
         print "CREATED repository at %s." % repo.path
 
         if options.fisheye:
             __write_repository_fisheyeauth(repo)
-            fisheye_admin = FisheyeAdmin(password=config.FISHEYE_ADMIN_PW)
-            if fisheye_admin.create_repository(repo, __get_description()):
+            from fisheye import admin
+            if admin().create_repository(repo, __get_description()):
                 print "Successfully created a fisheye instance for %s" % repo.name
 
     except Exception, e:
         raise CommandError("Failed to create the repository at %s\n" % repo.path_to_repo,
                            "The original error was: %s: %s" % (type(e), e))
 
+    __update_catalog([repo])
     __add_yaml(repo)
     __checkin_yaml(repo, ('Create repository: %s.' % (repo.path_to_repo)))
+    __reload_apache([repo.apache_conf])
 
 
 create = Command(name='create',
-                 usage='create path/name',
+                 usage='create [-f] path/name | create [-f] [-j N] --batch FILE',
                  description='create: Create a new Subversion repository.',
                  options = [ make_option('-f', '--fisheye',
                                action='store_true',
                                dest='fisheye',
                                default=False,
-                               help='Enable fisheye access to the new repository.') ],
+                               help='Enable fisheye access to the new repository.'),
+                             make_option('--batch',
+                               dest='batch',
+                               metavar='FILE',
+                               default=None,
+                               help='Create the repositories in the repo[,fisheye[,description]] '
+                                    'rows of FILE (- for stdin).'),
+                             make_option('-j', '--workers',
+                               type='int',
+                               dest='workers',
+                               default=None,
+                               help='How many repositories --batch creates at once.') ],
                  run=_run_create,
-                 arg_count=ArgumentCount(1)
+                 arg_count=ArgumentCount(0, operator.ge)
                  )
 ###############################################################################
 
+def __confirm(prompt):
+    """Ask a yes or no question. No input at all counts as no."""
+    try:
+        answer = raw_input('>>> %s y/n ' % prompt).lower().strip()
+        while answer not in ('y', 'yes', 'n', 'no'):
+            answer = raw_input('>>> %s y/n ' % prompt).lower().strip()
+    except EOFError:
+        return False
+    return answer in ('y', 'yes')
+
 def _run_delete(self, options, args):
     """ Backup and delete the repository"""
 
@@ -308,41 +761,282 @@ def _run_delete(self, options, args):
     if prefix: print "Prefix = %s" % prefix
     print ''
 
+    if in_transaction():
+        raise CommandError('Commit or roll back the open transaction before deleting a repository.')
+
     repo = __load_repository_from_yaml(prefix,name)
 
-    print 'We do this by hand.'
-    print 'Delete the apache files:'
-    print repo.apache_authz
-    print repo.apache_conf
-    print ''
+    if not options.yes and not __confirm("Back up and delete %s? This can't be undone." % repo.path):
+        print 'Not deleting %s.' % repo.path
+        return
 
-    print 'Delete the yaml descriptor:'
-    print repo.yaml_path
-    print ''
+    import backup as backups
+    print 'Backing up %s ...' % repo.path
+    start = time.time()
+    try:
+        backup_path, dumped, written = backups.backup(repo)
+    except Exception, e:
+        raise CommandError('Unable to back up %s, nothing was deleted: %s' % (repo.path, e))
+    print 'Backed up %s to %s (%d bytes, %d compressed) in %.2fs.' % \
+                (repo.path, backup_path, dumped, written, time.time() - start)
 
     if repo.fisheye:
-        print 'Delete the fisheye auth file.'
-        print repo.fisheye_auth_path
+        try:
+            from fisheye import admin
+            if admin().delete_repository(repo):
+                print "Deleted the fisheye instance for %s." % repo.name
+            else:
+                print "Failed to delete the fisheye instance for %s. Please do it by hand." % repo.name
+        except Exception, e:
+            print "Failed to delete the fisheye instance for %s: %s. Please do it by hand." % (repo.name, e)
 
-    print 'Tar up the repository:'
-    print 'tar czvf %s.tgz %s' % (repo.name, repo.path_to_repo)
-    print ''
+    try:
+        repo.delete()
+    except Exception, e:
+        raise CommandError('Error deleting %s: %s' % (repo.path_to_repo, e),
+                           'It was backed up to %s.' % backup_path)
+    print 'Deleted %s and its apache files.' % repo.path_to_repo
+
+    import descriptor
+    import manifest
+    for path in (repo.fisheye_auth_path, descriptor.sidecar_path(repo.yaml_path),
+                 manifest.manifest_path(repo.yaml_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    descriptor_cache.discard(repo.yaml_path)
+    catalog.remove(repo.prefix, repo.name)
+    print 'Removed %s from the catalog.' % repo.path
+
+    try:
+        svn_client.remove(repo.yaml_path)
+    except Exception, e:
+        raise CommandError('Error removing the yaml descriptor: %s.' % e)
+    if os.path.exists(repo.yaml_path):
+        os.remove(repo.yaml_path)
+    __checkin_yamls([repo], 'Delete repository: %s. Backed up to %s.' % (repo.path, backup_path))
 
-    print 'Restart apache.'
+    __reload_apache([repo.apache_conf])
 
 
 delete = Command(name='delete',
-                 usage='delete path/name',
+                 usage='delete [-y] path/name',
                  description='delete: Backup and remove Subversion repository.',
-                 options = [ ],
+                 options = [ make_option('-y', '--yes',
+                               action='store_true',
+                               dest='yes',
+                               default=False,
+                               help="Don't ask before deleting.") ],
                  run=_run_delete,
                  arg_count=ArgumentCount(1)
                  )
 ###############################################################################
 
+def _run_backup(self, options, args):
+    """Write compressed backups of repositories."""
+    import backup as backups
+
+    if options.all:
+        if args:
+            raise CommandArgumentError('backup --all takes no other arguments.\n')
+        if options.revision or options.incremental:
+            raise CommandArgumentError('backup --all makes full backups only.\n')
+        repo_keys = [(prefix, name) for prefix, name, fisheye in catalog.repositories()]
+        if not repo_keys:
+            print 'There are no repositories to back up.'
+            return
+        failures = backups.backup_many(repo_keys, options.workers, options.compression)
+        print 'Backed up %d of %d repositories.' % (len(repo_keys) - len(failures),
+                                                    len(repo_keys))
+        if failures:
+            raise CommandError('%d backup%s failed.' % (len(failures),
+                                                        (len(failures) != 1) and 's' or ''))
+        return
+
+    if len(args) != 1:
+        raise CommandArgumentError('Incorrect number of arguments.\n')
+    if options.incremental and not options.revision:
+        raise CommandArgumentError('--incremental needs a revision range.\n')
+
+    prefix, name = __parse_prefix_name(args[0])
+    repo = Repository(prefix, name)
+    start = time.time()
+    try:
+        path, dumped, written = backups.backup(repo, options.revision, options.incremental,
+                                              options.compression)
+    except Exception, e:
+        raise CommandError('Unable to back up %s: %s' % (repo.path, e))
+    print 'Backed up %s to %s (%d bytes, %d compressed) in %.2fs.' % \
+                (repo.path, path, dumped, written, time.time() - start)
+
+backup = Command(name='backup',
+                 usage='backup [-r N[:M] [--incremental]] [-c gz|bz2] path/name | '
+                       'backup --all [-j N] [-c gz|bz2]',
+                 description='backup: Write a compressed dump of a repository to the backup directory.',
+                 options = [ make_option('-r', '--revision',
+                               dest='revision',
+                               default=None,
+                               help='Only dump revision N or revisions N to M.'),
+                             make_option('--incremental',
+                               action='store_true',
+                               dest='incremental',
+                               default=False,
+                               help='Dump the first revision as a change from the one before it.'),
+                             make_option('-c', '--compression',
+                               dest='compression',
+                               choices=['gz', 'bz2'],
+                               default=None,
+                               help='gz or bz2. The default is set in config.'),
+                             make_option('-a', '--all',
+                               action='store_true',
+                               dest='all',
+                               default=False,
+                               help='Back up every repository in the catalog.'),
+                             make_option('-j', '--workers',
+                               type='int',
+                               dest='workers',
+                               default=None,
+                               help='How many repositories --all backs up at once.') ],
+                 run=_run_backup,
+                 arg_count=ArgumentCount(0, operator.ge)
+                 )
+###############################################################################
+
+def __read_grants(filename, min_fields):
+    """
+    Read repo,path,user,mode rows from filename, or stdin if filename is -.
+    Blank lines and lines starting with # are skipped. mode may be left
+    out if min_fields is 3.
+
+    Returns a list of (prefix, name) in the order they were first seen, a
+    dict mapping each (prefix, name) to its (line number, path, user, mode)
+    rows, and a list of (line number, error) for rows that couldn't be read.
+    """
+    if filename == '-':
+        f = sys.stdin
+    else:
+        try:
+            f = open(filename, 'rb')
+        except IOError, e:
+            raise CommandError('Unable to open %s: %s.' % (filename, e))
+
+    order = []
+    rows = {}
+    errors = []
+    try:
+        reader = csv.reader(f, skipinitialspace=True)
+        try:
+            for row in reader:
+                lineno = reader.line_num
+                row = [field.strip() for field in row]
+                if not row or not row[0] or row[0].startswith('#'):
+                    continue
+                if len(row) == 3 and min_fields == 3:
+                    row.append(None)
+                if len(row) != 4:
+                    errors.append((lineno, 'Expected repo,path,user,mode but found %d field%s.'
+                                                % (len(row), (len(row) != 1) and 's' or '')))
+                    continue
+
+                repo_name, path, user, mode = row
+                if not path.startswith('/'):
+                    errors.append((lineno, 'Invalid path: %s.' % path))
+                    continue
+                if mode is not None and not mode in Auth.MODES:
+                    errors.append((lineno, 'Invalid authorization type: %s.' % mode))
+                    continue
+
+                key = __parse_prefix_name(repo_name)
+                if key not in rows:
+                    order.append(key)
+                    rows[key] = []
+                rows[key].append((lineno, path, user, mode))
+        except csv.Error, e:
+            errors.append((reader.line_num, 'Unable to parse the line: %s.' % e))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    return order, rows, errors
+
+def __apply_grants(filename, min_fields, apply, verb):
+    """
+    Apply the rows of a grant file with one load and one write per
+    repository. apply(repo, path, user, mode) makes the change for a row
+    and raises ValueError if it can't. Rows that fail are reported with
+    their line numbers and the rest of the batch carries on. All of the
+    changed descriptors are committed together.
+
+    Returns the number of rows that failed.
+    """
+    order, rows, errors = __read_grants(filename, min_fields)
+
+    changed = []
+    applied = 0
+    for prefix, name in order:
+        repo_rows = rows[(prefix, name)]
+        try:
+            repo = __load_repository_from_yaml(prefix, name)
+        except CommandError, e:
+            for lineno, path, user, mode in repo_rows:
+                errors.append((lineno, 'Unable to load %s.' % _make_path(prefix, name)))
+            continue
+
+        count = 0
+        for lineno, path, user, mode in repo_rows:
+            try:
+                apply(repo, path, user, mode)
+                count += 1
+            except ValueError, e:
+                errors.append((lineno, '%s' % e))
+
+        if count:
+            applied += count
+            changed.append(repo)
+            print '%s %d authorization%s in %s.' % (verb, count, (count != 1) and 's' or '',
+                                                    repo.path)
+
+    if changed:
+        message = '%s %d authorization%s from %s in repositories: %s.' % \
+                        (verb, applied, (applied != 1) and 's' or '', filename,
+                         ', '.join([repo.path for repo in changed]))
+        if in_transaction():
+            for repo in changed:
+                __save_repository(repo, message)
+        else:
+            __save_repositories(changed, message)
+
+    errors.sort()
+    for lineno, error in errors:
+        print 'Line %d: %s' % (lineno, error)
+
+    print '%s %d authorization%s in %d repositor%s.' % \
+                (verb, applied, (applied != 1) and 's' or '',
+                 len(changed), (len(changed) == 1) and 'y' or 'ies')
+    return len(errors)
+
+def __check_grant_errors(filename, errors):
+    if errors:
+        raise CommandError('%d row%s of %s could not be applied.' %
+                           (errors, (errors != 1) and 's' or '', filename))
+
 def _run_add_auth(self, options, args):
     """Add an authorization to the repository"""
 
+    if options.from_file:
+        if args:
+            raise CommandArgumentError('addauth --from takes no other arguments.\n')
+        granted = []
+        def add(repo, path, user, mode):
+            repo.add_auth(path, user, mode)
+            granted.append((user, repo, path, mode))
+        errors = __apply_grants(options.from_file, 4, add, 'Added')
+        for email in granted:
+            __notify_addauth(*email)
+        __check_grant_errors(options.from_file, errors)
+        return
+
+    if len(args) != 4:
+        raise CommandArgumentError('Incorrect number of arguments.\n')
     name, path, user, mode = args
 
     if not mode in Auth.MODES:
@@ -363,20 +1057,21 @@ def _run_add_auth(self, options, args):
 
     print 'Add Auth (%s, %s, %s)' % (path, user, mode)
 
-    __write_repository_yaml(repo)
-    __write_repository_fisheyeauth(repo)
-    __write_authz(repo)
-    __checkin_yaml(repo, 'Add Auth (%s, %s, %s) to repository: %s.' %
+    __save_repository(repo, 'Add Auth (%s, %s, %s) to repository: %s.' %
                             (path, user, mode, repo.path))
-    addauth_email(user, repo, path, mode)
+    __notify_addauth(user, repo, path, mode)
 
 
 addauth = Command(name='addauth',
-                  usage='addauth path/name PATH USER MODE',
+                  usage='addauth path/name PATH USER MODE | addauth --from FILE',
                   description='addauth: Authorize USER for MODE permission on REPO',
-                  options=[],
+                  options=[ make_option('--from',
+                              dest='from_file',
+                              metavar='FILE',
+                              default=None,
+                              help='Read repo,path,user,mode rows from FILE (- for stdin).') ],
                   run=_run_add_auth,
-                  arg_count=ArgumentCount(4)
+                  arg_count=ArgumentCount(0, operator.ge)
                   )
 ###############################################################################
 
@@ -386,6 +1081,27 @@ def _run_del_auth(self, options, args):
     Save the yaml descriptor file
     """
 
+    if options.from_file:
+        if args:
+            raise CommandArgumentError('delauth --from takes no other arguments.\n')
+        def remove(repo, path, user, mode):
+            # A row with a mode only removes a grant with that mode.
+            for auth_mode in (mode and (mode,) or Auth.MODES):
+                if repo.has_auth(path, user, auth_mode):
+                    break
+            else:
+                if mode:
+                    raise ValueError('No %s authorization found for %s on %s in %s.' %
+                                                        (mode, user, path, repo.path))
+                raise ValueError('No Authorizations found for %s on %s in %s.' %
+                                                        (user, path, repo.path))
+            repo.remove_auth(path, user, mode or None)
+        errors = __apply_grants(options.from_file, 3, remove, 'Removed')
+        __check_grant_errors(options.from_file, errors)
+        return
+
+    if len(args) != 3:
+        raise CommandArgumentError('Incorrect number of arguments.\n')
     name, path, user = args
     prefix, name = __parse_prefix_name(name)
     print "Name = %s" % name
@@ -410,28 +1126,94 @@ def _run_del_auth(self, options, args):
 
     print "Removed %d permission%s for %s from %s." % (num_removed, (num_removed > 1) and 's' or '', user, name)
 
-    __write_repository_yaml(repo)
-    __write_repository_fisheyeauth(repo)
-    __write_authz(repo)
-    __checkin_yaml(repo,'Delete Auth (%s, %s) from repository: %s.' %
+    __save_repository(repo, 'Delete Auth (%s, %s) from repository: %s.' %
                             (path, user, repo.path))
 
 
 delauth = Command(name='delauth',
-                  usage='delauth [-d DEPT] REPO PATH USER',
+                  usage='delauth [-d DEPT] REPO PATH USER | delauth --from FILE',
                   description='delauth: Remove a users permission for a path',
-                  options=[],
+                  options=[ make_option('--from',
+                              dest='from_file',
+                              metavar='FILE',
+                              default=None,
+                              help='Read repo,path,user[,mode] rows from FILE (- for stdin).') ],
                   run = _run_del_auth,
-                  arg_count = ArgumentCount(3)
+                  arg_count = ArgumentCount(0, operator.ge)
                   )
 ###############################################################################
 
+def __del_user_everywhere(user):
+    """
+    Remove a user from every repository the catalog says they appear in,
+    and from the repositories changed by the open transaction, which the
+    catalog doesn't know about yet. Their authorizations and group memberships are removed. Groups left
+    without members are removed along with their authorizations, since
+    the authz file can't refer to a group it doesn't define. All of the
+    changed descriptors are committed together.
+    """
+    repos = sets.Set(catalog.repositories_for_user(user))
+    if __transaction is not None:
+        repos.update([(repo.prefix, repo.name) for repo in __transaction.repos()])
+    repos = list(repos)
+    repos.sort()
+
+    changed = []
+    for prefix, name in repos:
+        repo = __load_repository_from_yaml(prefix, name)
+
+        num_auths_orig = len(repo.authorizations)
+        repo.remove_user(user)
+        num_removed = num_auths_orig - len(repo.authorizations)
+        groups = repo.remove_member(user)
+        empty = []
+        emptied = [g.name for g in repo.groups if g.name in groups and not g.members]
+        while emptied:
+            # Groups nested in other groups go too, which can empty those.
+            empty.extend(emptied)
+            nested_in = []
+            for group in emptied:
+                repo.remove_group(group)
+                nested_in.extend(repo.remove_member('@%s' % group))
+            emptied = [g.name for g in repo.groups
+                       if g.name in nested_in and not g.members]
+
+        if not (num_removed or groups):
+            continue
+        changed.append(repo)
+        print "%s: removed %d permission%s%s%s." % \
+                    (repo.path, num_removed, (num_removed != 1) and 's' or '',
+                     groups and ' and membership of %s' % ', '.join(groups) or '',
+                     empty and ' (removed the now empty group%s %s)' %
+                                ((len(empty) > 1) and 's' or '', ', '.join(empty)) or '')
+
+    if not changed:
+        raise CommandError('%s has no permissions in any repository.' % user)
+
+    message = 'Del User %s from repositories: %s.' % \
+                        (user, ', '.join([repo.path for repo in changed]))
+    if in_transaction():
+        for repo in changed:
+            __save_repository(repo, message)
+    else:
+        __save_repositories(changed, message)
+    print 'Removed %s from %d repositor%s.' % (user, len(changed),
+                                               (len(changed) == 1) and 'y' or 'ies')
+
 def _run_del_user(self, options, args):
     """
     Delete all of a user's permissions from the repository
     Save the yaml descriptor file.
     """
 
+    if options.all:
+        if len(args) != 1:
+            raise CommandArgumentError('deluser --all takes only a user.\n')
+        __del_user_everywhere(args[0])
+        return
+
+    if len(args) != 2:
+        raise CommandArgumentError('Incorrect number of arguments.\n')
     name, user = args
     prefix, name = __parse_prefix_name(name)
     print "Name = %s" % name
@@ -448,18 +1230,20 @@ def _run_del_user(self, options, args):
 
     print "Removed %d permission%s for %s from %s" % (num_removed, (num_removed > 1) and 's' or '', user, name)
 
-    __write_repository_yaml(repo)
-    __write_repository_fisheyeauth(repo)
-    __write_authz(repo)
-    __checkin_yaml(repo, 'Del User %s from repository: %s.' % (user, repo.path))
+    __save_repository(repo, 'Del User %s from repository: %s.' % (user, repo.path))
 
 
 deluser = Command(name='deluser',
-                  usage='deluser [-d DEPT] REPO USER',
-                  description='deluser: Remove all permissions for a user on the repository.',
-                  options=[],
+                  usage='deluser [-d DEPT] REPO USER | deluser --all USER',
+                  description='deluser: Remove all permissions for a user on the repository, '
+                              'or with --all from every repository and group.',
+                  options=[ make_option('-a', '--all',
+                              dest='all',
+                              action='store_true',
+                              default=False,
+                              help='Remove the user from every repository and group.') ],
                   run=_run_del_user,
-                  arg_count=ArgumentCount(2)
+                  arg_count=ArgumentCount(1, operator.ge)
                   )
 ###############################################################################
 
@@ -515,10 +1299,7 @@ def _run_add_group(self, options, args):
     print "Added group %s to %s with members:" % (name, groupname)
     print '\n'.join(users)
 
-    __write_repository_yaml(repo)
-    __write_repository_fisheyeauth(repo)
-    __write_authz(repo)
-    __checkin_yaml(repo,'Add group (name:%s, users:%s) to repository: %s.' %
+    __save_repository(repo, 'Add group (name:%s, users:%s) to repository: %s.' %
                                 (groupname, ', '.join(users), repo.path))
 
 addgroup = Command(name='addgroup',
@@ -551,16 +1332,13 @@ def _run_del_group(self, options, args):
             repo.remove_group(groupname)
             print "Removed the group %s" % groupname
     else:
-        for g in repos.groups:
+        for g in repo.groups:
             if g.name == groupname:
                 for u in users: g.remove(u)
                 break
         print "Removed users %s from group %s." % (' ,'.join(users), groupname)
 
-    __write_repository_yaml(repo)
-    __write_repository_fisheyeauth(repo)
-    __write_authz(repo)
-    __checkin_yaml(repo, 'Delete Group:%s from repository: %s.' %
+    __save_repository(repo, 'Delete Group:%s from repository: %s.' %
                                 (groupname, repo.path))
 
 delgroup = Command(name='delgroup',
@@ -573,7 +1351,14 @@ delgroup = Command(name='delgroup',
 ###############################################################################
 
 def _run_commit(self, options, args):
-    """Commit the repository yaml descriptor file."""
+    """
+    Commit the repository yaml descriptor file. Without a repository
+    commit the open transaction.
+    """
+    if not args:
+        __commit_transaction()
+        return
+
     prefix, name = __parse_prefix_name(args[0])
     try:
         repo = __load_repository_from_yaml(prefix, name)
@@ -588,8 +1373,9 @@ def _run_commit(self, options, args):
     __checkin_yaml(repo, "Committing yaml descriptor for %s." % repo.path)
 
 commit = Command(name='commit',
-                   usage='commit [-a] [prefix/]name',
-                   description='commit: Commit the yaml descriptor for the repository.',
+                   usage='commit [-a] [prefix/]name | commit',
+                   description='commit: Commit the yaml descriptor for the repository, '
+                               'or the open transaction if no repository is given.',
                    options=[ make_option('-a', '--add',
             					dest='add',
             					action='store_true',
@@ -597,32 +1383,91 @@ commit = Command(name='commit',
             					help='Add the yaml descriptor to the config repository.'),
                              ],
                    run = _run_commit,
-                   arg_count=ArgumentCount(1)
+                   arg_count=ArgumentCount(1, operator.le)
+                   )
+###############################################################################
+
+def __commit_transaction():
+    global __transaction
+
+    if __transaction is None:
+        raise CommandError('There is no open transaction. Use begin to start one.')
+
+    transaction = __transaction
+    repos = transaction.repos()
+    if repos:
+        __save_repositories(repos, '\n'.join(transaction.messages))
+    # Only close the transaction once everything is written so a failed
+    # commit can be retried or rolled back.
+    __transaction = None
+
+    for email in transaction.emails:
+        addauth_email(*email)
+    print 'Committed %d change%s to %d repositor%s.' % \
+                (len(transaction.messages), (len(transaction.messages) != 1) and 's' or '',
+                 len(repos), (len(repos) == 1) and 'y' or 'ies')
+
+def _run_begin(self, options, args):
+    """Start a transaction."""
+    global __transaction
+
+    if __transaction is not None:
+        raise CommandError('A transaction is already open. Use commit or rollback first.')
+    __transaction = Transaction()
+    print 'Started a transaction. Changes are written out by commit.'
+
+begin = Command(name='begin',
+                   usage='begin',
+                   description='begin: Start a transaction. Changes are saved by commit '
+                               'or thrown away by rollback.',
+                   options=[],
+                   run = _run_begin,
+                   arg_count=ArgumentCount(0)
+                   )
+###############################################################################
+
+def rollback_transaction():
+    """
+    Throw away the open transaction, if there is one. Returns the number
+    of changes discarded.
+    """
+    global __transaction
+
+    if __transaction is None:
+        return 0
+    count = len(__transaction.messages)
+    for yaml_path in __transaction.repositories:
+        descriptor_cache.discard(yaml_path)
+    __transaction = None
+    return count
+
+def _run_rollback(self, options, args):
+    """Throw away the changes in the open transaction."""
+    if not in_transaction():
+        raise CommandError('There is no open transaction.')
+    count = rollback_transaction()
+    print 'Discarded %d change%s.' % (count, (count != 1) and 's' or '')
+
+rollback = Command(name='rollback',
+                   usage='rollback',
+                   description='rollback: Throw away the changes in the open transaction.',
+                   options=[],
+                   run = _run_rollback,
+                   arg_count=ArgumentCount(0)
                    )
 ###############################################################################
 
 def _run_ls(self, options, args):
     def print_repos(prefix):
-        paths = os.listdir(os.path.join(config.REPO_ROOT, prefix))
         print "\n[ Repositories in %s ]" % os.path.join(config.REPO_ROOT, prefix)
-        paths.sort()
-        for path in paths:
-            if Repository.exists(os.path.join(config.REPO_ROOT, prefix, path)):
-                print path
+        for repo_prefix, name, fisheye in catalog.repositories(prefix):
+            print name
 
     if len(args) == 1:
-        print_repos(args[0])
+        print_repos(args[0].strip('/'))
 
     else:
-        prefixes = os.listdir(config.REPO_ROOT)
-        for folder in ('bin', 'yaml', '.svn'):
-            try:
-                prefixes.remove(folder)
-            except ValueError, e:
-                pass
-
-        prefixes.sort()
-        for prefix in prefixes:
+        for prefix in catalog.prefixes():
             print_repos(prefix)
 
 
@@ -635,32 +1480,175 @@ ls = Command(name='ls',
                )
 ###############################################################################
 
-def _run_flush(self, options, args):
-
-    prefix, name = __parse_prefix_name(args[0])
+def __flush_repository(prefix, name, force=False):
+    """
+    Write out whichever of the yaml, fisheyeauth, authz and apache conf
+    for a repository are out of date, or all of them with force. Returns
+    the names of the files written.
+    """
     repo = __load_repository_from_yaml(prefix, name)
 
-    __write_repository_yaml(repo)
-    __write_repository_fisheyeauth(repo)
-    __write_authz(repo)
-    print 'Wrote apache authz.'
-    apache_conf.process_to_file(repo.apache_conf,
-                                    {'repopath' : repo.path,
-                                     'users' : ', '.join(repo.users()),
-                                     'apache_authz_path' : repo.apache_authz})
-    print 'Wrote apache conf.'
+    written = __write_artifacts(repo, force, apache=True)
+    if written:
+        print 'Wrote %s for %s.' % (', '.join(written), repo.path)
+    else:
+        print '%s is up to date.' % repo.path
+    return written
+
+def _flush_worker_init(force):
+    """Keep the output of the flush workers from mixing with the progress."""
+    global _flush_force
+    _flush_force = force
+    sys.stdout = open(os.devnull, 'w')
+
+def _flush_worker(repo_key):
+    """
+    Flush one repository in a worker process. Returns (path, names of the
+    files written, error).
+    """
+    prefix, name = repo_key
+    try:
+        written = __flush_repository(prefix, name, _flush_force)
+    except Exception, e:
+        return (_make_path(prefix, name), [], str(e).replace('\n', ' '))
+    return (_make_path(prefix, name), written, None)
+
+def __flush_many(repo_keys, workers, force=False):
+    """
+    Flush a list of (prefix, name) with a pool of worker processes,
+    printing progress as they finish.
+    """
+    import multiprocessing
+
+    if not workers:
+        workers = config.FLUSH_WORKERS or multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(repo_keys)))
+
+    # Read the template before the workers fork so they all share it.
+    apache_conf.load()
+
+    print 'Flushing %d repositor%s with %d worker%s.' % \
+                (len(repo_keys), (len(repo_keys) == 1) and 'y' or 'ies',
+                 workers, (workers != 1) and 's' or '')
+    failures = []
+    changed = []
+    files = 0
+    pool = multiprocessing.Pool(workers, _flush_worker_init, (force,))
+    try:
+        done = 0
+        for path, written, error in pool.imap_unordered(_flush_worker, repo_keys):
+            done += 1
+            if error is None:
+                print '[%d/%d] %s%s' % (done, len(repo_keys), path,
+                                        written and ': ' + ', '.join(written) or '')
+                files += len(written)
+                if 'conf' in written:
+                    changed.append(path)
+            else:
+                print '[%d/%d] %s FAILED: %s' % (done, len(repo_keys), path, error)
+                failures.append((path, error))
+        pool.close()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.join()
+
+    # The workers rewrote the descriptors behind the cache's back.
+    descriptor_cache.clear()
+
+    print 'Flushed %d of %d repositories, %d file%s written.' % \
+                (len(repo_keys) - len(failures), len(repo_keys), files, (files != 1) and 's' or '')
+    __reload_apache(changed)
+    if failures:
+        failures.sort()
+        raise CommandError('%d repositor%s failed to flush:' %
+                                (len(failures), (len(failures) == 1) and 'y' or 'ies'),
+                           *['  %s: %s' % failure for failure in failures])
+
+def _run_flush(self, options, args):
+    """
+    Flush one repository, every repository in a prefix (PREFIX/*) or, with
+    --all, every repository in the catalog.
+    """
+    if in_transaction():
+        raise CommandError('Commit or roll back the open transaction before flushing.')
+    if options.all:
+        if args:
+            raise CommandArgumentError('flush --all takes no repository.\n')
+        repos = catalog.repositories()
+    elif len(args) != 1:
+        raise CommandArgumentError('Incorrect number of arguments.\n')
+    elif args[0].endswith('/*'):
+        repos = catalog.repositories(args[0][:-2])
+    else:
+        prefix, name = __parse_prefix_name(args[0])
+        if 'conf' in __flush_repository(prefix, name, options.force):
+            __reload_apache([_make_path(prefix, name)])
+        return
+
+    if not repos:
+        raise CommandError('No repositories to flush.')
+    __flush_many([(prefix, name) for prefix, name, fisheye in repos], options.workers,
+                 options.force)
 
 
 flush = Command(name='flush',
-                   usage='flush [prefix/]name',
-                   description='flush: write out yaml, fisheyeauth, apache conf, and apache authz.',
-                   options=[],
+                   usage='flush [-f] [-j N] [prefix/]name | flush [-f] [-j N] prefix/* | '
+                         'flush [-f] [-j N] --all',
+                   description='flush: write out yaml, fisheyeauth, apache conf, and apache authz '
+                               'that are out of date.',
+                   options=[ make_option('-f', '--force',
+                               dest='force',
+                               action='store_true',
+                               default=False,
+                               help='Write every file, even the ones that are up to date.'),
+                             make_option('-a', '--all',
+                               dest='all',
+                               action='store_true',
+                               default=False,
+                               help='Flush every repository in the catalog.'),
+                             make_option('-j', '--jobs',
+                               dest='workers',
+                               type='int',
+                               default=None,
+                               help='Number of repositories to flush at once.') ],
                    run = _run_flush,
-                   arg_count=ArgumentCount(1)
+                   arg_count=ArgumentCount(1, operator.le)
                    )
 ###############################################################################
 
+def __fisheye_sync(options):
+    """
+    Create and delete fisheye instances until fisheye matches the
+    repositories in the catalog.
+    """
+    import fisheye as fisheyes
+
+    wanted, known = [], []
+    for prefix, name, repo_fisheye in catalog.repositories():
+        repo = Repository(prefix, name, repo_fisheye)
+        known.append(repo)
+        if repo_fisheye:
+            wanted.append(repo)
+
+    try:
+        failures = fisheyes.sync(wanted, known, options.workers, dry_run=options.dry_run)
+    except CommandError:
+        raise
+    except Exception, e:
+        raise CommandError('Unable to sync fisheye: %s' % e)
+    if failures:
+        raise CommandError('%d fisheye change%s failed.' % (len(failures),
+                                                           (len(failures) != 1) and 's' or ''),
+                           'Run fisheye sync again to retry them.')
+
 def _run_fisheye(self, options, args):
+    if args == ['sync']:
+        return __fisheye_sync(options)
+    if options.dry_run or options.workers is not None:
+        raise CommandArgumentError('-n and -j only apply to fisheye sync.\n')
+
     mode = 'check'
     prefix, name = __parse_prefix_name(args[0])
 
@@ -669,9 +1657,13 @@ def _run_fisheye(self, options, args):
 
     if not mode in ('on', 'off', 'check'):
         raise CommandArgumentError('fisheye: Enter either on or off.')
+    if mode != 'check' and in_transaction():
+        raise CommandError('Commit or roll back the open transaction before turning fisheye %s.'
+                                                                                    % mode)
 
     repo = __load_repository_from_yaml(prefix, name)
-    fisheye_admin = FisheyeAdmin(config.FISHEYE_ADMIN_PW)
+    from fisheye import admin
+    fisheye_admin = admin()
 
     if mode == 'on':
         if repo.fisheye == True:
@@ -679,7 +1671,6 @@ def _run_fisheye(self, options, args):
             return
         else:
             repo.fisheye = True
-            repo.set_fisheye_auth_path()
             if fisheye_admin.create_repository(repo, __get_description()):
                 print "Successfully create a fisheye instance for %s" % repo.name
             else:
@@ -701,21 +1692,30 @@ def _run_fisheye(self, options, args):
         print 'Fisheye is %s for %s' % (repo.fisheye and 'ON' or 'OFF', repo.name)
         return
 
-    __write_repository_yaml(repo)
+    __write_artifacts(repo)
+    __update_catalog([repo])
     __checkin_yaml(repo, commit_message)
 
-    if repo.fisheye:
-        __write_repository_fisheyeauth(repo)
-    else:
+    if not repo.fisheye:
         try:
             os.remove(repo.fisheye_auth_path)
         except Exception, e:
             raise CommandError('Error removing fisheye auth file at: %s \n%s' % (repo.fisheye_auth_path, e) )
 
 fisheye = Command(name='fisheye',
-                   usage='fisheye [prefix/name] on|off|check',
-                   description='fisheye: Enable or disable fisheye authorization file.',
-                   options=[ ],
+                   usage='fisheye [prefix/name] on|off|check | fisheye sync [-n] [-j N]',
+                   description='fisheye: Enable or disable fisheye authorization file, '
+                               'or make fisheye match the catalog.',
+                   options=[ make_option('-n', '--dry-run',
+                               dest='dry_run',
+                               action='store_true',
+                               default=False,
+                               help='Show what sync would change without changing it.'),
+                             make_option('-j', '--jobs',
+                               dest='workers',
+                               type='int',
+                               default=None,
+                               help='Number of fisheye sessions sync uses at once.') ],
                    run = _run_fisheye,
                    arg_count=ArgumentCount(1, operator.ge)
                    )
@@ -723,14 +1723,16 @@ fisheye = Command(name='fisheye',
 
 def _run_info(self, options, args):
     prefix, name = __parse_prefix_name(args[0])
+    if catalog.get(prefix, name) is None:
+        raise CommandError('No repository named %s in the catalog.' % args[0],
+                           'Run reindex if it was created outside of svnsh.')
     repo = __load_repository_from_yaml(prefix, name)
 
     print 'Repository summary:'
     print ''
     print 'Name: %s' % name
     if prefix: print "Prefix = %s" % prefix
-    print 'URL: %s%s/%s/%s' % (config.URL_PREFIX, config.SVN_SERVER,
-                                config.SVN_PREFIX, repo.path)
+    print 'URL: %s' % repo.url
 
     print 'Fisheye status: %s' % (repo.fisheye and 'on' or 'off')
     if options.verbose:
@@ -770,6 +1772,125 @@ info = Command(name='info',
                    )
 ###############################################################################
 
+def _run_check(self, options, args):
+    """Check the access a user has to a path in the repository."""
+
+    name, path, user = args
+    if not path.startswith('/'):
+        raise CommandArgumentError('The path must start with /.')
+
+    prefix, name = __parse_prefix_name(name)
+    repo = __load_repository_from_yaml(prefix, name)
+
+    mode = checker_for(repo).access(user, path)
+    description = {'rw': 'read-write', 'r': 'read-only', '': 'no'}[mode]
+    print '%s has %s access to %s in %s.' % (user, description, path, repo.path)
+
+check = Command(name='check',
+                   usage='check [prefix/]name PATH USER',
+                   description='check: Show the access USER has to PATH in the repository.',
+                   options=[],
+                   run = _run_check,
+                   arg_count=ArgumentCount(3)
+                   )
+###############################################################################
+
+def _run_access(self, options, args):
+    """
+    Show everything a user can access. Uses the catalog so no descriptors
+    are loaded. For each repository the paths where the user's access
+    changes are listed with the access they have below that path.
+    """
+    user = args[0]
+    found = False
+    for prefix, name in catalog.repositories_visible_to(user):
+        authorizations, groups = catalog.rules(prefix, name)
+        checker = AccessChecker(authorizations, groups)
+        paths = list(sets.Set([auth.path for auth in authorizations]))
+        paths.sort()
+
+        lines = []
+        for path in paths:
+            mode = checker.access(user, path)
+            components = split_path(path)
+            if components:
+                parent = checker.access(user, '/' + '/'.join(components[:-1]))
+            else:
+                parent = ''
+            if mode != parent:
+                lines.append('  %s\t%s' % (path, mode or 'none'))
+
+        if lines:
+            found = True
+            print _make_path(prefix, name)
+            print '\n'.join(lines)
+
+    if not found:
+        print '%s has no access to any repository.' % user
+
+access = Command(name='access',
+                   usage='access USER',
+                   description='access: Show the repositories and paths USER can access.',
+                   options=[],
+                   run = _run_access,
+                   arg_count=ArgumentCount(1)
+                   )
+###############################################################################
+
+def _run_who_has(self, options, args):
+    """Show everyone with access to a path in a repository."""
+    name, path = args
+    if not path.startswith('/'):
+        raise CommandArgumentError('The path must start with /.')
+
+    prefix, name = __parse_prefix_name(name)
+    if catalog.get(prefix, name) is None:
+        raise CommandError('No repository named %s in the catalog.' % args[0],
+                           'Run reindex if it was created outside of svnsh.')
+
+    authorizations, groups = catalog.rules(prefix, name)
+    checker = AccessChecker(authorizations, groups)
+    users = sets.Set([auth.user for auth in authorizations])
+    for group in groups:
+        users.update(group.members)
+    users = [user for user in users if not user.startswith('@')]
+    users.sort()
+
+    found = False
+    for user in users:
+        mode = checker.access(user, path)
+        if mode:
+            found = True
+            print '%s\t%s' % (user, mode)
+    if not found:
+        print 'Nobody has access to %s in %s.' % (path, _make_path(prefix, name))
+
+whohas = Command(name='whohas',
+                   usage='whohas [prefix/]name PATH',
+                   description='whohas: Show the users with access to PATH in the repository.',
+                   options=[],
+                   run = _run_who_has,
+                   arg_count=ArgumentCount(2)
+                   )
+###############################################################################
+
+def _run_reindex(self, options, args):
+    """Rebuild the repository catalog from the repositories on disk."""
+    try:
+        count = catalog.rebuild()
+    except Exception, e:
+        raise CommandError('Error rebuilding the catalog: %s.' % e)
+    print 'Indexed %d repositor%s.' % (count, (count == 1) and 'y' or 'ies')
+
+reindex = Command(name='reindex',
+                   usage='reindex',
+                   description='reindex: Rebuild the repository catalog from disk.',
+                   options=[],
+                   run = _run_reindex,
+                   arg_count=ArgumentCount(0)
+                   )
+###############################################################################
+
 def _test():
    import doctest
    doctest.testmod()
@@ -2,12 +2,13 @@
 Configuration for repopy modules.
 """
 
-import commands
 import os
 
 APACHE_USER = 'apache'
 APACHE_GROUP = 'users'
 APACHE_CONF_ROOT = '/etc/httpd/conf/repos.d'
+# Run after a command changes an apache conf. None means reload by hand.
+APACHE_RELOAD = ['/usr/sbin/apachectl', 'graceful']
 
 SVN_SERVER = 'svn.example.com'
 URL_PREFIX = 'https://'
@@ -15,7 +16,32 @@ SVN_PREFIX = 'svn'
 
 REPO_ROOT = '/repos'
 YAML_ROOT = os.path.join(REPO_ROOT, 'yaml')
-SVNADMIN = commands.getoutput("which svnadmin")
+CATALOG_PATH = os.path.join(YAML_ROOT, 'catalog.db')
+# The Unix socket and number of worker threads for svnsh.py --serve.
+SERVER_SOCKET = '/var/run/svnsh/svnsh.sock'
+SERVER_SOCKET_MODE = 0600
+SERVER_WORKERS = 4
+
+# Number of processes flush --all uses. None means one per CPU.
+FLUSH_WORKERS = None
+# Number of repositories create --batch makes at once.
+CREATE_WORKERS = 4
+
+# Where backups are written, gz or bz2, the number of processes backup
+# --all uses (None means one per CPU) and the most bytes per second of
+# dump to read, shared by all of the backups running at once. None
+# means no limit.
+BACKUP_ROOT = os.path.join(REPO_ROOT, 'backup')
+BACKUP_COMPRESSION = 'gz'
+BACKUP_WORKERS = 2
+BACKUP_RATE_LIMIT = None
+
+# Upper bound on the total size of the YAML descriptors svnsh keeps
+# loaded in memory. 0 turns the cache off.
+DESCRIPTOR_CACHE_BYTES = 64 * 1024 * 1024
+# Path to svnadmin. Looked up with which the first time it's needed if
+# it isn't set here.
+SVNADMIN = None
 VERBOSE = 1
 NON_LDAP_USERS = ['test1']
 TEMPLATE_DIR = 'templates'
@@ -24,7 +50,28 @@ MOCK_SVN_COMMANDS = True
 
 FISHEYE_ADMIN_URL = 'https://example.com/fisheye/admin'
 FISHEYE_ADMIN_PW = 'XXXXXXXX'
+# The saved fisheye admin session and the cached repository ids.
+FISHEYE_COOKIE_FILE = '/var/lib/svnsh/fisheye-cookies.txt'
+FISHEYE_ID_FILE = '/var/lib/svnsh/fisheye-ids.json'
+# Sessions fisheye sync uses at once and the most changes a second it
+# makes. None means no limit.
+FISHEYE_WORKERS = 4
+FISHEYE_RATE_LIMIT = 2
 
 SMTP_HOST = 'localhost'
+SMTP_PORT = 25
 EMAIL_DOMAIN = 'example.com'
-EMAIL_FROM = 'svn.admins@example.com'
\ No newline at end of file
+EMAIL_FROM = 'svn.admins@example.com'
+# Notifications wait here until they're sent, so they survive a crash.
+NOTIFY_SPOOL = '/var/spool/svnsh/notify'
+# Seconds to wait after a grant for more grants to put in the same email.
+NOTIFY_DELAY = 2
+
+
+def svnadmin():
+    """The path to svnadmin."""
+    global SVNADMIN
+    if SVNADMIN is None:
+        import commands
+        SVNADMIN = commands.getoutput("which svnadmin")
+    return SVNADMIN
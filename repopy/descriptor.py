@@ -0,0 +1,179 @@
+"""
+Reading and writing the YAML repository descriptors.
+
+Descriptors are loaded with the safe loader, the C implementation from
+libyaml if it is available, so a descriptor can only ever produce a
+Repository, its Groups and Auths and plain YAML data. They are written
+with the tags !repository, !group and !auth.
+
+Descriptors written by yaml.dump before these tags existed use
+!!python/object tags. Those tags are understood for the three classes
+only, so existing descriptors keep loading.
+
+The YAML is the source of truth, but parsing it is slow for large
+descriptors. dump_file also writes a sidecar next to the descriptor
+(sakai.yaml -> sakai.yamlc) holding the same data as marshalled tuples
+along with the SHA-1 of the YAML it was made from. load_file uses the
+sidecar when that hash matches the YAML on disk and falls back to
+parsing the YAML otherwise.
+"""
+
+import marshal
+import hashlib
+
+import yaml
+
+import fileio
+
+try:
+    from yaml import CSafeLoader as _SafeLoader, CSafeDumper as _SafeDumper
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader, SafeDumper as _SafeDumper
+
+from repository import Repository, Group, Auth
+
+REPOSITORY_TAG = u'!repository'
+GROUP_TAG = u'!group'
+AUTH_TAG = u'!auth'
+
+# The tags yaml.dump used for our classes. The module is repository
+# when the classes were imported with an implicit relative import.
+LEGACY_TAG = u'tag:yaml.org,2002:python/object:%s.%s'
+LEGACY_MODULES = ('repopy.repository', 'repository')
+
+# Appended to the descriptor path to name its sidecar.
+SIDECAR_SUFFIX = 'c'
+# Bump this when the layout of the sidecar changes.
+SIDECAR_VERSION = 1
+
+
+class Loader(_SafeLoader):
+    """A safe loader that knows about the descriptor classes."""
+    pass
+
+
+class Dumper(_SafeDumper):
+    """A safe dumper that knows about the descriptor classes."""
+    pass
+
+
+def _construct_repository(loader, node):
+    state = loader.construct_mapping(node, deep=True)
+    repo = Repository.__new__(Repository)
+    repo.__setstate__(state)
+    return repo
+
+def _construct_group(loader, node):
+    state = loader.construct_mapping(node, deep=True)
+    return Group(state['name'], state.get('members', []))
+
+def _construct_auth(loader, node):
+    state = loader.construct_mapping(node)
+    return Auth(state['path'], state['user'], state['mode'])
+
+def _represent_repository(dumper, repo):
+    return dumper.represent_mapping(REPOSITORY_TAG, repo.__getstate__())
+
+def _represent_group(dumper, group):
+    return dumper.represent_mapping(GROUP_TAG, {'name': group.name,
+                                                'members': group.members})
+
+def _represent_auth(dumper, auth):
+    return dumper.represent_mapping(AUTH_TAG, {'path': auth.path,
+                                               'user': auth.user,
+                                               'mode': auth.mode})
+
+for cls, tag, construct, represent in (
+        (Repository, REPOSITORY_TAG, _construct_repository, _represent_repository),
+        (Group, GROUP_TAG, _construct_group, _represent_group),
+        (Auth, AUTH_TAG, _construct_auth, _represent_auth)):
+    Loader.add_constructor(tag, construct)
+    for module in LEGACY_MODULES:
+        Loader.add_constructor(LEGACY_TAG % (module, cls.__name__), construct)
+    Dumper.add_representer(cls, represent)
+
+
+def sidecar_path(yaml_path):
+    """The path of the sidecar for the descriptor at yaml_path."""
+    return yaml_path + SIDECAR_SUFFIX
+
+def _to_tuples(repo):
+    """The state of a Repository as plain data marshal can write."""
+    state = repo.__getstate__()
+    state['authorizations'] = tuple([(a.path, a.user, a.mode)
+                                     for a in repo.authorizations])
+    state['groups'] = tuple([(g.name, tuple(g.members)) for g in repo.groups])
+    return state
+
+def _from_tuples(state):
+    """Rebuild a Repository from the output of _to_tuples."""
+    state = state.copy()
+    state['authorizations'] = [Auth(*a) for a in state['authorizations']]
+    state['groups'] = [Group(name, list(members)) for name, members in state['groups']]
+    repo = Repository.__new__(Repository)
+    repo.__setstate__(state)
+    return repo
+
+def _write_sidecar(repo, yaml_path, data):
+    """Write the sidecar for the YAML in data."""
+    sidecar = (SIDECAR_VERSION, hashlib.sha1(data).digest(), _to_tuples(repo))
+    fileio.write_file(sidecar_path(yaml_path), marshal.dumps(sidecar))
+
+def _read_sidecar(yaml_path, data):
+    """
+    Return the Repository from the sidecar for the YAML in data or None if
+    there is no sidecar or it was made from different YAML.
+    """
+    try:
+        f = open(sidecar_path(yaml_path), 'rb')
+        try:
+            sidecar = marshal.loads(f.read())
+        finally:
+            f.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+    if not (isinstance(sidecar, tuple) and len(sidecar) == 3):
+        return None
+    version, digest, state = sidecar
+    if version != SIDECAR_VERSION or digest != hashlib.sha1(data).digest():
+        return None
+    return _from_tuples(state)
+
+def load_file(yaml_path):
+    """
+    Load the Repository in the descriptor at yaml_path, from its sidecar
+    if the sidecar is up to date. A missing or stale sidecar is rewritten
+    if possible.
+    """
+    f = open(yaml_path, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+
+    repo = _read_sidecar(yaml_path, data)
+    if repo is None:
+        repo = load(data)
+        try:
+            _write_sidecar(repo, yaml_path, data)
+        except (IOError, OSError):
+            pass
+    return repo
+
+def dump_file(repo, yaml_path):
+    """Write the descriptor for repo to yaml_path along with its sidecar."""
+    data = dump(repo)
+    fileio.write_file(yaml_path, data)
+    _write_sidecar(repo, yaml_path, data)
+
+def load(stream):
+    """Load a Repository from a YAML string or file."""
+    return yaml.load(stream, Loader=Loader)
+
+def dump(repo, stream=None):
+    """
+    Dump a Repository as YAML to stream. If stream is None the YAML is
+    returned as a string.
+    """
+    return yaml.dump(repo, stream, Dumper=Dumper)
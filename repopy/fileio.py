@@ -0,0 +1,216 @@
+"""
+Writing files so that nobody ever sees half of one.
+
+write_file writes to a temporary file in the same directory and renames
+it over the old file once it's complete and on disk, so Apache, or
+anything else reading the file, sees either the old file or the new one.
+The directory is synced after the rename so the rename survives a crash
+too. The new file keeps the old one's mode and, if possible, its owner.
+
+Syncing is the slow part. Between begin and commit the files a thread
+writes are only staged. commit syncs them all, renames them into place
+and syncs each directory once however many files went into it. abort
+throws the staged files away. begin and commit nest, only the outermost
+commit writes anything. Anything that has to wait until the files are in
+place, like caching what was written, goes to after_commit.
+"""
+
+import os
+import tempfile
+import threading
+
+# Each thread has its own batch.
+_local = threading.local()
+
+# The mode of new files.
+DEFAULT_MODE = 0644
+
+_sync_data = getattr(os, 'fdatasync', os.fsync)
+
+
+def _sync_file(path):
+    f = open(path, 'rb')
+    try:
+        _sync_data(f.fileno())
+    finally:
+        f.close()
+
+def _sync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        try:
+            os.fsync(fd)
+        except OSError:
+            # Not every filesystem can sync a directory.
+            pass
+    finally:
+        os.close(fd)
+
+
+class _Batch(object):
+    """The files staged since begin, in the order they were written."""
+
+    def __init__(self):
+        self.depth = 1
+        # path -> temporary file
+        self.staged = {}
+        self.order = []
+        # (func, args) to call once the files are in place.
+        self.hooks = []
+
+    def add(self, path, partial):
+        if path in self.staged:
+            os.remove(self.staged[path])
+        else:
+            self.order.append(path)
+        self.staged[path] = partial
+
+    def commit(self):
+        dirs = []
+        for path in self.order:
+            _sync_file(self.staged[path])
+        for path in self.order:
+            os.rename(self.staged.pop(path), path)
+            directory = os.path.dirname(path) or '.'
+            if directory not in dirs:
+                dirs.append(directory)
+        for directory in dirs:
+            _sync_dir(directory)
+
+    def abort(self):
+        del self.hooks[:]
+        for partial in self.staged.values():
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+        self.staged.clear()
+
+
+def begin():
+    """Stage the files this thread writes until commit."""
+    batch = getattr(_local, 'batch', None)
+    if batch is None:
+        _local.batch = _Batch()
+    else:
+        batch.depth += 1
+
+def commit():
+    """
+    Put the files staged since the matching begin in place. Does nothing
+    if there's no batch or it's nested in another.
+    """
+    batch = getattr(_local, 'batch', None)
+    if batch is None:
+        return
+    batch.depth -= 1
+    if batch.depth > 0:
+        return
+    _local.batch = None
+    try:
+        batch.commit()
+    except:
+        batch.abort()
+        raise
+    for func, args in batch.hooks:
+        func(*args)
+
+def abort():
+    """Throw away every file staged by this thread and end the batch."""
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        _local.batch = None
+        batch.abort()
+
+
+def after_commit(func, *args):
+    """
+    Call func(*args) once the files this thread has staged are in place,
+    right away if there's no batch. Nothing is called if the batch is
+    aborted.
+    """
+    batch = getattr(_local, 'batch', None)
+    if batch is None:
+        func(*args)
+    else:
+        batch.hooks.append((func, args))
+
+
+def unchanged(path, data):
+    """Does the file at path hold exactly data?"""
+    try:
+        f = open(path, 'rb')
+        try:
+            # Don't bother reading a file that's the wrong size.
+            return os.fstat(f.fileno()).st_size == len(data) and f.read() == data
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return False
+
+def _stage(path, data, sync):
+    """
+    Write data, a string or chunks of one, to a temporary file next to
+    path. Returns its name.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+
+    fd, partial = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.',
+                                   dir=os.path.dirname(path) or '.')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            if isinstance(data, basestring):
+                f.write(data)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+            if sync:
+                f.flush()
+                _sync_data(f.fileno())
+        finally:
+            f.close()
+        if st is None:
+            os.chmod(partial, DEFAULT_MODE)
+        else:
+            os.chmod(partial, st.st_mode & 07777)
+            if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+                try:
+                    os.chown(partial, st.st_uid, st.st_gid)
+                except OSError:
+                    pass
+    except:
+        os.remove(partial)
+        raise
+    return partial
+
+def write_file(path, data, if_changed=False):
+    """
+    Replace the file at path with data. data can be a string or an
+    iterable of strings, which is written a chunk at a time. With
+    if_changed a file already holding data is left alone, mtime and all,
+    an iterable has to be joined to compare it. Returns True if the file
+    was written, or staged inside a batch.
+    """
+    if if_changed and not isinstance(data, basestring):
+        data = ''.join(data)
+    batch = getattr(_local, 'batch', None)
+    if if_changed and not (batch is not None and path in batch.staged) \
+            and unchanged(path, data):
+        return False
+
+    if batch is not None:
+        batch.add(path, _stage(path, data, False))
+        return True
+
+    partial = _stage(path, data, True)
+    try:
+        os.rename(partial, path)
+    except:
+        os.remove(partial)
+        raise
+    _sync_dir(os.path.dirname(path) or '.')
+    return True
@@ -1,26 +1,134 @@
 # python std libs
+import os
 import re
+import sys
+import sets
+import time
+import cgi
+import urlparse
+import threading
 from urllib2 import HTTPError
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 # 3rd party libs
 from BeautifulSoup import BeautifulSoup
-from mechanize import Browser
+from mechanize import Browser, LWPCookieJar
 
 # repopy
-from config import FISHEYE_ADMIN_URL, REPO_ROOT
+import config
 from errors import InvalidPasswordError
 
 
+def parse_repository_list(html):
+    """
+    Find the repositories on the admin repository list page. Returns a
+    dictionary mapping each fisheye name to its repository id.
+    """
+    soup = BeautifulSoup(html)
+    # Find the list of repos on the left side
+    helpPane = soup.find("div", {"class" : "helpPane"})
+    if helpPane is None:
+        raise ValueError("There is no repository list on the page.")
+    ids = {}
+    for link in helpPane("ul")[2]("a"):
+        rep = cgi.parse_qs(urlparse.urlparse(link["href"])[4]).get('rep')
+        if rep and link.contents:
+            ids[str(link.contents[0]).strip()] = int(rep[0])
+    return ids
+
+
+# Sessions in other threads may log in and save cookies at the same time.
+_cookie_file_lock = threading.Lock()
+
+
 class FisheyeAdmin(object):
     """
         Performs actions on fisheye admin on your behalf.
+
+        The session cookie is saved in config.FISHEYE_COOKIE_FILE so a
+        login is reused by later commands and svnsh processes. It only
+        logs in again when Fisheye sends it back to the login page.
+
+        The ids Fisheye gives repositories are cached by fisheye name in
+        config.FISHEYE_ID_FILE. The cache is filled from the repository
+        list page and kept up to date as repositories are created and
+        deleted.
     """
-    def __init__(self, password=None):
-        self.browser = Browser()
+    def __init__(self, password=None, cookie_file=None, id_file=None):
         self.password = password
-        if self.password:
-            if not self.login(self.password):
-                raise InvalidPasswordError("Invalid fisheye admin password.")
+        self.cookie_file = cookie_file or config.FISHEYE_COOKIE_FILE
+        self.id_file = id_file or config.FISHEYE_ID_FILE
+        self.logged_in = False
+        # The browser isn't safe to share between threads.
+        self.lock = threading.RLock()
+
+        self.cookies = LWPCookieJar()
+        try:
+            # Fisheye's session cookie is a session cookie, keep it anyway.
+            self.cookies.load(self.cookie_file, ignore_discard=True)
+        except (IOError, OSError):
+            pass
+        except Exception:
+            # A corrupt cookie file just means logging in again.
+            self.cookies.clear()
+
+        self.browser = Browser()
+        self.browser.set_handle_robots(False)
+        self.browser.set_cookiejar(self.cookies)
+
+        self.repo_ids = self._load_ids()
+
+
+    def _url(self, path):
+        return config.FISHEYE_ADMIN_URL + path
+
+    def _at(self, path):
+        """Is the browser on the admin page path?"""
+        return self.browser.geturl().split('?')[0] == self._url(path)
+
+    def _save_cookies(self):
+        # The session is as good as the admin password. The file is only
+        # ever readable by us, even while it's being written.
+        _cookie_file_lock.acquire()
+        try:
+            try:
+                fd = os.open(self.cookie_file, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0600)
+                f = os.fdopen(fd, 'w')
+                try:
+                    os.fchmod(fd, 0600)
+                    f.write('#LWP-Cookies-2.0\n')
+                    f.write(self.cookies.as_lwp_str(ignore_discard=True))
+                finally:
+                    f.close()
+            except (IOError, OSError), e:
+                print >>sys.stderr, 'Unable to save the fisheye session in %s, ' \
+                                    'the next command will log in again: %s' % (self.cookie_file, e)
+        finally:
+            _cookie_file_lock.release()
+
+    def _load_ids(self):
+        try:
+            f = open(self.id_file)
+            try:
+                return dict([(str(name), int(rep)) for name, rep in json.load(f).items()])
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError, AttributeError):
+            return {}
+
+    def _save_ids(self):
+        try:
+            f = open(self.id_file, 'w')
+            try:
+                json.dump(self.repo_ids, f)
+            finally:
+                f.close()
+        except (IOError, OSError):
+            pass
 
 
     def login(self, admin_password=None):
@@ -28,119 +136,345 @@ class FisheyeAdmin(object):
             Log into the fisheye admin.
             The login info is saved in a cookie by self.browser
         """
-        admin_login_url = FISHEYE_ADMIN_URL + '/login.do'
+        admin_login_url = self._url('/login.do')
 
         if not admin_password:
             admin_password = self.password
 
+        self.lock.acquire()
         try:
-            self.browser.open(admin_login_url)
-            self.browser.select_form(name='loginform')
-            self.browser["adminPassword"] = admin_password
             try:
-                self.browser.submit()
+                self.browser.open(admin_login_url)
+                self.browser.select_form(name='loginform')
+                self.browser["adminPassword"] = admin_password
+                try:
+                    self.browser.submit()
+                except HTTPError, e:
+                    raise Exception("Unable to post to admin login form : " + str(e))
             except HTTPError, e:
-                raise Exception("Unable to post to admin login form : " + str(e))
-        except HTTPError, e:
-            raise Exception("Unable to open the fisheye admin login page : " + str(e))
+                raise Exception("Unable to open the fisheye admin login page : " + str(e))
 
-        # Got kicked back to the admin login page
-        if self.browser.geturl() == FISHEYE_ADMIN_URL + '/login.do':
-            self.logged_in = False
-            raise InvalidPasswordError("Invalid fisheye admin password.")
-        # Made it to the admin repo list
-        elif self.browser.geturl() == FISHEYE_ADMIN_URL + '/viewRepList.do':
-            self.logged_in = True
-        # wtf?
-        else:
-            self.logged_in = False
+            # Got kicked back to the admin login page
+            if self._at('/login.do'):
+                self.logged_in = False
+                raise InvalidPasswordError("Invalid fisheye admin password.")
+            # Made it to the admin repo list
+            elif self._at('/viewRepList.do'):
+                self.logged_in = True
+                self._save_cookies()
+                # We're looking at the repository list anyway.
+                try:
+                    self._update_ids(self.browser.response().read())
+                except (ValueError, IndexError):
+                    pass
+            # wtf?
+            else:
+                self.logged_in = False
 
-        return self.logged_in
+            return self.logged_in
+        finally:
+            self.lock.release()
 
 
-    def create_repository(self, repo, description):
+    def _open(self, path):
         """
-            Add a repository to fisheye.
+            Open an admin page, logging in first if the session expired.
         """
+        self.lock.acquire()
+        try:
+            response = self.browser.open(self._url(path))
+            if self._at('/login.do'):
+                if not self.login():
+                    raise Exception("Unable to log into the fisheye admin.")
+                # Logging in lands on the repository list.
+                if self._at(path):
+                    return self.browser.response()
+                response = self.browser.open(self._url(path))
+            else:
+                self.logged_in = True
+            return response
+        finally:
+            self.lock.release()
+
 
-        if not self.logged_in:
-            return False
+    def _update_ids(self, html):
+        self.repo_ids = parse_repository_list(html)
+        self._save_ids()
 
-        add_repo_url = FISHEYE_ADMIN_URL + '/addRep!default.do'
+    def refresh_ids(self):
+        """Reload the name to id map from the repository list page."""
+        self.lock.acquire()
         try:
-            self.browser.open(add_repo_url)
+            try:
+                self._update_ids(self._open('/viewRepList.do').read())
+            except HTTPError, e:
+                raise Exception("Unable to open the admin repo list page : " + str(e))
+            except (ValueError, IndexError), e:
+                raise Exception("Error parsing the page to find the repo ids : " + str(e))
+            return self.repo_ids
+        finally:
+            self.lock.release()
+
+    def repository_id(self, fisheye_name):
+        """
+            The id of a repository in fisheye or None if it isn't there.
+            The repository list is only fetched if the name isn't cached.
+        """
+        self.lock.acquire()
+        try:
+            if fisheye_name not in self.repo_ids:
+                self.refresh_ids()
+            return self.repo_ids.get(fisheye_name)
+        finally:
+            self.lock.release()
 
-            self.browser.select_form(nr=0)
-            self.browser['repository.name'] = repo.fisheye_name
-            self.browser['repository.description'] = description
-            self.browser['repoTypeSelection'] = ['SVN']
-            self.browser['svn.url'] = 'file://%s' % repo.path_to_repo
-            self.browser['svnSymbolic.type'] = ['none']
 
+    def create_repository(self, repo, description):
+        """
+            Add a repository to fisheye.
+        """
+        self.lock.acquire()
+        try:
             try:
-                self.browser.submit()
-                result_url = self.browser.geturl().split('?')[0]
-                if result_url == FISHEYE_ADMIN_URL + '/viewRep.do':
-                    return True
-                elif result_url == FISHEYE_ADMIN_URL + '/addRep.do':
-                    return False
+                self._open('/addRep!default.do')
+
+                self.browser.select_form(nr=0)
+                self.browser['repository.name'] = repo.fisheye_name
+                self.browser['repository.description'] = description
+                self.browser['repoTypeSelection'] = ['SVN']
+                self.browser['svn.url'] = 'file://%s' % repo.path_to_repo
+                self.browser['svnSymbolic.type'] = ['none']
+
+                try:
+                    self.browser.submit()
+                    if self._at('/viewRep.do'):
+                        query = urlparse.urlparse(self.browser.geturl())[4]
+                        rep = cgi.parse_qs(query).get('rep')
+                        if rep:
+                            self.repo_ids[repo.fisheye_name] = int(rep[0])
+                            self._save_ids()
+                        return True
+                    elif self._at('/addRep.do'):
+                        return False
+                except HTTPError, e:
+                    raise Exception("Unable to post to create repo form : " + str(e))
             except HTTPError, e:
-                raise Exception("Unable to post to create repo form : " + str(e))
-        except HTTPError, e:
-            raise Exception("Unable to open the fisheye create repo page : " + str(e))
+                raise Exception("Unable to open the fisheye create repo page : " + str(e))
+        finally:
+            self.lock.release()
+
 
+    def _delete_form(self, rep, fisheye_name):
+        """
+            The form to delete the repository with id rep, or None if rep
+            isn't the id of the repository called fisheye_name.
+        """
+        try:
+            html = self._open('/deleteRep!default.do?rep=%d' % rep).read()
+        except HTTPError:
+            return None
+        if re.search(r'(?<![\w.-])%s(?![\w.-])' % re.escape(fisheye_name), html) is None:
+            return None
+        self.browser.select_form(nr=0)
+        return self.browser.form
 
     def delete_repository(self, repo):
         """
             Delete a repository from fisheye.
 
-            Open the repo list and figure out the repo id by parsing the page
+            Look up the repo id, in the cache or from the repo list
+            Open the delete page, checking it names the repo since the
+            cached id may be stale
             Click the link to stop repo
-            Click the delete link
-            Click the delete button on the subsequent form
+            Click the delete button on the delete page's form
         """
-        if not self.logged_in:
-            return False
-
-        fisheye_repo_id = -1
+        self.lock.acquire()
         try:
-            # Open the repository list
-            viewrep = self.browser.open(FISHEYE_ADMIN_URL + '/viewRepList.do')
-            soup = BeautifulSoup(viewrep.read())
-            # Find the list of repos on the left side
-            helpPane = soup.find("div", {"class" : "helpPane"})
-            links = helpPane("ul")[2]("a")
-            # Filter the links looking for the repo name (dept_name)
-            links = filter(lambda l: l.contents[0] == repo.fisheye_name, links)
-            if len(links) > 0:
-                link = links[0]
-            else:
+            fisheye_repo_id = self.repository_id(repo.fisheye_name)
+            if fisheye_repo_id is None:
                 return False
-            #Get the id out of there
-            fisheye_repo_id = int(link["href"].split("=")[1])
-        except HTTPError, e:
-            raise Exception("Unable to open the admin repo list page : " + str(e))
-        except ValueError, e:
-            raise Exception("Error parsing the page to find the repo id : " + str(e))
+            form = self._delete_form(fisheye_repo_id, repo.fisheye_name)
+            if form is None:
+                # Changed in fisheye behind our back. Look it up again.
+                self.repo_ids.pop(repo.fisheye_name, None)
+                self._save_ids()
+                fisheye_repo_id = self.repository_id(repo.fisheye_name)
+                if fisheye_repo_id is None:
+                    return False
+                form = self._delete_form(fisheye_repo_id, repo.fisheye_name)
+                if form is None:
+                    return False
+
+            try:
+                self._open('/manageRep.do?rep=%d&doStop=true' % fisheye_repo_id)
+                self.browser.open(form.click())
+            except HTTPError, e:
+                # The cached id may be stale. Look it up again next time.
+                self.repo_ids.pop(repo.fisheye_name, None)
+                self._save_ids()
+                raise Exception("Unable to delete the repo. : " + str(e))
+
+            self.repo_ids.pop(repo.fisheye_name, None)
+            self._save_ids()
+            return True
+        finally:
+            self.lock.release()
+
+
+__admin = None
+__admin_lock = threading.Lock()
+
+def admin():
+    """
+        The FisheyeAdmin this process shares, logged in with
+        config.FISHEYE_ADMIN_PW when it's first needed.
+    """
+    global __admin
+    __admin_lock.acquire()
+    try:
+        if __admin is None:
+            __admin = FisheyeAdmin(password=config.FISHEYE_ADMIN_PW)
+        return __admin
+    finally:
+        __admin_lock.release()
+
+
+class RateLimiter(object):
+    """
+        Spaces out calls shared by several threads so no more than rate
+        of them start each second. A rate of None or 0 means no limit.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next = time.time()
 
+    def wait(self):
+        if not self.rate:
+            return
+        self.lock.acquire()
         try:
-            stop_url = '/manageRep.do?rep=%d&doStop=true' % fisheye_repo_id
-            stop_url = FISHEYE_ADMIN_URL + stop_url
-            self.browser.open(stop_url)
+            now = time.time()
+            start = max(now, self.next)
+            self.next = start + 1.0 / self.rate
+        finally:
+            self.lock.release()
+        if start > now:
+            time.sleep(start - now)
 
-            delete_url = '/deleteRep!default.do?rep=%d' % fisheye_repo_id
-            delete_url = FISHEYE_ADMIN_URL + delete_url
-            self.browser.open(delete_url)
 
-            self.browser.select_form(nr=0)
-            self.browser.submit()
-            return True
-        except HTTPError, e:
-            raise Exception("Unable to delete the repo. : " + str(e))
+def plan_sync(wanted, managed, existing):
+    """
+        Work out what sync has to do. wanted are the fisheye names that
+        should be in fisheye, managed every fisheye name svnsh looks after
+        and existing the names fisheye has. Returns sorted lists of the
+        names to create, to delete and the ones svnsh doesn't manage.
+
+        >>> plan_sync(['a', 'b'], ['a', 'b', 'c', 'd'], ['b', 'c', 'x'])
+        (['a'], ['c'], ['x'])
+    """
+    wanted = sets.Set(wanted)
+    managed = sets.Set(managed) | wanted
+    existing = sets.Set(existing)
+    create = list(wanted - existing)
+    delete = list((existing & managed) - wanted)
+    unmanaged = list(existing - managed)
+    for names in (create, delete, unmanaged):
+        names.sort()
+    return create, delete, unmanaged
+
+
+def sync(wanted, known, workers=None, rate=None, dry_run=False, out=None):
+    """
+        Make fisheye match svnsh. wanted are the Repositories that should
+        have a fisheye instance and known every Repository svnsh manages.
+        Missing instances are created and instances of known repositories
+        that shouldn't have one are deleted. Fisheye instances of
+        repositories svnsh doesn't know about are left alone.
+
+        The changes are made by a pool of workers, each with its own
+        session, no faster than rate changes a second. The defaults are
+        config.FISHEYE_WORKERS and config.FISHEYE_RATE_LIMIT.
+
+        Returns a list of (fisheye name, error) for the changes that
+        failed.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if out is None:
+        out = sys.stdout
+    if workers is None:
+        workers = config.FISHEYE_WORKERS
+    if rate is None:
+        rate = config.FISHEYE_RATE_LIMIT
+
+    repos = dict([(repo.fisheye_name, repo) for repo in known])
+    repos.update([(repo.fisheye_name, repo) for repo in wanted])
+    ids = dict(admin().refresh_ids())
+    create, delete, unmanaged = plan_sync([repo.fisheye_name for repo in wanted],
+                                          repos.keys(), ids.keys())
 
+    for name in unmanaged:
+        print >>out, 'Leaving %s alone, svnsh does not manage it.' % name
+    for name in create:
+        print >>out, 'Fisheye is missing %s.' % name
+    for name in delete:
+        print >>out, 'Fisheye has %s, which should be off.' % name
+
+    jobs = [('create', name) for name in create] + [('delete', name) for name in delete]
+    if dry_run or not jobs:
+        return []
+
+    local = threading.local()
+    limiter = RateLimiter(rate)
+
+    def run(job):
+        action, name = job
+        if getattr(local, 'admin', None) is None:
+            # The workers share the saved session but not the id file,
+            # which is rewritten once they're done.
+            local.admin = FisheyeAdmin(password=config.FISHEYE_ADMIN_PW, id_file=os.devnull)
+            local.admin.repo_ids = dict(ids)
+        limiter.wait()
+        repo = repos[name]
+        try:
+            if action == 'create':
+                ok = local.admin.create_repository(repo, repo.path)
+            else:
+                ok = local.admin.delete_repository(repo)
+        except Exception, e:
+            return action, name, str(e)
+        if not ok:
+            return action, name, 'fisheye refused to %s it' % action
+        return action, name, None
+
+    workers = max(1, min(workers, len(jobs)))
+    failures = []
+    pool = ThreadPool(workers)
+    try:
+        for action, name, error in pool.imap_unordered(run, jobs):
+            if error is None:
+                print >>out, '%s %s.' % ((action == 'create') and 'Created' or 'Deleted', name)
+            else:
+                print >>out, 'Failed to %s %s: %s' % (action, name, error)
+                failures.append((name, error))
+        pool.close()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.join()
+
+    admin().refresh_ids()
+    return failures
+
+
+def _test():
+    import doctest
+    doctest.testmod()
 
 if __name__ == "__main__":
-    pass
+    _test()
     # from getpass import getpass
     #     password = getpass('Fisheye admin pw : ')
     #
@@ -148,4 +482,3 @@ if __name__ == "__main__":
     #     fisheye.login(password)
     #     fisheye.add_repository("testy", "its", "A test!")
     #     fisheye.delete_repository(name="testy", department="its")
-
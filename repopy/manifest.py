@@ -0,0 +1,106 @@
+"""
+Which of a repository's generated files are up to date.
+
+Four files are generated from each repository: the YAML descriptor (and
+its sidecar), the fisheye auth file, the Apache authz and the Apache
+conf. Each depends on only part of the repository. The authz comes from
+the groups and authorizations, the fisheye auth file from the groups and
+the authorizations on /, and the conf from the repository's paths and
+the template.
+
+The manifest next to the descriptor (sakai.yaml -> sakai.manifest)
+records the SHA-1 of the inputs each file was last written from. A file
+only needs writing when its inputs hash differently or it's missing.
+Files edited by hand aren't noticed, flush --force rewrites everything.
+
+The hashes include GENERATOR_VERSION, and the conf's includes the
+template's version, so changing how a file is written or editing the
+template makes every existing copy out of date.
+"""
+
+import os
+import marshal
+import hashlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import fileio
+from descriptor import _to_tuples
+
+# Replaces .yaml in the descriptor path to name its manifest.
+MANIFEST_SUFFIX = '.manifest'
+# Bump this when the way any of the files are written changes.
+GENERATOR_VERSION = 1
+
+
+def manifest_path(yaml_path):
+    """The path of the manifest for the descriptor at yaml_path."""
+    return os.path.splitext(yaml_path)[0] + MANIFEST_SUFFIX
+
+def digest(*parts):
+    """The SHA-1 of parts, which must be data marshal can write."""
+    return hashlib.sha1(marshal.dumps((GENERATOR_VERSION,) + parts)).hexdigest()
+
+def digests(repo):
+    """
+    The hashes of the inputs of the descriptor, fisheye auth file and
+    authz for repo, by name.
+    """
+    state = _to_tuples(repo)
+    authorizations, groups = state['authorizations'], state['groups']
+    state = state.items()
+    state.sort()
+    return {'yaml': digest('yaml', tuple(state)),
+            'fisheyeauth': digest('fisheyeauth', repo.fisheye, groups,
+                                  tuple([auth for auth in authorizations if auth[0] == '/'])),
+            'authz': digest('authz', authorizations, groups)}
+
+def template_digest(template, data):
+    """The hash of the parts of data template uses and its version."""
+    template.load()
+    return digest('template', template.version,
+                  tuple([(key, data[key]) for key in sorted(template.keys)]))
+
+
+class Manifest(object):
+    """The input hashes recorded for one repository's files."""
+
+    def __init__(self, yaml_path):
+        self.path = manifest_path(yaml_path)
+        self.digests = {}
+        self.changed = False
+        try:
+            f = open(self.path, 'rb')
+            try:
+                self.digests = dict([(str(name), str(value))
+                                     for name, value in json.load(f).items()])
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError, AttributeError):
+            # No manifest, or a bad one, means everything is rewritten.
+            pass
+
+    def stale(self, name, digest, path):
+        """Does the file at path, last written as name, need writing?"""
+        return self.digests.get(name) != digest or not os.path.exists(path)
+
+    def record(self, name, digest):
+        """Note that name was written from inputs with digest."""
+        if self.digests.get(name) != digest:
+            self.digests[name] = digest
+            self.changed = True
+
+    def forget(self, name):
+        if name in self.digests:
+            del self.digests[name]
+            self.changed = True
+
+    def save(self):
+        """Write the manifest if anything was recorded."""
+        if not self.changed:
+            return
+        fileio.write_file(self.path, json.dumps(self.digests, sort_keys=True))
+        self.changed = False
@@ -0,0 +1,320 @@
+"""
+Notification emails sent in the background.
+
+Commands don't talk to the mail server. Each notification is written to
+a spool directory, config.NOTIFY_SPOOL, as a small JSON file and a
+background thread sends them. Grants made close together are collected
+into one email per user, and all of the emails are sent over a single
+SMTP connection.
+
+A notification is only removed from the spool once it's been sent, so
+anything that couldn't be sent, because the mail server was down or
+svnsh exited or crashed, is sent the next time svnsh sends mail. When
+svnsh exits normally it sends whatever is waiting first.
+
+Several svnsh processes share the spool. Only one of them sends at a
+time, holding a lock on SPOOL_LOCK, so nothing is sent twice. A
+notification the mail server rejects outright, for a bad address say,
+is moved to the failed directory in the spool instead of being retried
+forever. Anything else that goes wrong sending to one user is retried
+later and doesn't hold up the others.
+"""
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import atexit
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import config
+
+# Spool files end with this. Files being written don't.
+SPOOL_SUFFIX = '.json'
+# Locked by whichever process is sending.
+SPOOL_LOCK = '.lock'
+# Where rejected notifications go, in the spool.
+FAILED_DIR = 'failed'
+
+MODE_NAMES = {'rw': 'write', 'r': 'read'}
+
+SUBJECT = 'Subversion access granted'
+
+GREETING = """Hello %(user)s,
+
+"""
+
+GRANT = """You've been granted %(mode)s access on %(path)s for the repository located at %(url)s.
+"""
+
+SIGNATURE = """
+Have fun!
+SVN Admins
+"""
+
+
+def format_digest(user, grants):
+    """
+    The body of the email telling user about a list of grants, each a
+    dictionary with the mode, path and url.
+    """
+    lines = [GREETING % {'user': user}]
+    for grant in grants:
+        lines.append(GRANT % {'mode': MODE_NAMES.get(grant['mode'], grant['mode']),
+                              'path': grant['path'],
+                              'url': grant['url']})
+    lines.append(SIGNATURE)
+    return ''.join(lines)
+
+
+class Notifier(object):
+    """A spool of notifications and the thread that sends them."""
+
+    def __init__(self, spool=None, delay=None):
+        if spool is None:
+            spool = config.NOTIFY_SPOOL
+        if delay is None:
+            delay = config.NOTIFY_DELAY
+        self.spool = spool
+        self.delay = delay
+
+        self._condition = threading.Condition()
+        self._pending = False
+        self._stopping = False
+        self._thread = None
+        self._registered = False
+        # Only one thread sends at a time.
+        self._send_lock = threading.Lock()
+        self._count = 0
+
+    def addauth(self, user, repo, path, mode):
+        """Tell user they were granted mode access to path in repo."""
+        self._write({'user': user, 'repository': repo.path, 'url': repo.url,
+                     'path': path, 'mode': mode})
+        self._wake()
+
+    def _write(self, message):
+        if not os.path.isdir(self.spool):
+            os.makedirs(self.spool)
+        self._condition.acquire()
+        try:
+            self._count += 1
+            name = '%017.6f-%d-%d' % (time.time(), os.getpid(), self._count)
+        finally:
+            self._condition.release()
+
+        # Written under another name and renamed so the sender never sees
+        # half a file.
+        partial = os.path.join(self.spool, name + '.partial')
+        f = open(partial, 'w')
+        try:
+            json.dump(message, f)
+        finally:
+            f.close()
+        os.rename(partial, os.path.join(self.spool, name + SPOOL_SUFFIX))
+
+    def _wake(self):
+        self._condition.acquire()
+        try:
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='svnsh-notify')
+                self._thread.setDaemon(True)
+                self._thread.start()
+                if not self._registered:
+                    atexit.register(self.close)
+                    self._registered = True
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def _work(self):
+        while True:
+            self._condition.acquire()
+            try:
+                while not (self._pending or self._stopping):
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                # Give related grants a moment to arrive so they share an
+                # email.
+                deadline = time.time() + self.delay
+                while not self._stopping and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                if self._stopping:
+                    return
+                self._pending = False
+            finally:
+                self._condition.release()
+
+            try:
+                self.send()
+            except Exception, e:
+                print >>sys.stderr, 'Unable to send notifications, they will be retried: %s' % e
+
+    def pending(self):
+        """The names of the spool files waiting to be sent, oldest first."""
+        try:
+            names = [n for n in os.listdir(self.spool) if n.endswith(SPOOL_SUFFIX)]
+        except OSError:
+            return []
+        names.sort()
+        return names
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.spool, name))
+        except OSError, e:
+            # Sent already, by another process.
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _fail(self, name):
+        failed = os.path.join(self.spool, FAILED_DIR)
+        if not os.path.isdir(failed):
+            os.makedirs(failed)
+        try:
+            os.rename(os.path.join(self.spool, name), os.path.join(failed, name))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def send(self):
+        """
+        Send everything in the spool now, one email per user over one SMTP
+        connection. Returns the number of emails sent.
+        """
+        self._send_lock.acquire()
+        try:
+            if not self.pending():
+                return 0
+            # Other processes wait for this one to finish, then find
+            # what it sent gone from the spool.
+            lock = open(os.path.join(self.spool, SPOOL_LOCK), 'a')
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                return self._send()
+            finally:
+                lock.close()
+        finally:
+            self._send_lock.release()
+
+    def _send(self):
+        names = self.pending()
+        if not names:
+            return 0
+
+        # user -> [(name, message)] in the order they were granted.
+        by_user = {}
+        users = []
+        for name in names:
+            try:
+                f = open(os.path.join(self.spool, name))
+                try:
+                    message = json.load(f)
+                finally:
+                    f.close()
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    print >>sys.stderr, 'Skipping unreadable notification %s: %s' % (name, e)
+                continue
+            except ValueError, e:
+                print >>sys.stderr, 'Skipping unreadable notification %s: %s' % (name, e)
+                continue
+            user = message['user']
+            if user not in by_user:
+                by_user[user] = []
+                users.append(user)
+            by_user[user].append((name, message))
+        if not users:
+            return 0
+
+        import smtplib
+        from email.mime.text import MIMEText
+        from email.utils import formatdate
+
+        server = smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT)
+        sent = 0
+        try:
+            for user in users:
+                to = '%s@%s' % (user, config.EMAIL_DOMAIN)
+                msg = MIMEText(format_digest(user, [m for n, m in by_user[user]]))
+                msg['From'] = config.EMAIL_FROM
+                msg['To'] = to
+                msg['Subject'] = SUBJECT
+                msg['Date'] = formatdate(localtime=True)
+                try:
+                    server.sendmail(config.EMAIL_FROM, [to], msg.as_string())
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError), e:
+                    # A refused recipient's code is only in recipients.
+                    if isinstance(e, smtplib.SMTPRecipientsRefused):
+                        code = e.recipients.get(to, (550,))[0]
+                    else:
+                        code = e.smtp_code
+                    if code >= 500:
+                        print >>sys.stderr, 'Notification to %s rejected, moved to %s: %s' % \
+                                    (to, os.path.join(self.spool, FAILED_DIR), e)
+                        for name, message in by_user[user]:
+                            self._fail(name)
+                    else:
+                        print >>sys.stderr, 'Notification to %s will be retried: %s' % (to, e)
+                    continue
+                sent += 1
+                for name, message in by_user[user]:
+                    self._remove(name)
+        finally:
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                pass
+        return sent
+
+    def close(self, timeout=30):
+        """
+        Stop the background thread and send anything still waiting.
+        Whatever can't be sent stays in the spool.
+        """
+        self._condition.acquire()
+        try:
+            thread = self._thread
+            self._stopping = True
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        if thread is not None:
+            thread.join(timeout)
+
+        try:
+            self.send()
+        except Exception, e:
+            print >>sys.stderr, '%d notification%s left in %s: %s' % \
+                        (len(self.pending()), (len(self.pending()) != 1) and 's' or '',
+                         self.spool, e)
+
+        self._condition.acquire()
+        try:
+            self._thread = None
+            self._stopping = False
+        finally:
+            self._condition.release()
+
+
+__notifier = None
+__notifier_lock = threading.Lock()
+
+def notifier():
+    """The Notifier everything in this process shares."""
+    global __notifier
+    __notifier_lock.acquire()
+    try:
+        if __notifier is None:
+            __notifier = Notifier()
+        return __notifier
+    finally:
+        __notifier_lock.release()
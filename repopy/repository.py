@@ -1,24 +1,36 @@
 import os
 import shutil
-import commands
-import tarfile
 import sets
 import itertools
-import yaml
+import bisect
+import operator
+import subprocess
 
 from pwd import getpwnam
 
 import config
+import fileio
 
-def _run_command(cmd):
-    status, output = commands.getstatusoutput(cmd)
+def _run_args(args):
+    """
+    Run a program with a list of arguments, no shell involved. Returns
+    its output and raises an Exception with the output if it fails.
+    """
     if config.VERBOSE:
-        print cmd
-        print output
-
-    if not status == 0:
+        print ' '.join(args)
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               close_fds=True)
+    output = process.communicate()[0]
+    if process.returncode != 0:
         raise Exception, output
-    return (status, output)
+    return output
+
+def _chown_tree(path, uid, gid):
+    """Set the owner of path and everything under it in one pass."""
+    os.lchown(path, uid, gid)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            os.lchown(os.path.join(root, name), uid, gid)
 
 # The prefix could be None or a string of the form "some/path/to"
 def _make_path(prefix, name, sep="/"):
@@ -59,37 +71,101 @@ class Repository (object):
         return _make_path(self.prefix, self.name)
     path = property(_get_path)
 
+    def _get_authorizations(self):
+        return self._authorizations
+
+    def _set_authorizations(self, authorizations):
+        """
+        Replace all of the authorizations and rebuild the indexes.
+
+        The authorizations are kept sorted in self._authorizations. The
+        sort keys are kept in a parallel list so the position of an
+        authorization can be found with bisect. self._auth_index maps
+        (path, user) to the authorizations for that pair and
+        self._user_paths maps a user to the paths they have
+        authorizations for.
+
+        Finding where an authorization goes takes O(log n) and lookups
+        through the indexes are O(1), but add_auth and remove_auth still
+        shift the lists along, which is O(n). That's a memmove of
+        pointers, cheap next to writing the descriptor out.
+        """
+        self._authorizations = list(authorizations)
+        self._authorizations.sort(key=Auth.key)
+        self._auth_keys = [a.key() for a in self._authorizations]
+        self._auth_index = {}
+        self._user_paths = {}
+        for auth in self._authorizations:
+            self._index_auth(auth)
+
+    authorizations = property(_get_authorizations, _set_authorizations)
+
+    def _index_auth(self, auth):
+        self._auth_index.setdefault((auth.path, auth.user), []).append(auth)
+        self._user_paths.setdefault(auth.user, sets.Set()).add(auth.path)
+
+    def __getstate__(self):
+        """
+        Only the authorizations list is saved. The indexes are rebuilt
+        from it when the repository is loaded.
+        """
+        state = self.__dict__.copy()
+        for attr in ('_authorizations', '_auth_keys', '_auth_index', '_user_paths'):
+            del state[attr]
+        state['authorizations'] = self._authorizations
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        authorizations = state.pop('authorizations', [])
+        self.__dict__.update(state)
+        self.authorizations = authorizations
+
+    def _get_url(self):
+        """The URL users check the repository out from."""
+        return '%s%s/%s/%s' % (config.URL_PREFIX, config.SVN_SERVER,
+                               config.SVN_PREFIX, self.path)
+    url = property(_get_url)
+
     def _path_to_repo(self):
         """Where is this Repository located on the filesystem?"""
         return os.path.join(config.REPO_ROOT, _make_path(self.prefix, self.name))
     path_to_repo = property(_path_to_repo)
 
     def dump(self, filename):
-        cmd = "%s dump %s > %s" % (config.SVNADMIN, self.path_to_repo, filename)
-        _run_command(cmd)
+        """
+        Dump the repository to filename uncompressed. See repopy.backup
+        for compressed backups.
+        """
+        f = open(filename, 'wb')
+        try:
+            status = subprocess.call([config.svnadmin(), 'dump', '--quiet',
+                                      self.path_to_repo], stdout=f, close_fds=True)
+        finally:
+            f.close()
+        if status != 0:
+            raise SVNRepositoryException('Error dumping %s with svnadmin.' % self.path)
 
     def create(self):
-        """Create the repository on the filesystem."""
+        """
+        Create the repository on the filesystem and give it to the Apache
+        user. This is safe to call from several threads at once.
+        """
         try:
             apache_uid, apache_gid = getpwnam(config.APACHE_USER)[2:4]
         except KeyError, e:
             raise SVNRepositoryException('No passwd entry for Apache user: %s' % config.APACHE_USER)
 
         os.makedirs(self.path_to_repo)
-        print 'Create %s' % self.path_to_repo
-        cmd = "%s --fs-type fsfs create %s" % (config.SVNADMIN, self.path_to_repo)
-        status, output = _run_command(cmd)
-
-        if not status == 0:
-            raise SVNRepositoryException('Error creating repository with svnadmin: %s' % output)
+        try:
+            _run_args([config.svnadmin(), '--fs-type', 'fsfs', 'create', self.path_to_repo])
+        except Exception, e:
+            shutil.rmtree(self.path_to_repo, True)
+            raise SVNRepositoryException('Error creating repository with svnadmin: %s' % e)
 
-        os.chown(self.path_to_repo, apache_uid, apache_gid)
-        for root, dirs, files in os.walk(self.path_to_repo):
-            for path in [ os.path.join(root, f) for f in dirs + files]:
-                os.chown(path, apache_uid, apache_gid)
-                print "ownership of '%s' set to '%s:%s'" % (self.path_to_repo,
-                                                            config.APACHE_USER,
-                                                            config.APACHE_GROUP)
+        # Nothing to do if we're already running as the Apache user.
+        if (os.geteuid(), os.getegid()) != (apache_uid, apache_gid):
+            _chown_tree(self.path_to_repo, apache_uid, apache_gid)
 
 
     def exists(path):
@@ -107,10 +183,14 @@ class Repository (object):
     exists = staticmethod(exists)
 
     def delete(self):
-        """Delete a repository from the filesystem."""
-        shutil.rmtree(self.path)
-        os.remove(self.apache_authz)
-        os.remove(self.apache_conf)
+        """
+        Delete a repository and its apache files from the filesystem.
+        Files that are already gone are skipped.
+        """
+        shutil.rmtree(self.path_to_repo)
+        for path in (self.apache_authz, self.apache_conf):
+            if os.path.exists(path):
+                os.remove(path)
 
     def add_auth(self, path_in_repo, user, mode):
         """
@@ -135,30 +215,35 @@ class Repository (object):
             raise ValueError('Auth( %s, %s, %s ) already exists.' % \
                                 (path_in_repo, user, mode))
 
-        self.authorizations.append(Auth(path_in_repo, user, mode))
-        self.authorizations.sort()
-
-    def authz(self):
-        """ Make an string to write to an authz file."""
-        l = []
+        auth = Auth(path_in_repo, user, mode)
+        key = auth.key()
+        i = bisect.bisect_right(self._auth_keys, key)
+        self._auth_keys.insert(i, key)
+        self._authorizations.insert(i, auth)
+        self._index_auth(auth)
 
+    def iter_authz(self):
+        """
+        Generate the lines of the authz file in one pass over the sorted
+        authorizations. Each line includes its newline.
+        """
         if len(self.groups) > 0:
-            l.append('[groups]')
+            yield '[groups]\n'
         for group in self.groups:
             if len(group.members) > 0 :
-                l.append( "%s = %s" % (group.name, ", ".join(group.members)) )
+                yield "%s = %s\n" % (group.name, ", ".join(group.members))
 
-        l.append('')
-        paths = dict([ (a.path,1) for a in self.authorizations ]).keys()
-        paths.sort()
-        for path in paths:
-            l.append('[%s]' % path)
-            for auth in self.authorizations:
-                if auth.path == path:
-                    l.append('%s = %s' % (auth.user, auth.mode))
-            l.append('')
+        yield '\n'
+        for path, auths in itertools.groupby(self._authorizations,
+                                             operator.attrgetter('path')):
+            yield '[%s]\n' % path
+            for auth in auths:
+                yield '%s = %s\n' % (auth.user, auth.mode)
+            yield '\n'
 
-        return '\n'.join(l) + "\n"
+    def authz(self):
+        """ Make an string to write to an authz file."""
+        return ''.join(self.iter_authz())
 
 
     def has_auth(self, path_in_repo, user, mode):
@@ -174,15 +259,16 @@ class Repository (object):
         if user[0] == '@' and user[1:] not in [g.name for g in self.groups]:
             raise ValueError('Group %s is not a valid group for this repository.' % user)
 
-        for auth in self.authorizations:
-            if auth.path == path_in_repo and auth.user == user and auth.mode == mode:
+        for auth in self._auth_index.get((path_in_repo, user), ()):
+            if auth.mode == mode:
                 return True
 
         return False
 
-    def remove_auth(self, path_in_repo, user):
+    def remove_auth(self, path_in_repo, user, mode=None):
         """
-        Remove a specific authorization from the repository.
+        Remove a specific authorization from the repository. Without a
+        mode every mode user has on path_in_repo goes.
 
         >>> r = Repository("test_repo", "test_dept", False)
         >>> r.add_auth('/test1', 'test_user1', Auth.READ_WRITE)
@@ -191,10 +277,30 @@ class Repository (object):
         >>> r.remove_auth('/test1', 'test_user2')
         >>> r.authorizations
         [Auth(/test1, test_user1, rw), Auth(/test2, test_user2, rw)]
+        >>> r.add_auth('/test2', 'test_user2', Auth.READ_ONLY)
+        >>> r.remove_auth('/test2', 'test_user2', Auth.READ_WRITE)
+        >>> r.authorizations
+        [Auth(/test1, test_user1, rw), Auth(/test2, test_user2, r)]
 
         """
-        self.authorizations = [ a for a in self.authorizations if not (a.user == user and
-                                                                    a.path == path_in_repo) ]
+        auths = self._auth_index.pop((path_in_repo, user), [])
+        if mode is not None:
+            kept = [auth for auth in auths if auth.mode != mode]
+            auths = [auth for auth in auths if auth.mode == mode]
+            if kept:
+                self._auth_index[(path_in_repo, user)] = kept
+        for auth in auths:
+            i = bisect.bisect_left(self._auth_keys, auth.key())
+            while self._authorizations[i] is not auth:
+                i += 1
+            del self._auth_keys[i]
+            del self._authorizations[i]
+
+        paths = self._user_paths.get(user)
+        if paths is not None and (path_in_repo, user) not in self._auth_index:
+            paths.discard(path_in_repo)
+            if not paths:
+                del self._user_paths[user]
 
     def remove_group(self, group):
         """
@@ -213,9 +319,29 @@ class Repository (object):
         """
 
         self.groups = filter(lambda g: not g.name == group, self.groups)
-        self.authorizations = filter(lambda a: a.user != ('@%s' % group), self.authorizations)
+        self.remove_user('@%s' % group)
 
 
+    def remove_member(self, user):
+        """
+        Remove a user from every group they're a member of. Returns the
+        names of those groups.
+
+        >>> r = Repository('bar', 'foo', False)
+        >>> r.groups.append(Group('g1', ['ford', 'arthur']))
+        >>> r.groups.append(Group('g2', ['arthur']))
+        >>> r.remove_member('ford')
+        ['g1']
+        >>> r.groups
+        [Group(g1, ['arthur']), Group(g2, ['arthur'])]
+        """
+        removed = []
+        for group in self.groups:
+            if user in group.members:
+                group.remove(user)
+                removed.append(group.name)
+        return removed
+
     def remove_user(self, user):
         """
         Remove all of a users permissions.
@@ -232,8 +358,8 @@ class Repository (object):
         []
 
         """
-        self.authorizations = filter(lambda a: a.user != user,
-                                     self.authorizations)
+        for path in list(self._user_paths.get(user, ())):
+            self.remove_auth(path, user)
 
 
     def users(self):
@@ -265,7 +391,7 @@ class Repository (object):
         return users
 
     def write_authz(self):
-        open(self.apache_authz, 'w').write(self.authz())
+        fileio.write_file(self.apache_authz, self.iter_authz())
 
 
 class Group (object):
@@ -347,6 +473,10 @@ class Auth (object):
         return "Auth(%s, %s, %s)" % (self. path, self.user, self.mode)
 
 
+    def key(self):
+        """The sort key for an Auth. See __cmp__."""
+        return (self.path, self.mode, self.user)
+
     def __cmp__(self, other):
         if not other:
             return 1
@@ -363,13 +493,7 @@ class Auth (object):
             >>> as
             [Auth(/, esf221, r), Auth(/, esf221, rw), Auth(/eeee, esf221, rw)]
         """
-        pc = cmp(self.path, other.path)
-        if pc: return pc
-
-        mc = cmp(self.mode, other.mode)
-        if mc: return mc
-
-        return cmp(self.user, other.user)
+        return cmp(self.key(), other.key())
 
 def _test():
     import doctest
@@ -0,0 +1,309 @@
+"""
+Run svnsh commands in a long lived process over a Unix socket.
+
+The server keeps the imports, the svn client, the catalog and the loaded
+descriptors warm between requests. A client connects, sends one request
+and reads one response. Both are a line of JSON:
+
+    {"argv": ["addauth", "its/sakai", "/", "neil", "rw"]}
+    {"status": 0, "output": "..."}
+
+status is the exit status svnsh.py would have returned and output is
+everything the command printed.
+
+Requests go on a queue served by a fixed pool of worker threads.
+Commands on the same repository run one at a time. Commands on
+different repositories run at the same time. Commands that aren't about
+a single repository, like reindex or addauth --from, wait for everything
+else to finish and run alone.
+
+Transactions belong to one shell session so begin, rollback and commit
+without a repository aren't available through the server. Commands that
+prompt for input fail because the server has no terminal.
+"""
+
+import os
+import sys
+import signal
+import socket
+import threading
+import traceback
+import Queue
+import SocketServer
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from StringIO import StringIO
+
+import config
+
+# Commands that only make sense in a single shell session.
+SESSION_COMMANDS = ('begin', 'rollback')
+
+
+###############################################################################
+# Client
+
+def request(argv, socket_path=None):
+    """
+    Send argv to the server listening on socket_path and return
+    (status, output).
+    """
+    if socket_path is None:
+        socket_path = config.SERVER_SOCKET
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({'argv': list(argv)}) + '\n')
+        f = sock.makefile('r')
+        try:
+            response = json.loads(f.readline())
+        finally:
+            f.close()
+    finally:
+        sock.close()
+    return response['status'], response['output']
+
+
+###############################################################################
+# Server
+
+class _ThreadOutput(object):
+    """
+    Replaces sys.stdout and sys.stderr. Threads running a command write to
+    their own buffer. Everything else goes to the real stream.
+    """
+
+    def __init__(self, stream, local):
+        self.stream = stream
+        self.local = local
+
+    def write(self, data):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            self.stream.write(data)
+        else:
+            buffer.write(data)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class _FleetLock(object):
+    """
+    A shared/exclusive lock. Commands on one repository hold it shared,
+    commands on many repositories hold it exclusively.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared = 0
+        self.exclusive = False
+        self.waiting_exclusive = 0
+
+    def acquire(self, exclusive):
+        self.condition.acquire()
+        try:
+            if exclusive:
+                self.waiting_exclusive += 1
+                while self.exclusive or self.shared:
+                    self.condition.wait()
+                self.waiting_exclusive -= 1
+                self.exclusive = True
+            else:
+                # Don't starve a waiting exclusive request.
+                while self.exclusive or self.waiting_exclusive:
+                    self.condition.wait()
+                self.shared += 1
+        finally:
+            self.condition.release()
+
+    def release(self, exclusive):
+        self.condition.acquire()
+        try:
+            if exclusive:
+                self.exclusive = False
+            else:
+                self.shared -= 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+class CommandServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Accepts requests and runs them on a pool of workers."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, workers=None):
+        if socket_path is None:
+            socket_path = config.SERVER_SOCKET
+        if workers is None:
+            workers = config.SERVER_WORKERS
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        SocketServer.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        os.chmod(socket_path, config.SERVER_SOCKET_MODE)
+        self.socket_path = socket_path
+
+        self.queue = Queue.Queue()
+        self.fleet_lock = _FleetLock()
+        self.repo_locks = {}
+        self.repo_locks_lock = threading.Lock()
+
+        self.local = threading.local()
+        sys.stdout = _ThreadOutput(sys.stdout, self.local)
+        sys.stderr = _ThreadOutput(sys.stderr, self.local)
+        # Nobody is there to answer a prompt.
+        sys.stdin = StringIO()
+
+        import repopy.shell
+        self.shell = repopy.shell
+
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name='svnsh-worker-%d' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+
+    def server_bind(self):
+        # bind creates the socket file. Create it with no more than
+        # SERVER_SOCKET_MODE so nobody can connect before the chmod.
+        umask = os.umask(0777 & ~config.SERVER_SOCKET_MODE)
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+    def submit(self, argv):
+        """Queue argv to be run and wait for (status, output)."""
+        done = threading.Event()
+        job = {'argv': argv, 'done': done}
+        self.queue.put(job)
+        done.wait()
+        return job['status'], job['output']
+
+    def _repo_lock(self, key):
+        self.repo_locks_lock.acquire()
+        try:
+            lock = self.repo_locks.get(key)
+            if lock is None:
+                lock = self.repo_locks[key] = threading.Lock()
+            return lock
+        finally:
+            self.repo_locks_lock.release()
+
+    def _lock_key(self, argv):
+        """
+        The repository a command works on, or None if it works on more
+        than one repository or on none.
+        """
+        import repopy.command
+
+        if argv[0] not in repopy.command.__all__:
+            return None
+        command = getattr(repopy.command, argv[0])
+        try:
+            options, args = command.parser.parse_args(args=argv[1:])
+        except Exception:
+            return None
+        for fleet_option in ('from_file', 'all', 'batch'):
+            if getattr(options, fleet_option, None):
+                return None
+        if not args:
+            return None
+        # fisheye sync goes through every repository.
+        if argv[0] == 'fisheye' and args[0] == 'sync':
+            return None
+        # PREFIX/* and other patterns name many repositories.
+        if [c for c in '*?[' if c in args[0]]:
+            return None
+        return '/'.join([part for part in args[0].split('/') if part])
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            self.local.buffer = StringIO()
+            try:
+                try:
+                    job['status'] = self._run(job['argv'])
+                except:
+                    traceback.print_exc()
+                    job['status'] = self.shell.EXIT_ERROR
+            finally:
+                job['output'] = self.local.buffer.getvalue()
+                self.local.buffer = None
+                job['done'].set()
+
+    def _run(self, argv):
+        if not argv:
+            return self.shell.EXIT_OK
+        if argv[0] in SESSION_COMMANDS or argv == ['commit']:
+            print 'Transactions are not available through the server.'
+            return self.shell.EXIT_USAGE
+
+        key = self._lock_key(argv)
+        exclusive = key is None
+        self.fleet_lock.acquire(exclusive)
+        try:
+            if exclusive:
+                return self.shell.run_command(argv)
+            lock = self._repo_lock(key)
+            lock.acquire()
+            try:
+                return self.shell.run_command(argv)
+            finally:
+                lock.release()
+        finally:
+            self.fleet_lock.release(exclusive)
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            argv = [isinstance(arg, unicode) and arg.encode('utf-8') or str(arg)
+                    for arg in request['argv']]
+        except (ValueError, KeyError, TypeError), e:
+            status, output = 2, 'Malformed request: %s\n' % e
+        else:
+            status, output = self.server.submit(argv)
+        self.wfile.write(json.dumps({'status': status, 'output': output}) + '\n')
+
+
+def serve(socket_path=None, workers=None):
+    """Run the server until it's interrupted."""
+    server = CommandServer(socket_path, workers)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, stop)
+
+    print 'svnsh server listening on %s with %d workers.' % (server.socket_path,
+                                                            len(server.workers))
+    try:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.server_close()
@@ -13,6 +13,74 @@ except:
     pass
 
 
+# Exit statuses for commands run without the interactive shell.
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_UNKNOWN_COMMAND = 127
+
+
+def run_command(argv):
+    """
+    Run the command named by argv[0] with the rest of argv as its
+    arguments. Errors are printed to stderr. Returns an exit status.
+    """
+    if not argv:
+        return EXIT_OK
+
+    name = argv[0]
+    if name == 'help' and len(argv) == 2 and argv[1] in repopy.command.__all__:
+        getattr(repopy.command, argv[1]).help()
+        return EXIT_OK
+    if name not in repopy.command.__all__:
+        print >> sys.stderr, 'Unknown command: %s' % name
+        print >> sys.stderr, 'Commands: %s' % ', '.join(sorted(repopy.command.__all__))
+        return EXIT_UNKNOWN_COMMAND
+
+    command = getattr(repopy.command, name)
+    try:
+        command(argv[1:])
+    except (CommandArgumentError, CommandOptionError), e:
+        print >> sys.stderr, e
+        print >> sys.stderr, command.usage
+        return EXIT_USAGE
+    except CommandError, e:
+        print >> sys.stderr, e
+        return EXIT_ERROR
+    return EXIT_OK
+
+
+def run_script(f, name='<script>'):
+    """
+    Run the commands in the file object f, one per line. Blank lines and
+    lines starting with # are skipped. Stops at the first command that
+    fails and returns its exit status. A transaction left open at the end
+    of the script is rolled back and counts as a failure.
+    """
+    for lineno, line in enumerate(f):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            argv = shlex.split(line)
+        except ValueError, e:
+            print >> sys.stderr, '%s:%d: %s' % (name, lineno + 1, e)
+            return EXIT_USAGE
+
+        status = run_command(argv)
+        if status != EXIT_OK:
+            print >> sys.stderr, '%s:%d: %s failed.' % (name, lineno + 1, argv[0])
+            repopy.command.rollback_transaction()
+            return status
+
+    if repopy.command.in_transaction():
+        repopy.command.rollback_transaction()
+        print >> sys.stderr, '%s: the transaction was not committed. ' \
+                             'Its changes were discarded.' % name
+        return EXIT_ERROR
+    return EXIT_OK
+
+
 def _make_do_cmd(command):
     def do_cmd(self, line):
         args = shlex.split(line)
@@ -51,6 +119,10 @@ class Shell(cmd.Cmd):
 
 
     def do_exit(self, arg):
+        discarded = repopy.command.rollback_transaction()
+        if discarded:
+            print 'Discarded %d uncommitted change%s.' % (discarded,
+                                                          (discarded != 1) and 's' or '')
         sys.exit(0)
 
 
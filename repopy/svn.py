@@ -1,4 +1,5 @@
 import pysvn
+import threading
 
 from getpass import getpass
 
@@ -11,6 +12,8 @@ class Client(object):
     """Dispatcher class for the Subversion Client"""
 
     __client = None
+    # pysvn clients can't be used by two threads at once.
+    __lock = threading.RLock()
 
     class LoginPrompt(object):
         """
@@ -83,7 +86,11 @@ class Client(object):
             print 'SVNCient.add()'
             print '\tpath: %s' % path
         else:
-            return self.__client.add(path)
+            self.__lock.acquire()
+            try:
+                return self.__client.add(path)
+            finally:
+                self.__lock.release()
 
     def checkin(self, paths, message):
         if config.MOCK_SVN_COMMANDS:
@@ -91,11 +98,19 @@ class Client(object):
             print '\tpaths: %s' % ', '.join(paths)
             print '\tmessage: %s' % message
         else:
-            return self.__client.checkin(paths, message)
+            self.__lock.acquire()
+            try:
+                return self.__client.checkin(paths, message)
+            finally:
+                self.__lock.release()
 
     def remove(self, path):
         if config.MOCK_SVN_COMMANDS:
             print 'SVNCient.remove()'
             print '\tpath: %s' % path
         else:
-            return self.__client.remove(path)
+            self.__lock.acquire()
+            try:
+                return self.__client.remove(path)
+            finally:
+                self.__lock.release()
@@ -1,12 +1,22 @@
 
 import os
+import re
+import hashlib
 import repopy.config as config
 
+import fileio
+
+# The %(name)s keys a template uses. %% is a literal %.
+_KEY = re.compile(r'%(?:%|\((\w+)\))')
+
 class Template:
     """
     A very simple template class. Basically a wrapper around the
     printf style string substition.
 
+    The template is read and checked once, the first time it's used.
+    Then keys is the set of parameters it uses and version a hash of the
+    template text.
     """
 
     def __init__(self, params, template=None, template_string=None):
@@ -14,11 +24,13 @@ class Template:
         Create a new template object.
         """
         self.file = template
-        self.params = params
+        self.params = frozenset(params)
         self.template = None
+        self.keys = None
+        self.version = None
 
         if template_string:
-            self.template = template_string
+            self._compile(template_string)
         else:
             if not self.file.startswith(os.path.sep):
                 self.file = os.path.join(config.TEMPLATE_DIR, self.file)
@@ -26,31 +38,57 @@ class Template:
             if not (os.path.exists(self.file) and os.path.isfile(self.file)):
                 raise ValueError("Can't find template file for %s." % self.file)
 
+    def _compile(self, template):
+        keys = frozenset(filter(None, _KEY.findall(template)))
+        unknown = keys - self.params
+        if unknown:
+            raise ValueError("Template uses undeclared parameters %s." %
+                             ', '.join(sorted(unknown)))
+        self.keys = keys
+        self.version = hashlib.sha1(template).hexdigest()
+        self.template = template
+
+    def load(self):
+        """Read the template file if it hasn't been read yet."""
+        if not self.template:
+            fh = open(self.file, 'r')
+            try:
+                self._compile(fh.read())
+            finally:
+                fh.close()
+
     def process(self, data):
         """
         Process the template with the template parameters bound to the
         matching values of data dictionary. Returns the template
         output as a string.
         """
-        if not self.template:
-            fh = open(self.file, 'r')
-            self.template = fh.read()
-            fh.close()
+        if self.template is None:
+            self.load()
 
-        for param in self.params:
-            if not data.has_key(param):
-                raise ValueError("Missing required template parameter %s." % param)
+        if not self.params.issubset(data):
+            missing = sorted(self.params.difference(data))
+            raise ValueError("Missing required template parameter %s." % missing[0])
 
         return self.template % data
 
     def process_to_file(self, filename, data):
         """
         Like process, but the processed template is written to
-        filename.
+        filename. An unchanged file isn't rewritten. Returns True if
+        filename changed.
+        """
+        return fileio.write_file(filename, self.process(data), if_changed=True)
+
+    def render_many(self, items):
+        """
+        Process the template for a list of (filename, data) pairs, writing
+        each to its filename. Returns the filenames that changed.
         """
-        f = file(filename, 'w')
-        f.write(self.process(data))
-        f.close()
+        if self.template is None:
+            self.load()
+        return [filename for filename, data in items
+                if self.process_to_file(filename, data)]
 
 
 apache_conf = Template(template='apache.conf',
@@ -59,4 +97,3 @@ fisheye_conf = Template(template='fisheye.conf',
                         params=['repopath', 'users'])
 fisheye_site_conf = Template(template='fisheye.site.conf',
                              params=['users'])
-
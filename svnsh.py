@@ -1,8 +1,70 @@
 #!/usr/bin/env python
+"""
+svnsh.py                    Start the interactive shell.
+svnsh.py COMMAND [ARGS...]  Run one command and exit.
+svnsh.py -f SCRIPT          Run the commands in SCRIPT (- for stdin) and exit.
+svnsh.py --serve            Run commands sent over a Unix socket.
+svnsh.py -S SOCKET COMMAND [ARGS...]
+                            Run one command in the server listening on SOCKET.
+
+Exits with 0 on success, 1 if a command failed, 2 for bad arguments
+and 127 for an unknown command.
+"""
+
+import sys
+
+from optparse import OptionParser
 
 if __name__ == '__main__':
+    parser = OptionParser(usage=__doc__.strip())
+    parser.disable_interspersed_args()
+    parser.add_option('-f', '--file', dest='script', default=None,
+                      help='Run the commands in SCRIPT, one per line.')
+    parser.add_option('--serve', dest='serve', action='store_true', default=False,
+                      help='Run a server on the socket given by -S or config.SERVER_SOCKET.')
+    parser.add_option('-j', '--workers', dest='workers', type='int', default=None,
+                      help='Number of commands the server runs at once.')
+    parser.add_option('-S', '--socket', dest='socket', default=None,
+                      help='The Unix socket of the svnsh server.')
+    (options, args) = parser.parse_args()
+
+    if options.serve:
+        from repopy import server
+        server.serve(options.socket, options.workers)
+        sys.exit(0)
+
+    if options.socket:
+        if options.script or not args:
+            parser.error('-S needs a command.')
+        from repopy import server
+        try:
+            status, output = server.request(args, options.socket)
+        except Exception, e:
+            print >> sys.stderr, 'Unable to reach the svnsh server at %s: %s' % (options.socket, e)
+            sys.exit(1)
+        sys.stdout.write(output)
+        sys.exit(status)
+
     from repopy import shell
 
+    if options.script:
+        if args:
+            parser.error('-f does not take a command.')
+        if options.script == '-':
+            sys.exit(shell.run_script(sys.stdin, '<stdin>'))
+        try:
+            f = open(options.script, 'r')
+        except IOError, e:
+            print >> sys.stderr, e
+            sys.exit(shell.EXIT_ERROR)
+        try:
+            sys.exit(shell.run_script(f, options.script))
+        finally:
+            f.close()
+
+    if args:
+        sys.exit(shell.run_command(args))
+
     shell = shell.Shell()
     shell.cmdloop()
 
@@ -0,0 +1,38 @@
+import unittest
+
+from repopy.repository import Repository, Auth, Group
+from repopy.access import checker_for
+
+
+class AccessCheckerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        repo = Repository('its', 'sakai')
+        repo.groups.append(Group('devs', ['neil', 'amy']))
+        repo.add_auth('/', '@devs', Auth.READ_ONLY)
+        repo.add_auth('/', 'bob', Auth.READ_WRITE)
+        repo.add_auth('/trunk', '@devs', Auth.READ_WRITE)
+        repo.add_auth('/trunk/secret', 'amy', Auth.READ_ONLY)
+        repo.add_auth('/tags', '*', Auth.READ_ONLY)
+        self.checker = checker_for(repo)
+
+    def test_longest_path_wins(self):
+        self.assertEqual(self.checker.access('neil', '/'), 'r')
+        self.assertEqual(self.checker.access('neil', '/trunk/src'), 'rw')
+        # Only amy is named in /trunk/secret so neil falls through to /trunk.
+        self.assertEqual(self.checker.access('neil', '/trunk/secret'), 'rw')
+        self.assertEqual(self.checker.access('amy', '/trunk/secret/x'), 'r')
+
+    def test_prefix_is_per_component(self):
+        self.assertEqual(self.checker.access('neil', '/trunk2'), 'r')
+
+    def test_everyone(self):
+        self.assertEqual(self.checker.access('bob', '/tags/1.0'), 'r')
+        self.assertEqual(self.checker.access('nobody', '/tags'), 'r')
+        self.assertEqual(self.checker.access('nobody', '/trunk'), '')
+        self.failIf(self.checker.can_read('nobody', '/'))
+
+    def test_check_many(self):
+        queries = [('bob', '/trunk'), ('amy', '/trunk'), ('bob', '/trunk')]
+        self.assertEqual(self.checker.check_many(queries), ['rw', 'rw', 'rw'])
+        self.failUnless(self.checker.can_write('bob', '/branches'))
@@ -0,0 +1,140 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import importrepo
+import repopy.config as config
+from repopy.repository import Repository
+
+AUTHZ = """
+# Imported from the old server.
+[groups]
+devs = neil, amy ,
+ops=
+
+[/]
+@devs = rw
+* = r
+
+[sakai:/trunk]
+bob = rw
+; not for this repository
+[other:/branches]
+carol = rw
+
+[/tags]
+dave
+erin = w
+[aliases
+"""
+
+
+class ParseAuthzTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        entries = list(importrepo.parse_authz(AUTHZ.splitlines(True), 'sakai'))
+        groups = [(n, g.name, g.members) for n, kind, g in entries if kind == 'group']
+        self.assertEqual(groups, [(4, 'devs', ['neil', 'amy']), (5, 'ops', [])])
+
+        auths = [(n, a.path, a.user, a.mode) for n, kind, a in entries if kind == 'auth']
+        self.assertEqual(auths, [(8, '/', '@devs', 'rw'), (9, '/', '*', 'r'),
+                                 (12, '/trunk', 'bob', 'rw')])
+
+        errors = [n for n, kind, message in entries if kind == 'error']
+        self.assertEqual(errors, [14, 18, 19, 20])
+
+    def test_generator(self):
+        # Nothing is read ahead of what has been yielded.
+        def lines():
+            yield '[/]\n'
+            yield 'neil = rw\n'
+            raise AssertionError('read too far')
+        entries = importrepo.parse_authz(lines())
+        self.assertEqual(entries.next()[0], 2)
+
+
+class FindAuthzFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        os.makedirs(os.path.join(self.root, 'math'))
+        for name in ('its_sakai.authz', 'plain.authz', 'notes.txt',
+                     os.path.join('math', 'math_thesis.authz'),
+                     os.path.join('math', 'its_other.authz')):
+            open(os.path.join(self.root, name), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_find(self):
+        found = [(prefix, name) for prefix, name, filename
+                 in importrepo.find_authz_files(self.root, 'its')]
+        self.assertEqual(found, [('its', 'plain'), ('its', 'sakai'),
+                                 ('math', 'its_other'), ('math', 'thesis')])
+
+
+class ReadAuthzTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.filename = os.path.join(self.root, 'sakai.authz')
+        open(self.filename, 'w').write(AUTHZ)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_read_authz(self):
+        repo = Repository('its', 'sakai')
+        errors = importrepo.read_authz(repo, self.filename, quiet=True)
+        self.assertEqual([n for n, message in errors], [14, 18, 19, 20])
+        self.assertEqual([g.name for g in repo.groups], ['devs', 'ops'])
+        self.assertEqual(len(repo.authorizations), 3)
+        self.failUnless(repo.has_auth('/trunk', 'bob', 'rw'))
+
+
+class _RecordingClient(object):
+
+    def __init__(self):
+        self.added = []
+        self.checkins = []
+
+    def add(self, path):
+        self.added.append(path)
+
+    def checkin(self, paths, message):
+        self.checkins.append(list(paths))
+
+
+class ImportAllTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.saved = (config.REPO_ROOT, config.YAML_ROOT, config.CATALOG_PATH)
+        config.REPO_ROOT = os.path.join(self.root, 'repos')
+        config.YAML_ROOT = os.path.join(config.REPO_ROOT, 'yaml')
+        config.CATALOG_PATH = os.path.join(self.root, 'catalog.db')
+        os.makedirs(os.path.join(config.YAML_ROOT, 'its'))
+
+        self.authz = os.path.join(self.root, 'authz')
+        os.makedirs(os.path.join(self.authz, 'math'))
+        for name in ('its_sakai.authz', os.path.join('math', 'math_thesis.authz')):
+            open(os.path.join(self.authz, name), 'w').write(AUTHZ)
+
+    def tearDown(self):
+        config.REPO_ROOT, config.YAML_ROOT, config.CATALOG_PATH = self.saved
+        shutil.rmtree(self.root)
+
+    def test_new_department(self):
+        svn = _RecordingClient()
+        report = importrepo.import_all(self.authz, 'its', workers=1, svn_client=svn)
+        self.assertEqual([entry['repository'] for entry in report['imported']],
+                         ['its/sakai', 'math/thesis'])
+
+        math = os.path.join(config.YAML_ROOT, 'math')
+        sakai = os.path.join(config.YAML_ROOT, 'its', 'sakai.yaml')
+        thesis = os.path.join(math, 'thesis.yaml')
+        # The new directory is added while it's empty, then every
+        # descriptor, including the one in the new directory.
+        self.assertEqual(svn.added, [math, sakai, thesis])
+        self.assertEqual(svn.checkins, [[math, sakai, thesis]])
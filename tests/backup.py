@@ -0,0 +1,85 @@
+import os
+import gzip
+import bz2
+import time
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import repopy.config as config
+import repopy.backup
+from repopy.repository import Repository
+
+# Stands in for svnadmin dump. Writes its arguments and then some data,
+# after $WARNINGS bytes of warnings if it's set.
+FAKE_SVNADMIN = """#!/bin/sh
+eval last=\\${$#}
+[ -f "$last/format" ] || { echo "no repository at $last" >&2; exit 1; }
+[ -n "$WARNINGS" ] && head -c $WARNINGS /dev/zero | tr '\\0' w >&2
+echo "$*"
+head -c 100000 /dev/zero
+"""
+
+
+class BackupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.saved = (config.REPO_ROOT, config.BACKUP_ROOT, config.SVNADMIN,
+                      config.BACKUP_RATE_LIMIT)
+        config.REPO_ROOT = os.path.join(self.root, 'repos')
+        config.BACKUP_ROOT = os.path.join(self.root, 'backup')
+        config.SVNADMIN = os.path.join(self.root, 'svnadmin')
+        config.BACKUP_RATE_LIMIT = None
+        open(config.SVNADMIN, 'w').write(FAKE_SVNADMIN)
+        os.chmod(config.SVNADMIN, 0755)
+
+        self.repo = Repository('its', 'sakai')
+        os.makedirs(os.path.join(self.repo.path_to_repo, 'conf'))
+        open(os.path.join(self.repo.path_to_repo, 'format'), 'w').write('5\n')
+
+    def tearDown(self):
+        (config.REPO_ROOT, config.BACKUP_ROOT, config.SVNADMIN,
+         config.BACKUP_RATE_LIMIT) = self.saved
+        shutil.rmtree(self.root)
+
+    def test_backup(self):
+        path, dumped, written = repopy.backup.backup(self.repo, compression='gz')
+        self.failUnless(path.startswith(os.path.join(config.BACKUP_ROOT, 'its', 'sakai-')))
+        self.failUnless(path.endswith('.svndump.gz'))
+        data = gzip.open(path).read()
+        self.assertEqual(len(data), dumped)
+        self.assertEqual(data.split('\n')[0], 'dump --quiet %s' % self.repo.path_to_repo)
+        self.assertEqual(os.path.getsize(path), written)
+        self.failUnless(written < dumped)
+
+        # A second backup in the same second gets its own file.
+        second = repopy.backup.backup(self.repo, compression='gz')[0]
+        self.assertNotEqual(second, path)
+        self.assertEqual(len(os.listdir(os.path.dirname(path))), 2)
+
+    def test_incremental(self):
+        path, dumped, written = repopy.backup.backup(self.repo, '10:20', True, 'bz2')
+        self.failUnless(path.endswith('-r10-20.svndump.bz2'))
+        self.assertEqual(bz2.BZ2File(path).readline(),
+                         'dump --quiet -r 10:20 --incremental %s\n' % self.repo.path_to_repo)
+
+    def test_failure(self):
+        os.remove(os.path.join(self.repo.path_to_repo, 'format'))
+        self.assertRaises(repopy.backup.BackupError, repopy.backup.backup, self.repo)
+        # No partial backup is left behind.
+        self.assertEqual(os.listdir(os.path.join(config.BACKUP_ROOT, 'its')), [])
+
+    def test_warnings(self):
+        # More warnings than a pipe holds don't hold up the dump.
+        os.environ['WARNINGS'] = '1000000'
+        try:
+            path, dumped, written = repopy.backup.backup(self.repo, compression='gz')
+        finally:
+            del os.environ['WARNINGS']
+        self.assertEqual(len(gzip.open(path).read()), dumped)
+
+    def test_rate_limit(self):
+        start = time.time()
+        repopy.backup.backup(self.repo, rate=400000)
+        self.failUnless(time.time() - start >= 0.2)
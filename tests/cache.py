@@ -0,0 +1,64 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from repopy.cache import DescriptorCache
+
+
+class DescriptorCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data):
+        path = os.path.join(self.dir, name)
+        f = open(path, 'w')
+        f.write(data)
+        f.close()
+        return path
+
+    def test_hit(self):
+        path = self._write('a.yaml', 'aaaa')
+        cache = DescriptorCache(100)
+        repo = object()
+        cache.put(path, repo)
+        self.failUnless(cache.get(path) is repo)
+
+    def test_changed_on_disk(self):
+        path = self._write('a.yaml', 'aaaa')
+        cache = DescriptorCache(100)
+        cache.put(path, object())
+        self._write('a.yaml', 'aaaaaa')
+        self.assertEqual(cache.get(path), None)
+        self.assertEqual(cache.size, 0)
+
+    def test_removed(self):
+        path = self._write('a.yaml', 'aaaa')
+        cache = DescriptorCache(100)
+        cache.put(path, object())
+        os.remove(path)
+        self.assertEqual(cache.get(path), None)
+
+    def test_eviction(self):
+        a = self._write('a.yaml', 'a' * 40)
+        b = self._write('b.yaml', 'b' * 40)
+        c = self._write('c.yaml', 'c' * 40)
+        cache = DescriptorCache(100)
+        cache.put(a, 'A')
+        cache.put(b, 'B')
+        cache.get(a)
+        cache.put(c, 'C')
+        self.assertEqual(cache.get(b), None)
+        self.assertEqual(cache.get(a), 'A')
+        self.assertEqual(cache.get(c), 'C')
+        self.assertEqual(cache.size, 80)
+
+    def test_disabled(self):
+        path = self._write('a.yaml', 'aaaa')
+        cache = DescriptorCache(0)
+        cache.put(path, object())
+        self.assertEqual(len(cache), 0)
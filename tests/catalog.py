@@ -0,0 +1,91 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import repopy.catalog
+from repopy.repository import Repository, Group
+
+
+class CatalogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.catalog = repopy.catalog.Catalog(os.path.join(self.root, 'catalog.db'))
+        # An empty REPO_ROOT so the initial build finds nothing.
+        self.catalog.rebuild(self.root)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.root)
+
+    def _make_repo_dir(self, prefix, name):
+        path = os.path.join(self.root, prefix, name)
+        os.makedirs(os.path.join(path, 'conf'))
+        open(os.path.join(path, 'format'), 'w').write('5\n')
+
+    def test_add_remove(self):
+        self.catalog.add(Repository('its', 'sakai', True))
+        self.catalog.add(Repository('its', 'apache'))
+        self.catalog.add(Repository('math', 'thesis'))
+        self.assertEqual(self.catalog.prefixes(), ['its', 'math'])
+        self.assertEqual(self.catalog.repositories('its'),
+                         [('its', 'apache', False), ('its', 'sakai', True)])
+        self.assertEqual(self.catalog.get('its', 'sakai'), ('its', 'sakai', True))
+
+        self.catalog.remove('its', 'sakai')
+        self.assertEqual(self.catalog.get('its', 'sakai'), None)
+        self.assertEqual(len(self.catalog.repositories()), 2)
+
+    def test_rebuild(self):
+        self._make_repo_dir('its', 'sakai')
+        self._make_repo_dir('its', 'apache')
+        os.makedirs(os.path.join(self.root, 'its', 'not_a_repo'))
+        os.makedirs(os.path.join(self.root, 'yaml', 'its'))
+
+        self.catalog.add(Repository('gone', 'old'))
+        self.assertEqual(self.catalog.rebuild(self.root), 2)
+        self.assertEqual(self.catalog.repositories(),
+                         [('its', 'apache', False), ('its', 'sakai', False)])
+
+    def test_users(self):
+        repo = Repository('its', 'sakai')
+        repo.groups.append(Group('devs', ['neil', 'amy']))
+        repo.add_auth('/', '@devs', 'rw')
+        repo.add_auth('/trunk', 'bob', 'r')
+        self.catalog.add(repo)
+        other = Repository('math', 'thesis')
+        other.add_auth('/', 'neil', 'r')
+        self.catalog.add(other)
+
+        self.assertEqual(self.catalog.repositories_for_user('neil'),
+                         [('its', 'sakai'), ('math', 'thesis')])
+        self.assertEqual(self.catalog.repositories_for_user('bob'), [('its', 'sakai')])
+        self.assertEqual(self.catalog.repositories_for_user('@devs'), [('its', 'sakai')])
+
+        repo.remove_member('neil')
+        self.catalog.update([repo])
+        self.assertEqual(self.catalog.repositories_for_user('neil'), [('math', 'thesis')])
+
+        self.catalog.remove('math', 'thesis')
+        self.assertEqual(self.catalog.repositories_for_user('neil'), [])
+
+    def test_rules(self):
+        repo = Repository('its', 'sakai')
+        repo.groups.append(Group('devs', ['neil', '@ops']))
+        repo.groups.append(Group('ops', ['amy']))
+        repo.add_auth('/', '@devs', 'rw')
+        repo.add_auth('/trunk', '*', 'r')
+        self.catalog.add(repo)
+        self.catalog.add(Repository('math', 'thesis'))
+
+        authorizations, groups = self.catalog.rules('its', 'sakai')
+        authorizations.sort()
+        self.assertEqual(authorizations, repo.authorizations)
+        groups.sort(key=lambda g: g.name)
+        self.assertEqual([(g.name, g.members) for g in groups],
+                         [('devs', ['neil', '@ops']), ('ops', ['amy'])])
+        self.assertEqual(self.catalog.rules('math', 'thesis'), ([], []))
+
+        self.assertEqual(self.catalog.repositories_visible_to('bob'), [('its', 'sakai')])
+        self.assertEqual(self.catalog.repositories_visible_to('amy'), [('its', 'sakai')])
@@ -1,7 +1,19 @@
+import os
+import sys
+import pwd
+import shutil
 import unittest
 import operator
+from StringIO import StringIO
+from tempfile import mkdtemp
 
+import repopy.config as config
 import repopy.command
+import repopy.fisheye
+import repopy.descriptor as descriptor
+from repopy.catalog import Catalog
+from repopy.errors import CommandError
+from repopy.repository import Repository, Group
 
 class ArgumentCountTestCase(unittest.TestCase):
 
@@ -15,3 +27,382 @@ class ArgumentCountTestCase(unittest.TestCase):
         self.failUnless(count.validate([1, 2, 3]))
         self.failIf(count.validate([1]))
 
+
+
+# Stands in for svnadmin create.
+FAKE_SVNADMIN = """#!/bin/sh
+for repo; do :; done
+mkdir -p "$repo/conf" && echo 5 > "$repo/format"
+"""
+
+
+class RecordingClient(object):
+    """Stands in for the svn client, remembering what it was asked to do."""
+
+    def __init__(self):
+        self.added = []
+        self.checkins = []
+        self.removed = []
+
+    def add(self, path):
+        self.added.append(path)
+
+    def checkin(self, paths, message):
+        self.checkins.append((list(paths), message))
+
+    def remove(self, path):
+        self.removed.append(path)
+
+
+class CommandTestCase(unittest.TestCase):
+    """
+    Runs commands against repositories in a temporary REPO_ROOT. svn is
+    replaced by a RecordingClient and addauth emails are only recorded.
+    """
+
+    CONFIG = ('REPO_ROOT', 'YAML_ROOT', 'CATALOG_PATH', 'APACHE_CONF_ROOT', 'APACHE_RELOAD',
+              'APACHE_USER', 'SVNADMIN')
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.saved_config = [getattr(config, name) for name in self.CONFIG]
+        config.REPO_ROOT = os.path.join(self.root, 'repos')
+        config.YAML_ROOT = os.path.join(config.REPO_ROOT, 'yaml')
+        config.CATALOG_PATH = os.path.join(self.root, 'catalog.db')
+        config.APACHE_CONF_ROOT = os.path.join(self.root, 'apache')
+        config.APACHE_RELOAD = None
+        # Repositories are "created" by a stand-in svnadmin, for this user.
+        config.APACHE_USER = pwd.getpwuid(os.getuid())[0]
+        config.SVNADMIN = os.path.join(self.root, 'svnadmin')
+        open(config.SVNADMIN, 'w').write(FAKE_SVNADMIN)
+        os.chmod(config.SVNADMIN, 0755)
+        os.makedirs(config.YAML_ROOT)
+        os.makedirs(config.APACHE_CONF_ROOT)
+
+        self.saved = (repopy.command.catalog, repopy.command.svn_client,
+                      repopy.command.addauth_email, sys.stdout)
+        repopy.command.catalog = Catalog()
+        repopy.command.svn_client = self.svn = RecordingClient()
+        self.emails = []
+        repopy.command.addauth_email = lambda *args: self.emails.append(args)
+        repopy.command.descriptor_cache.clear()
+        sys.stdout = self.out = StringIO()
+
+    def tearDown(self):
+        repopy.command.rollback_transaction()
+        repopy.command.descriptor_cache.clear()
+        repopy.command.catalog.close()
+        (repopy.command.catalog, repopy.command.svn_client,
+         repopy.command.addauth_email, sys.stdout) = self.saved
+        for name, value in zip(self.CONFIG, self.saved_config):
+            setattr(config, name, value)
+        shutil.rmtree(self.root)
+
+    def make_repo(self, prefix, name, fisheye=False, auths=(), groups=(), catalog=True):
+        """
+        Make a repository on disk with a descriptor holding the (path,
+        user, mode) auths and (name, members) groups, and catalog it.
+        """
+        repo = Repository(prefix, name, fisheye)
+        for group, members in groups:
+            repo.groups.append(Group(group, list(members)))
+        for auth in auths:
+            repo.add_auth(*auth)
+        os.makedirs(os.path.join(repo.path_to_repo, 'conf'))
+        open(os.path.join(repo.path_to_repo, 'format'), 'w').write('5\n')
+        if not os.path.isdir(os.path.dirname(repo.yaml_path)):
+            os.makedirs(os.path.dirname(repo.yaml_path))
+        descriptor.dump_file(repo, repo.yaml_path)
+        if catalog:
+            repopy.command.catalog.add(repo)
+        return repo
+
+    def load(self, repo):
+        return descriptor.load_file(repo.yaml_path)
+
+    def write_file(self, text):
+        path = os.path.join(self.root, 'rows.csv')
+        f = open(path, 'w')
+        f.write(text)
+        f.close()
+        return path
+
+
+class TransactionTestCase(CommandTestCase):
+
+    def setUp(self):
+        CommandTestCase.setUp(self)
+        self.a = self.make_repo('its', 'a')
+        self.b = self.make_repo('its', 'b')
+
+    def test_commit(self):
+        repopy.command.begin([])
+        repopy.command.addauth(['its/a', '/', 'neil', 'rw'])
+        repopy.command.addauth(['its/b', '/trunk', 'amy', 'r'])
+        repopy.command.addauth(['its/a', '/docs', 'amy', 'r'])
+        # Nothing is written or sent until commit.
+        self.failIf(self.load(self.a).has_auth('/', 'neil', 'rw'))
+        self.assertEqual(self.svn.checkins, [])
+        self.assertEqual(self.emails, [])
+
+        repopy.command.commit([])
+        self.failUnless(self.load(self.a).has_auth('/', 'neil', 'rw'))
+        self.failUnless(self.load(self.a).has_auth('/docs', 'amy', 'r'))
+        self.failUnless(self.load(self.b).has_auth('/trunk', 'amy', 'r'))
+        # One svn commit for both repositories.
+        self.assertEqual(len(self.svn.checkins), 1)
+        self.assertEqual(sorted(self.svn.checkins[0][0]),
+                         [self.a.yaml_path, self.b.yaml_path])
+        self.assertEqual(len(self.emails), 3)
+        self.failIf(repopy.command.in_transaction())
+
+    def test_rollback(self):
+        repopy.command.begin([])
+        repopy.command.addauth(['its/a', '/', 'neil', 'rw'])
+        repopy.command.rollback([])
+        self.failIf(repopy.command.in_transaction())
+        self.failIf(self.load(self.a).has_auth('/', 'neil', 'rw'))
+        self.assertEqual(self.svn.checkins, [])
+        self.assertEqual(self.emails, [])
+
+        # The rolled back grant isn't seen by the next command either.
+        repopy.command.addauth(['its/a', '/docs', 'amy', 'r'])
+        repo = self.load(self.a)
+        self.failUnless(repo.has_auth('/docs', 'amy', 'r'))
+        self.failIf(repo.has_auth('/', 'neil', 'rw'))
+
+    def test_no_writes_in_transaction(self):
+        repopy.command.begin([])
+        repopy.command.addauth(['its/a', '/', 'neil', 'rw'])
+        self.assertRaises(CommandError, repopy.command.flush, ['its/a'])
+        self.assertRaises(CommandError, repopy.command.flush, ['--all'])
+        self.assertRaises(CommandError, repopy.command.fisheye, ['its/a', 'on'])
+        self.failIf(os.path.exists(self.a.apache_authz))
+        self.failIf(self.load(self.a).has_auth('/', 'neil', 'rw'))
+        repopy.command.fisheye(['its/a', 'check'])
+
+        repopy.command.rollback([])
+        self.failIf(self.load(self.a).has_auth('/', 'neil', 'rw'))
+
+    def test_failed_command(self):
+        c = self.make_repo('its', 'c', groups=[('devs', ['neil', 'amy'])])
+        repopy.command.begin([])
+        repopy.command.addauth(['its/c', '/docs', 'bob', 'r'])
+        # neil is removed before nobody is found not to be a member.
+        self.assertRaises(Exception, repopy.command.delgroup, ['its/c', 'devs', 'neil', 'nobody'])
+        repopy.command.commit([])
+
+        repo = self.load(c)
+        self.assertEqual([(g.name, g.members) for g in repo.groups], [('devs', ['neil', 'amy'])])
+        self.failUnless(repo.has_auth('/docs', 'bob', 'r'))
+        self.assertEqual(len(self.svn.checkins), 1)
+        self.assertEqual(self.svn.checkins[0][0], [c.yaml_path])
+
+    def test_begin_twice(self):
+        repopy.command.begin([])
+        self.assertRaises(CommandError, repopy.command.begin, [])
+        repopy.command.rollback([])
+        self.assertRaises(CommandError, repopy.command.rollback, [])
+        self.assertRaises(CommandError, repopy.command.commit, [])
+
+
+class GrantFileTestCase(CommandTestCase):
+
+    def setUp(self):
+        CommandTestCase.setUp(self)
+        self.a = self.make_repo('its', 'a')
+        self.b = self.make_repo('its', 'b')
+
+    def test_addauth_from(self):
+        rows = self.write_file('# repo,path,user,mode\n'
+                               'its/a,/,neil,rw\n'
+                               'its/b,/trunk,amy,r\n'
+                               'its/a,/docs,amy,x\n'
+                               'its/a,docs,amy,r\n'
+                               'its/nope,/,amy,r\n'
+                               'its/b,/\n')
+        self.assertRaises(CommandError, repopy.command.addauth, ['--from', rows])
+        # The good rows are applied despite the bad ones.
+        self.failUnless(self.load(self.a).has_auth('/', 'neil', 'rw'))
+        self.failUnless(self.load(self.b).has_auth('/trunk', 'amy', 'r'))
+        self.assertEqual(len(self.svn.checkins), 1)
+        self.assertEqual(sorted(self.svn.checkins[0][0]),
+                         [self.a.yaml_path, self.b.yaml_path])
+        self.assertEqual(len(self.emails), 2)
+        out = self.out.getvalue()
+        for lineno in (4, 5, 6, 7):
+            self.failUnless('Line %d:' % lineno in out, lineno)
+        self.failIf('Line 2:' in out)
+
+    def test_delauth_from(self):
+        repopy.command.addauth(['its/a', '/', 'neil', 'rw'])
+        repopy.command.addauth(['its/a', '/trunk', 'neil', 'rw'])
+        repopy.command.addauth(['its/b', '/', 'amy', 'r'])
+        self.svn.checkins = []
+
+        rows = self.write_file('its/a,/,neil\n'
+                               'its/a,/trunk,neil,r\n'
+                               'its/b,/,amy,r\n'
+                               'its/b,/x,amy\n')
+        self.assertRaises(CommandError, repopy.command.delauth, ['--from', rows])
+        a, b = self.load(self.a), self.load(self.b)
+        self.failIf(a.has_auth('/', 'neil', 'rw'))
+        # The row asked for r, neil has rw, so it's kept.
+        self.failUnless(a.has_auth('/trunk', 'neil', 'rw'))
+        self.failIf(b.has_auth('/', 'amy', 'r'))
+        self.assertEqual(len(self.svn.checkins), 1)
+        out = self.out.getvalue()
+        self.failUnless('Line 2: No r authorization found for neil on /trunk' in out)
+        self.failUnless('Line 4:' in out)
+
+    def test_delauth_from_one_mode(self):
+        repopy.command.addauth(['its/a', '/', 'neil', 'r'])
+        repopy.command.addauth(['its/a', '/', 'neil', 'rw'])
+        repopy.command.delauth(['--from', self.write_file('its/a,/,neil,r\n')])
+        a = self.load(self.a)
+        # Only the r grant goes.
+        self.failIf(a.has_auth('/', 'neil', 'r'))
+        self.failUnless(a.has_auth('/', 'neil', 'rw'))
+        self.assertEqual([(auth.path, auth.user, auth.mode) for auth in a.authorizations],
+                         [('/', 'neil', 'rw')])
+
+
+class DelUserTestCase(CommandTestCase):
+
+    def make_repos(self, catalog=True):
+        self.a = self.make_repo('its', 'a', auths=[('/', 'neil', 'rw'), ('/', 'amy', 'r')],
+                                catalog=catalog)
+        # neil is the only member of devs, which is the only member of all.
+        self.b = self.make_repo('its', 'b', groups=[('devs', ['neil']), ('all', ['@devs'])],
+                                auths=[('/', '@all', 'r'), ('/', 'amy', 'rw')],
+                                catalog=catalog)
+        self.c = self.make_repo('math', 'c', auths=[('/', 'amy', 'r')], catalog=catalog)
+
+    def check_removed(self):
+        a, b = self.load(self.a), self.load(self.b)
+        self.assertEqual([(x.path, x.user) for x in a.authorizations], [('/', 'amy')])
+        self.assertEqual(b.groups, [])
+        self.assertEqual([(x.path, x.user) for x in b.authorizations], [('/', 'amy')])
+        self.assertEqual(len(self.svn.checkins), 1)
+        self.assertEqual(sorted(self.svn.checkins[0][0]), [self.a.yaml_path, self.b.yaml_path])
+        self.assertEqual(repopy.command.catalog.repositories_for_user('neil'), [])
+
+    def test_deluser_all(self):
+        self.make_repos()
+        repopy.command.deluser(['--all', 'neil'])
+        self.check_removed()
+        self.assertRaises(CommandError, repopy.command.deluser, ['--all', 'neil'])
+
+    def test_in_transaction(self):
+        self.make_repos()
+        repopy.command.begin([])
+        # The catalog doesn't know about this grant until commit.
+        repopy.command.addauth(['math/c', '/', 'neil', 'rw'])
+        repopy.command.deluser(['--all', 'neil'])
+        repopy.command.commit([])
+        c = self.load(self.c)
+        self.assertEqual([(x.path, x.user) for x in c.authorizations], [('/', 'amy')])
+        self.failIf(self.load(self.a).has_auth('/', 'neil', 'rw'))
+        self.assertEqual(sorted(self.svn.checkins[0][0]),
+                         [self.a.yaml_path, self.b.yaml_path, self.c.yaml_path])
+        self.assertEqual(repopy.command.catalog.repositories_for_user('neil'), [])
+
+    def test_old_catalog(self):
+        # A catalog from before grants and members were indexed.
+        import sqlite3
+        conn = sqlite3.connect(config.CATALOG_PATH)
+        conn.executescript("""
+            CREATE TABLE repositories (prefix TEXT NOT NULL, name TEXT NOT NULL,
+                                       fisheye INTEGER NOT NULL DEFAULT 0,
+                                       PRIMARY KEY (prefix, name));
+            INSERT INTO repositories VALUES ('its', 'a', 0);
+            INSERT INTO repositories VALUES ('its', 'b', 0);
+            INSERT INTO repositories VALUES ('math', 'c', 0);
+        """)
+        conn.commit()
+        conn.close()
+        self.make_repos(catalog=False)
+
+        # Opening it rebuilds it, no reindex needed.
+        repopy.command.deluser(['--all', 'neil'])
+        self.check_removed()
+
+
+class DescriptorCacheTestCase(CommandTestCase):
+
+    def test_cached_after_write(self):
+        repo = self.make_repo('its', 'a')
+        repopy.command.addauth(['its/a', '/', 'neil', 'rw'])
+        # The entry was made once the new descriptor was in place, so
+        # it's still good.
+        cached = repopy.command.descriptor_cache.get(repo.yaml_path)
+        self.failIf(cached is None)
+        self.failUnless(cached.has_auth('/', 'neil', 'rw'))
+
+
+class CreateBatchTestCase(CommandTestCase):
+
+    def test_new_prefix(self):
+        self.make_repo('its', 'old')
+        rows = self.write_file('its/a\n'
+                               'math/b,no,Theses\n'
+                               'math/c\n'
+                               'its/old\n')
+        self.assertRaises(CommandError, repopy.command.create, ['--batch', rows])
+
+        math = os.path.join(config.YAML_ROOT, 'math')
+        paths = [Repository(prefix, name).yaml_path
+                 for prefix, name in (('its', 'a'), ('math', 'b'), ('math', 'c'))]
+        for path in paths:
+            self.failUnless(os.path.exists(path))
+        # math is new, it's added empty and then every descriptor is added,
+        # including the ones in math.
+        self.assertEqual(self.svn.added, [math] + paths)
+        self.assertEqual(len(self.svn.checkins), 1)
+        self.assertEqual(sorted(self.svn.checkins[0][0]), sorted([math] + paths))
+        self.failUnless('Line 4:' in self.out.getvalue())
+
+
+class RecordingAdmin(object):
+    """Stands in for the fisheye admin."""
+
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+
+    def create_repository(self, repo, description):
+        self.created.append((repo.fisheye_name, description))
+        return True
+
+    def delete_repository(self, repo):
+        self.deleted.append(repo.fisheye_name)
+        return True
+
+
+class FisheyeTestCase(CommandTestCase):
+
+    def setUp(self):
+        CommandTestCase.setUp(self)
+        self.admin = RecordingAdmin()
+        self.saved_fisheye = (repopy.fisheye.admin, sys.stdin)
+        repopy.fisheye.admin = lambda: self.admin
+        # The description fisheye on asks for.
+        sys.stdin = StringIO('Sakai\n')
+
+    def tearDown(self):
+        repopy.fisheye.admin, sys.stdin = self.saved_fisheye
+        CommandTestCase.tearDown(self)
+
+    def test_on_off(self):
+        repo = self.make_repo('its', 'a', auths=[('/', 'neil', 'r')])
+        repopy.command.fisheye(['its/a', 'on'])
+        self.assertEqual(self.admin.created, [(repo.fisheye_name, 'Sakai')])
+        self.failUnless(self.load(repo).fisheye)
+        self.failUnless(os.path.exists(repo.fisheye_auth_path))
+        self.assertEqual(self.svn.checkins[-1][1], 'Turned fisheye ON for a.')
+
+        repopy.command.fisheye(['its/a', 'off'])
+        self.assertEqual(self.admin.deleted, [repo.fisheye_name])
+        self.failIf(self.load(repo).fisheye)
+        self.failIf(os.path.exists(repo.fisheye_auth_path))
+        self.assertEqual(self.svn.checkins[-1][1], 'Turned fisheye OFF for a.')
@@ -0,0 +1,89 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import yaml
+
+import repopy.descriptor
+from repopy.repository import Repository, Group, Auth
+
+
+class DescriptorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = Repository('its', 'sakai', True)
+        self.repo.groups.append(Group('devs', ['neil', 'amy']))
+        self.repo.add_auth('/', '@devs', Auth.READ_ONLY)
+        self.repo.add_auth('/trunk', 'neil', Auth.READ_WRITE)
+
+    def assertSameRepository(self, repo):
+        self.failUnless(isinstance(repo, Repository))
+        self.assertEqual(repo.path, 'its/sakai')
+        self.assertEqual(repo.fisheye, True)
+        self.assertEqual(repo.yaml_path, self.repo.yaml_path)
+        self.assertEqual(repo.authorizations, self.repo.authorizations)
+        self.assertEqual([(g.name, g.members) for g in repo.groups],
+                         [('devs', ['neil', 'amy'])])
+        self.failUnless(repo.has_auth('/trunk', 'neil', Auth.READ_WRITE))
+
+    def test_round_trip(self):
+        dumped = repopy.descriptor.dump(self.repo)
+        self.failUnless(dumped.startswith('!repository'))
+        self.failIf('python/object' in dumped)
+        self.assertSameRepository(repopy.descriptor.load(dumped))
+
+    def test_legacy(self):
+        # Descriptors written by yaml.dump before the explicit tags.
+        dumped = yaml.dump(self.repo)
+        self.failUnless('python/object:repopy.repository.Repository' in dumped)
+        self.assertSameRepository(repopy.descriptor.load(dumped))
+
+    def test_legacy_relative_module(self):
+        dumped = yaml.dump(self.repo).replace('repopy.repository.', 'repository.')
+        self.assertSameRepository(repopy.descriptor.load(dumped))
+
+    def test_unsafe(self):
+        self.assertRaises(yaml.YAMLError, repopy.descriptor.load,
+                          '!!python/object/apply:os.system ["true"]')
+
+
+class SidecarTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.yaml_path = os.path.join(self.dir, 'sakai.yaml')
+        self.repo = Repository('its', 'sakai')
+        self.repo.groups.append(Group('devs', ['neil']))
+        self.repo.add_auth('/', '@devs', Auth.READ_WRITE)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_dump_file(self):
+        repopy.descriptor.dump_file(self.repo, self.yaml_path)
+        self.failUnless(os.path.exists(self.yaml_path + 'c'))
+        repo = repopy.descriptor.load_file(self.yaml_path)
+        self.assertEqual(repo.authorizations, self.repo.authorizations)
+        self.assertEqual(repo.groups[0].members, ['neil'])
+        self.failUnless(repo.has_auth('/', '@devs', Auth.READ_WRITE))
+
+    def test_stale_sidecar(self):
+        repopy.descriptor.dump_file(self.repo, self.yaml_path)
+        # Someone edits the YAML by hand.
+        self.repo.add_auth('/trunk', 'amy', Auth.READ_ONLY)
+        f = open(self.yaml_path, 'w')
+        repopy.descriptor.dump(self.repo, f)
+        f.close()
+
+        repo = repopy.descriptor.load_file(self.yaml_path)
+        self.failUnless(repo.has_auth('/trunk', 'amy', Auth.READ_ONLY))
+        # The sidecar was brought up to date.
+        self.failUnless(repopy.descriptor._read_sidecar(self.yaml_path,
+                                    open(self.yaml_path).read()) is not None)
+
+    def test_corrupt_sidecar(self):
+        repopy.descriptor.dump_file(self.repo, self.yaml_path)
+        open(self.yaml_path + 'c', 'w').write('garbage')
+        repo = repopy.descriptor.load_file(self.yaml_path)
+        self.assertEqual(repo.authorizations, self.repo.authorizations)
@@ -0,0 +1,109 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from repopy import fileio
+
+
+class WriteFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.path = os.path.join(self.root, 'sakai.authz')
+
+    def tearDown(self):
+        fileio.abort()
+        shutil.rmtree(self.root)
+
+    def read(self, path=None):
+        f = open(path or self.path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_write(self):
+        self.failUnless(fileio.write_file(self.path, 'old'))
+        self.assertEqual(os.stat(self.path).st_mode & 0777, fileio.DEFAULT_MODE)
+        os.chmod(self.path, 0640)
+        inode = os.stat(self.path).st_ino
+
+        self.failUnless(fileio.write_file(self.path, 'new'))
+        self.assertEqual(self.read(), 'new')
+        # A new file was renamed into place, keeping the old one's mode.
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0640)
+        self.assertEqual(os.listdir(self.root), ['sakai.authz'])
+
+    def test_if_changed(self):
+        fileio.write_file(self.path, 'same')
+        os.utime(self.path, (1000, 1000))
+        self.failIf(fileio.write_file(self.path, 'same', if_changed=True))
+        self.assertEqual(os.stat(self.path).st_mtime, 1000)
+        self.failUnless(fileio.write_file(self.path, 'different', if_changed=True))
+
+    def test_batch(self):
+        other = os.path.join(self.root, 'sakai.conf')
+        fileio.write_file(self.path, 'old')
+        fileio.begin()
+        fileio.write_file(self.path, 'new')
+        fileio.begin()
+        fileio.write_file(other, 'conf')
+        fileio.commit()
+        # Nothing is in place until the outermost commit.
+        self.assertEqual(self.read(), 'old')
+        self.failIf(os.path.exists(other))
+        # A file staged twice gets the last version.
+        fileio.write_file(self.path, 'newer')
+        fileio.commit()
+
+        self.assertEqual(self.read(), 'newer')
+        self.assertEqual(self.read(other), 'conf')
+        self.assertEqual(sorted(os.listdir(self.root)), ['sakai.authz', 'sakai.conf'])
+
+    def test_abort(self):
+        fileio.write_file(self.path, 'old')
+        fileio.begin()
+        fileio.write_file(self.path, 'new')
+        fileio.write_file(os.path.join(self.root, 'sakai.conf'), 'conf')
+        fileio.abort()
+        # commit without a batch does nothing.
+        fileio.commit()
+        self.assertEqual(self.read(), 'old')
+        self.assertEqual(os.listdir(self.root), ['sakai.authz'])
+
+    def test_chunks(self):
+        chunks = iter(['[groups]\n', 'devs = neil\n'])
+        self.failUnless(fileio.write_file(self.path, chunks))
+        self.assertEqual(self.read(), '[groups]\ndevs = neil\n')
+        # if_changed compares the joined chunks.
+        self.failIf(fileio.write_file(self.path, iter(['[groups]\n', 'devs = neil\n']),
+                                      if_changed=True))
+        fileio.begin()
+        fileio.write_file(self.path, (line for line in ['new\n']))
+        fileio.commit()
+        self.assertEqual(self.read(), 'new\n')
+
+    def test_after_commit(self):
+        called = []
+        # Without a batch it's called right away.
+        fileio.after_commit(called.append, 'now')
+        self.assertEqual(called, ['now'])
+
+        fileio.begin()
+        fileio.write_file(self.path, 'new')
+        fileio.begin()
+        fileio.after_commit(lambda: called.append(self.read()))
+        fileio.commit()
+        self.assertEqual(called, ['now'])
+        fileio.commit()
+        # Called once the file is in place.
+        self.assertEqual(called, ['now', 'new'])
+
+        fileio.begin()
+        fileio.after_commit(called.append, 'aborted')
+        fileio.abort()
+        fileio.begin()
+        fileio.commit()
+        self.assertEqual(called, ['now', 'new'])
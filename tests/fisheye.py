@@ -0,0 +1,323 @@
+import os
+import cgi
+import time
+import shutil
+import threading
+import unittest
+import BaseHTTPServer
+from tempfile import mkdtemp
+
+import repopy.config as config
+import repopy.fisheye
+from repopy.repository import Repository
+from repopy.errors import InvalidPasswordError
+from StringIO import StringIO
+
+PASSWORD = 'secret'
+
+LOGIN_PAGE = """<html><body>
+<form name="loginform" method="post" action="login.do">
+<input type="password" name="adminPassword">
+<input type="submit" value="Log in">
+</form></body></html>"""
+
+LIST_PAGE = """<html><body><div class="helpPane">
+<ul><li>Admin</li></ul><ul><li>Settings</li></ul>
+<ul>%s</ul>
+</div></body></html>"""
+
+ADD_PAGE = """<html><body><form method="post" action="addRep.do">
+<input type="text" name="repository.name">
+<input type="text" name="repository.description">
+<select name="repoTypeSelection"><option value="SVN">SVN</option><option value="CVS">CVS</option></select>
+<input type="text" name="svn.url">
+<select name="svnSymbolic.type"><option value="none">none</option></select>
+<input type="submit">
+</form></body></html>"""
+
+DELETE_PAGE = """<html><body><p>Delete %s?</p><form method="post" action="deleteRep.do">
+<input type="hidden" name="rep" value="%d">
+<input type="submit" value="Delete">
+</form></body></html>"""
+
+
+class FakeFisheye(BaseHTTPServer.HTTPServer):
+    """
+    Mimics the fisheye admin pages repopy.fisheye uses, under /admin.
+    Counts logins and the pages it serves so tests can see what was
+    fetched.
+    """
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _FakeFisheyeHandler)
+        self.url = 'http://127.0.0.1:%d/admin' % self.server_port
+        self.lock = threading.Lock()
+        self.repositories = {}
+        self.next_id = 1
+        self.sessions = set()
+        self.logins = 0
+        self.views = {}
+
+    def add(self, name):
+        self.lock.acquire()
+        try:
+            rep = self.next_id
+            self.next_id += 1
+            self.repositories[name] = rep
+            return rep
+        finally:
+            self.lock.release()
+
+    def expire(self):
+        """Forget every session, as a restart of fisheye would."""
+        self.sessions.clear()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+
+class _FakeFisheyeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _session(self):
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, sep, value = part.strip().partition('=')
+            if name == 'JSESSIONID' and value in self.server.sessions:
+                return value
+        return None
+
+    def _send(self, body, status=200, headers=()):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect(self, page, headers=()):
+        self._send('', 302, (('Location', self.server.url + page),) + tuple(headers))
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return cgi.parse_qs(self.rfile.read(length))
+
+    def do_GET(self):
+        path, sep, query = self.path.partition('?')
+        page = path[len('/admin'):]
+        query = cgi.parse_qs(query)
+        server = self.server
+
+        if page != '/login.do' and self._session() is None:
+            return self._redirect('/login.do')
+        server.views[page] = server.views.get(page, 0) + 1
+        if page == '/login.do':
+            return self._send(LOGIN_PAGE)
+
+        if page == '/viewRepList.do':
+            links = ''.join(['<li><a href="viewRep.do?rep=%d">%s</a></li>' % (rep, name)
+                             for name, rep in sorted(server.repositories.items())])
+            return self._send(LIST_PAGE % links)
+        if page == '/addRep!default.do':
+            return self._send(ADD_PAGE)
+        if page in ('/viewRep.do', '/manageRep.do'):
+            return self._send('<html><body>%s</body></html>' % page)
+        if page == '/deleteRep!default.do':
+            rep = int(query['rep'][0])
+            for name, value in server.repositories.items():
+                if value == rep:
+                    return self._send(DELETE_PAGE % (name, rep))
+            return self._send('Not found', 404)
+        self._send('Not found', 404)
+
+    def do_POST(self):
+        page = self.path.partition('?')[0][len('/admin'):]
+        form = self._form()
+        server = self.server
+
+        if page == '/login.do':
+            if form.get('adminPassword') != [PASSWORD]:
+                return self._send(LOGIN_PAGE)
+            server.logins += 1
+            session = 'session%d' % server.logins
+            server.sessions.add(session)
+            return self._redirect('/viewRepList.do',
+                                  (('Set-Cookie', 'JSESSIONID=%s; Path=/' % session),))
+        if self._session() is None:
+            return self._redirect('/login.do')
+
+        if page == '/addRep.do':
+            rep = server.add(form['repository.name'][0])
+            return self._redirect('/viewRep.do?rep=%d' % rep)
+        if page == '/deleteRep.do':
+            rep = int(form['rep'][0])
+            for name, value in server.repositories.items():
+                if value == rep:
+                    del server.repositories[name]
+            return self._redirect('/viewRepList.do')
+        self._send('Not found', 404)
+
+
+class FisheyeTestCase(unittest.TestCase):
+    """Runs a FakeFisheye and points the fisheye config at it."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.server = FakeFisheye()
+        self.server.start()
+        self.saved = (config.FISHEYE_ADMIN_URL, config.FISHEYE_ADMIN_PW,
+                      config.FISHEYE_COOKIE_FILE, config.FISHEYE_ID_FILE)
+        config.FISHEYE_ADMIN_URL = self.server.url
+        config.FISHEYE_ADMIN_PW = PASSWORD
+        config.FISHEYE_COOKIE_FILE = os.path.join(self.root, 'cookies.txt')
+        config.FISHEYE_ID_FILE = os.path.join(self.root, 'ids.json')
+        # Don't reuse a shared admin made for another test's server.
+        setattr(repopy.fisheye, '__admin', None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        (config.FISHEYE_ADMIN_URL, config.FISHEYE_ADMIN_PW,
+         config.FISHEYE_COOKIE_FILE, config.FISHEYE_ID_FILE) = self.saved
+        setattr(repopy.fisheye, '__admin', None)
+        shutil.rmtree(self.root)
+
+
+class SessionTestCase(FisheyeTestCase):
+
+    def test_session_reused(self):
+        sakai = Repository('its', 'sakai')
+        admin = repopy.fisheye.FisheyeAdmin(PASSWORD)
+        self.failUnless(admin.create_repository(sakai, 'Sakai'))
+        self.assertEqual(self.server.logins, 1)
+
+        # A new admin, as in the next svnsh process, uses the saved cookie
+        # and the saved repository id.
+        views = self.server.views['/viewRepList.do']
+        admin = repopy.fisheye.FisheyeAdmin(PASSWORD)
+        self.failUnless(admin.delete_repository(sakai))
+        self.assertEqual(self.server.logins, 1)
+        # The only list page seen is the one fisheye shows after a delete.
+        self.assertEqual(self.server.views['/viewRepList.do'], views + 1)
+        self.assertEqual(self.server.repositories, {})
+
+    def test_relogin_when_expired(self):
+        admin = repopy.fisheye.FisheyeAdmin(PASSWORD)
+        admin.create_repository(Repository('its', 'sakai'), 'Sakai')
+        self.server.expire()
+        self.failUnless(admin.create_repository(Repository('its', 'other'), 'Other'))
+        self.assertEqual(self.server.logins, 2)
+
+    def test_bad_password(self):
+        admin = repopy.fisheye.FisheyeAdmin('wrong')
+        self.assertRaises(InvalidPasswordError, admin.create_repository,
+                          Repository('its', 'sakai'), 'Sakai')
+
+    def test_id_map(self):
+        for name in ('its_a', 'its_b', 'its_c'):
+            self.server.add(name)
+        admin = repopy.fisheye.FisheyeAdmin(PASSWORD)
+        # Logging in lands on the list page, which fills the map.
+        self.assertEqual(admin.repository_id('its_b'), 2)
+        self.assertEqual(admin.repository_id('its_b'), 2)
+        self.assertEqual(self.server.views.get('/viewRepList.do'), 1)
+
+        # Unknown names are looked up once more, in case they're new.
+        self.assertEqual(admin.repository_id('its_x'), None)
+        self.assertEqual(self.server.views.get('/viewRepList.do'), 2)
+
+        # Disabling many repositories never asks for the list. It's only
+        # seen after each delete, when fisheye shows it, and isn't parsed.
+        views = self.server.views.get('/viewRepList.do')
+        parsed = []
+        parse = repopy.fisheye.parse_repository_list
+        repopy.fisheye.parse_repository_list = lambda html: parsed.append(html) or parse(html)
+        try:
+            for name in ('a', 'b', 'c'):
+                self.failUnless(admin.delete_repository(Repository('its', name)))
+        finally:
+            repopy.fisheye.parse_repository_list = parse
+        self.assertEqual(parsed, [])
+        self.assertEqual(self.server.views.get('/viewRepList.do'), views + 3)
+        self.assertEqual(self.server.repositories, {})
+        self.assertEqual(admin.repo_ids, {})
+        self.assertEqual(self.server.logins, 1)
+
+
+class SyncTestCase(FisheyeTestCase):
+
+    def setUp(self):
+        FisheyeTestCase.setUp(self)
+        self.out = StringIO()
+        self.on = [Repository('its', name, True) for name in ('a', 'b', 'c', 'd')]
+        self.off = [Repository('its', name) for name in ('e', 'f')]
+        # b is already there, e and f should be off and x isn't svnsh's.
+        for name in ('its_b', 'its_e', 'its_f', 'x'):
+            self.server.add(name)
+
+    def sync(self, **kwargs):
+        kwargs.setdefault('rate', 0)
+        return repopy.fisheye.sync(self.on, self.on + self.off, out=self.out, **kwargs)
+
+    def test_sync(self):
+        self.assertEqual(self.sync(workers=3), [])
+        self.assertEqual(sorted(self.server.repositories.keys()),
+                         ['its_a', 'its_b', 'its_c', 'its_d', 'x'])
+        self.failUnless('Leaving x alone' in self.out.getvalue())
+        # Every worker reused the saved session.
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(sorted(repopy.fisheye.admin().repo_ids.keys()),
+                         ['its_a', 'its_b', 'its_c', 'its_d', 'x'])
+
+        # Nothing left to do the second time.
+        self.out.truncate(0)
+        self.assertEqual(self.sync(), [])
+        self.failIf('missing' in self.out.getvalue())
+
+    def test_dry_run(self):
+        self.assertEqual(self.sync(dry_run=True), [])
+        self.assertEqual(sorted(self.server.repositories.keys()),
+                         ['its_b', 'its_e', 'its_f', 'x'])
+        out = self.out.getvalue()
+        self.failUnless('Fisheye is missing its_a.' in out)
+        self.failUnless('Fisheye has its_e, which should be off.' in out)
+
+    def test_rate_limit(self):
+        start = time.time()
+        self.sync(workers=4, rate=20)
+        # Five changes, the first straight away and the rest 1/20s apart.
+        self.failUnless(time.time() - start >= 0.2)
+
+    def test_plan(self):
+        create, delete, unmanaged = repopy.fisheye.plan_sync(
+            ['its_a'], ['its_a', 'its_b'], ['its_b', 'x'])
+        self.assertEqual((create, delete, unmanaged), (['its_a'], ['its_b'], ['x']))
+
+    def test_stale_id(self):
+        self.server.repositories = {}
+        old = self.server.add('its_a')
+        admin = repopy.fisheye.FisheyeAdmin(PASSWORD)
+        self.assertEqual(admin.repository_id('its_a'), old)
+
+        # Changed through the fisheye UI: its_a is gone and its id
+        # belongs to another repository.
+        self.server.repositories = {'other': old}
+        self.failIf(admin.delete_repository(Repository('its', 'a')))
+        self.assertEqual(self.server.repositories, {'other': old})
+        self.failIf('its_a' in admin.repo_ids)
+
+        # Recreated with a new id, the new one is deleted.
+        admin.repo_ids['its_a'] = old
+        self.server.add('its_a')
+        self.failUnless(admin.delete_repository(Repository('its', 'a')))
+        self.assertEqual(self.server.repositories, {'other': old})
+
+    def test_cookie_file_private(self):
+        admin = repopy.fisheye.FisheyeAdmin(PASSWORD)
+        admin.login()
+        self.assertEqual(os.stat(config.FISHEYE_COOKIE_FILE).st_mode & 0777, 0600)
+        self.failUnless('JSESSIONID' in open(config.FISHEYE_COOKIE_FILE).read())
@@ -0,0 +1,76 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import repopy.manifest
+from repopy.manifest import Manifest, digests, template_digest
+from repopy.repository import Repository, Group, Auth
+from repopy.templates import Template
+
+
+class DigestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = Repository('its', 'sakai', True)
+        self.repo.groups.append(Group('devs', ['neil', 'amy']))
+        self.repo.add_auth('/', '@devs', Auth.READ_ONLY)
+
+    def test_only_inputs_matter(self):
+        before = digests(self.repo)
+        self.assertEqual(digests(self.repo), before)
+
+        # A grant below / doesn't change the fisheye auth file.
+        self.repo.add_auth('/trunk', 'neil', Auth.READ_WRITE)
+        after = digests(self.repo)
+        self.assertNotEqual(after['yaml'], before['yaml'])
+        self.assertNotEqual(after['authz'], before['authz'])
+        self.assertEqual(after['fisheyeauth'], before['fisheyeauth'])
+
+        self.repo.fisheye = False
+        self.assertEqual(digests(self.repo)['authz'], after['authz'])
+        self.assertNotEqual(digests(self.repo)['fisheyeauth'], after['fisheyeauth'])
+
+    def test_template_digest(self):
+        template = Template(template_string='%(repopath)s', params=['repopath', 'users'])
+        data = {'repopath': 'its/sakai', 'users': 'neil'}
+        digest = template_digest(template, data)
+        # users isn't used by the template.
+        data['users'] = 'amy'
+        self.assertEqual(template_digest(template, data), digest)
+
+        changed = Template(template_string='# %(repopath)s', params=['repopath'])
+        self.assertNotEqual(template_digest(changed, data), digest)
+
+
+class ManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.yaml_path = os.path.join(self.root, 'sakai.yaml')
+        self.authz = os.path.join(self.root, 'sakai.authz')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_round_trip(self):
+        manifest = Manifest(self.yaml_path)
+        self.failUnless(manifest.stale('authz', 'abc', self.authz))
+        open(self.authz, 'w').close()
+        manifest.record('authz', 'abc')
+        manifest.save()
+        self.assertEqual(manifest.path, os.path.join(self.root, 'sakai.manifest'))
+
+        manifest = Manifest(self.yaml_path)
+        self.failIf(manifest.stale('authz', 'abc', self.authz))
+        self.failUnless(manifest.stale('authz', 'def', self.authz))
+        # A missing file is always stale.
+        os.remove(self.authz)
+        self.failUnless(manifest.stale('authz', 'abc', self.authz))
+
+    def test_corrupt(self):
+        f = open(repopy.manifest.manifest_path(self.yaml_path), 'w')
+        f.write('{not json')
+        f.close()
+        open(self.authz, 'w').close()
+        self.failUnless(Manifest(self.yaml_path).stale('authz', 'abc', self.authz))
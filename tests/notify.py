@@ -0,0 +1,178 @@
+import os
+import email
+import shutil
+import smtpd
+import asyncore
+import threading
+import unittest
+from tempfile import mkdtemp
+
+import repopy.config as config
+import repopy.notify
+from repopy.repository import Repository
+
+
+class FakeSMTPChannel(smtpd.SMTPChannel):
+    """Refuses the recipients its server says to."""
+
+    def __init__(self, server, conn, addr):
+        smtpd.SMTPChannel.__init__(self, server, conn, addr)
+        self.fake = server
+
+    def smtp_RCPT(self, arg):
+        for address, reply in self.fake.refuse.items():
+            if arg and '<%s>' % address in arg:
+                self.push(reply)
+                return
+        smtpd.SMTPChannel.smtp_RCPT(self, arg)
+
+
+class FakeSMTPServer(smtpd.SMTPServer):
+    """Records what it's sent instead of delivering it."""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+        # Addresses to reject after DATA.
+        self.reject = set()
+        # address -> reply to RCPT TO.
+        self.refuse = {}
+
+    def handle_accept(self):
+        self.connections += 1
+        pair = self.accept()
+        if pair is not None:
+            conn, addr = pair
+            FakeSMTPChannel(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if rcpttos[0] in self.reject:
+            return '550 No such user'
+        self.messages.append((rcpttos, email.message_from_string(data)))
+
+
+class NotifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.server = FakeSMTPServer()
+        self.thread = threading.Thread(target=asyncore.loop,
+                                       kwargs={'timeout': 0.05, 'map': asyncore.socket_map})
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.saved = (config.SMTP_HOST, config.SMTP_PORT)
+        config.SMTP_HOST, config.SMTP_PORT = '127.0.0.1', self.server.port
+
+        self.spool = os.path.join(self.root, 'spool')
+        self.notifier = repopy.notify.Notifier(self.spool, delay=0.2)
+        self.sakai = Repository('its', 'sakai')
+        self.thesis = Repository('math', 'thesis')
+
+    def tearDown(self):
+        self.notifier.close()
+        self.server.close()
+        self.thread.join()
+        config.SMTP_HOST, config.SMTP_PORT = self.saved
+        shutil.rmtree(self.root)
+
+    def wait_for(self, count):
+        for i in range(100):
+            if len(self.server.messages) >= count and not self.notifier.pending():
+                return
+            threading.Event().wait(0.05)
+        self.fail('Only %d of %d messages arrived.' % (len(self.server.messages), count))
+
+    def test_digest(self):
+        self.notifier.addauth('neil', self.sakai, '/', 'r')
+        self.notifier.addauth('amy', self.sakai, '/trunk', 'rw')
+        self.notifier.addauth('neil', self.thesis, '/', 'rw')
+        self.wait_for(2)
+
+        self.assertEqual(self.server.connections, 1)
+        by_user = dict([(to[0], message) for to, message in self.server.messages])
+        self.assertEqual(sorted(by_user.keys()),
+                         ['amy@%s' % config.EMAIL_DOMAIN, 'neil@%s' % config.EMAIL_DOMAIN])
+        body = by_user['neil@%s' % config.EMAIL_DOMAIN].get_payload()
+        self.failUnless('read access on / for the repository located at %s' % self.sakai.url in body)
+        self.failUnless('write access on / for the repository located at %s' % self.thesis.url in body)
+
+    def test_spool_survives(self):
+        # Nothing is listening, so the notification stays in the spool.
+        config.SMTP_PORT = 1
+        self.notifier._write({'user': 'neil', 'repository': 'its/sakai', 'url': self.sakai.url,
+                              'path': '/', 'mode': 'r'})
+        self.assertRaises(Exception, self.notifier.send)
+        self.assertEqual(len(self.notifier.pending()), 1)
+
+        # A later process picks it up.
+        config.SMTP_PORT = self.server.port
+        self.assertEqual(repopy.notify.Notifier(self.spool).send(), 1)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.notifier.pending(), [])
+
+    def test_close_sends(self):
+        self.notifier.delay = 60
+        self.notifier.addauth('neil', self.sakai, '/', 'r')
+        self.notifier.close()
+        self.assertEqual(self.notifier.pending(), [])
+        self.wait_for(1)
+
+    def write(self, user):
+        self.notifier._write({'user': user, 'repository': 'its/sakai', 'url': self.sakai.url,
+                              'path': '/', 'mode': 'r'})
+
+    def test_rejected(self):
+        self.server.reject.add('bad@%s' % config.EMAIL_DOMAIN)
+        self.write('bad')
+        self.write('neil')
+        # The bad address doesn't stop neil's email.
+        self.assertEqual(self.notifier.send(), 1)
+        self.assertEqual([to for to, message in self.server.messages],
+                         [['neil@%s' % config.EMAIL_DOMAIN]])
+        self.assertEqual(self.notifier.pending(), [])
+        self.assertEqual(len(os.listdir(os.path.join(self.spool, repopy.notify.FAILED_DIR))), 1)
+
+    def test_refused_for_now(self):
+        self.server.refuse['busy@%s' % config.EMAIL_DOMAIN] = '450 Mailbox busy'
+        self.write('busy')
+        self.write('neil')
+        self.assertEqual(self.notifier.send(), 1)
+        # busy's is kept to retry, not failed.
+        self.assertEqual(len(self.notifier.pending()), 1)
+        self.failIf(os.path.exists(os.path.join(self.spool, repopy.notify.FAILED_DIR)))
+
+        del self.server.refuse['busy@%s' % config.EMAIL_DOMAIN]
+        self.assertEqual(self.notifier.send(), 1)
+        self.assertEqual(self.notifier.pending(), [])
+        self.assertEqual(sorted([to[0] for to, message in self.server.messages]),
+                         ['busy@%s' % config.EMAIL_DOMAIN, 'neil@%s' % config.EMAIL_DOMAIN])
+
+    def test_refused(self):
+        self.server.refuse['bad@%s' % config.EMAIL_DOMAIN] = '550 No such user'
+        self.write('bad')
+        self.assertEqual(self.notifier.send(), 0)
+        self.assertEqual(self.notifier.pending(), [])
+        self.assertEqual(len(os.listdir(os.path.join(self.spool, repopy.notify.FAILED_DIR))), 1)
+
+    def test_shared_spool(self):
+        for i in range(20):
+            self.write('user%d' % i)
+        # Two senders, as in two svnsh processes, each send what's there.
+        others = [repopy.notify.Notifier(self.spool) for i in range(2)]
+        threads = [threading.Thread(target=other.send) for other in others]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wait_for(20)
+        self.assertEqual(len(self.server.messages), 20)
+
+    def test_already_sent(self):
+        self.write('neil')
+        name = self.notifier.pending()[0]
+        os.remove(os.path.join(self.spool, name))
+        # Gone between listing and reading or removing, it's skipped.
+        self.notifier._remove(name)
+        self.assertEqual(self.notifier._send(), 0)
@@ -1,4 +1,9 @@
+import os
+import shutil
 import unittest
+from tempfile import mkdtemp
+
+import yaml
 
 import repopy.repository
 from repopy.repository import Auth
@@ -23,3 +28,112 @@ class RemoveAuthTestCase(unittest.TestCase):
         self.assertEqual(auth.user, 'bob')
         self.assertEqual(auth.path, '/foo')
 
+
+class AuthIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = repopy.repository.Repository('bar', 'foo')
+        self.repo.groups.append(repopy.repository.Group('devs', ['neil']))
+        self.repo.add_auth('/trunk', 'neil', Auth.READ_WRITE)
+        self.repo.add_auth('/', 'bob', Auth.READ_ONLY)
+        self.repo.add_auth('/trunk', '@devs', Auth.READ_ONLY)
+        self.repo.add_auth('/branches', 'neil', Auth.READ_ONLY)
+
+    def test_sorted(self):
+        self.assertEqual(self.repo.authorizations,
+                         sorted(self.repo.authorizations))
+
+    def test_has_auth(self):
+        self.failUnless(self.repo.has_auth('/trunk', 'neil', Auth.READ_WRITE))
+        self.failIf(self.repo.has_auth('/trunk', 'neil', Auth.READ_ONLY))
+        self.failIf(self.repo.has_auth('/', 'neil', Auth.READ_WRITE))
+
+    def test_remove_user(self):
+        self.repo.remove_user('neil')
+        self.assertEqual([(a.path, a.user) for a in self.repo.authorizations],
+                         [('/', 'bob'), ('/trunk', '@devs')])
+        self.failIf(self.repo.has_auth('/trunk', 'neil', Auth.READ_WRITE))
+        self.repo.add_auth('/trunk', 'neil', Auth.READ_WRITE)
+        self.failUnless(self.repo.has_auth('/trunk', 'neil', Auth.READ_WRITE))
+
+    def test_assign(self):
+        self.repo.authorizations = [Auth('/z', 'amy', Auth.READ_ONLY),
+                                    Auth('/a', 'amy', Auth.READ_ONLY)]
+        self.assertEqual([a.path for a in self.repo.authorizations], ['/a', '/z'])
+        self.failUnless(self.repo.has_auth('/z', 'amy', Auth.READ_ONLY))
+        self.failIf(self.repo.has_auth('/trunk', 'neil', Auth.READ_WRITE))
+
+    def test_yaml_round_trip(self):
+        dumped = yaml.dump(self.repo)
+        self.failUnless('authorizations:' in dumped)
+        self.failIf('_auth_index' in dumped)
+        repo = yaml.load(dumped, Loader=yaml.Loader)
+        self.assertEqual(repo.authorizations, self.repo.authorizations)
+        self.failUnless(repo.has_auth('/branches', 'neil', Auth.READ_ONLY))
+
+
+class AuthzTestCase(unittest.TestCase):
+
+    def test_authz(self):
+        repo = repopy.repository.Repository('bar', 'foo')
+        repo.groups.append(repopy.repository.Group('devs', ['u1', 'u2']))
+        repo.groups.append(repopy.repository.Group('empty', []))
+        repo.add_auth('/trunk', 'u3', Auth.READ_ONLY)
+        repo.add_auth('/', '@devs', Auth.READ_WRITE)
+        repo.add_auth('/trunk', 'u1', Auth.READ_WRITE)
+        repo.add_auth('/trunk', 'u0', Auth.READ_ONLY)
+        expected = ('[groups]\n'
+                    'devs = u1, u2\n'
+                    '\n'
+                    '[/]\n'
+                    '@devs = rw\n'
+                    '\n'
+                    '[/trunk]\n'
+                    'u0 = r\n'
+                    'u3 = r\n'
+                    'u1 = rw\n'
+                    '\n')
+        self.assertEqual(repo.authz(), expected)
+
+    def test_authz_empty(self):
+        repo = repopy.repository.Repository('bar', 'foo')
+        self.assertEqual(repo.authz(), '\n')
+
+    def test_write_authz(self):
+        root = mkdtemp()
+        try:
+            repo = repopy.repository.Repository('bar', 'foo')
+            repo.groups.append(repopy.repository.Group('devs', ['u1', 'u2']))
+            repo.add_auth('/', '@devs', Auth.READ_WRITE)
+            repo.apache_authz = os.path.join(root, 'foo.authz')
+            repo.write_authz()
+            self.assertEqual(open(repo.apache_authz).read(), repo.authz())
+        finally:
+            shutil.rmtree(root)
+
+
+class RunArgsTestCase(unittest.TestCase):
+
+    def test_run_args(self):
+        # Arguments go to the program as they are, no shell.
+        self.assertEqual(repopy.repository._run_args(['echo', 'a b;', '$HOME']), 'a b; $HOME\n')
+        self.assertRaises(Exception, repopy.repository._run_args, ['false'])
+
+
+class ChownTreeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        os.makedirs(os.path.join(self.root, 'db', 'revs'))
+        open(os.path.join(self.root, 'db', 'revs', '0'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_chown_tree(self):
+        if os.geteuid() != 0:
+            return
+        repopy.repository._chown_tree(self.root, 12345, 12346)
+        for path in ('', 'db', os.path.join('db', 'revs', '0')):
+            st = os.stat(os.path.join(self.root, path))
+            self.assertEqual((st.st_uid, st.st_gid), (12345, 12346))
@@ -0,0 +1,69 @@
+import os
+import shutil
+import threading
+import unittest
+from tempfile import mkdtemp
+
+import repopy.config
+import repopy.server
+
+
+class CheckedServer(repopy.server.CommandServer):
+    """Notes the socket's mode as soon as it's bound."""
+
+    def server_bind(self):
+        repopy.server.CommandServer.server_bind(self)
+        self.bound_mode = os.stat(self.server_address).st_mode & 0777
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.socket_path = os.path.join(self.dir, 'svnsh.sock')
+        self.stdout, self.stderr, self.stdin = repopy.server.sys.stdout, \
+                repopy.server.sys.stderr, repopy.server.sys.stdin
+        self.server = CheckedServer(self.socket_path, workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        repopy.server.sys.stdout, repopy.server.sys.stderr, \
+                repopy.server.sys.stdin = self.stdout, self.stderr, self.stdin
+        shutil.rmtree(self.dir)
+
+    def test_socket_private(self):
+        # Nobody else could connect even before the chmod.
+        self.assertEqual(self.server.bound_mode, repopy.config.SERVER_SOCKET_MODE)
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0777,
+                         repopy.config.SERVER_SOCKET_MODE)
+
+    def test_unknown_command(self):
+        status, output = repopy.server.request(['nosuchcommand'], self.socket_path)
+        self.assertEqual(status, 127)
+        self.failUnless('Unknown command: nosuchcommand' in output)
+
+    def test_usage(self):
+        status, output = repopy.server.request(['check', 'its/sakai'], self.socket_path)
+        self.assertEqual(status, 2)
+        self.failUnless('check [prefix/]name PATH USER' in output)
+
+    def test_no_transactions(self):
+        status, output = repopy.server.request(['begin'], self.socket_path)
+        self.assertEqual(status, 2)
+
+    def test_lock_key(self):
+        self.assertEqual(self.server._lock_key(['addauth', '/its/sakai/', '/', 'u', 'r']),
+                         'its/sakai')
+        self.assertEqual(self.server._lock_key(['addauth', '--from', 'f.csv']), None)
+        self.assertEqual(self.server._lock_key(['reindex']), None)
+        self.assertEqual(self.server._lock_key(['flush', 'its/sakai']), 'its/sakai')
+        self.assertEqual(self.server._lock_key(['flush', '--all']), None)
+        self.assertEqual(self.server._lock_key(['flush', '-j', '4', '--all']), None)
+        self.assertEqual(self.server._lock_key(['flush', 'its/*']), None)
+        self.assertEqual(self.server._lock_key(['fisheye', 'sync']), None)
+        self.assertEqual(self.server._lock_key(['fisheye', '-j', '4', 'sync']), None)
+        self.assertEqual(self.server._lock_key(['fisheye', 'its/sakai', 'on']), 'its/sakai')
@@ -0,0 +1,37 @@
+import sys
+import unittest
+from StringIO import StringIO
+
+import repopy.shell
+
+
+class RunCommandTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+
+    def test_unknown_command(self):
+        self.assertEqual(repopy.shell.run_command(['nosuchcommand']),
+                         repopy.shell.EXIT_UNKNOWN_COMMAND)
+
+    def test_usage(self):
+        self.assertEqual(repopy.shell.run_command(['check', 'repo']),
+                         repopy.shell.EXIT_USAGE)
+
+    def test_script(self):
+        script = StringIO('# comment\n\nbegin\nrollback\n')
+        self.assertEqual(repopy.shell.run_script(script), repopy.shell.EXIT_OK)
+
+    def test_script_stops_on_error(self):
+        script = StringIO('begin\nrollback\nrollback\nbegin\n')
+        self.assertEqual(repopy.shell.run_script(script), repopy.shell.EXIT_ERROR)
+        self.failIf(repopy.command.in_transaction())
+
+    def test_script_open_transaction(self):
+        script = StringIO('begin\n')
+        self.assertEqual(repopy.shell.run_script(script), repopy.shell.EXIT_ERROR)
+        self.failIf(repopy.command.in_transaction())
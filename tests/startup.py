@@ -0,0 +1,28 @@
+import os
+import sys
+import unittest
+import subprocess
+
+# Modules that are slow to import and are only needed by some commands.
+HEAVY_MODULES = ('pysvn', 'mechanize', 'BeautifulSoup', 'smtplib', 'yaml',
+                 'sqlite3', 'repopy.svn', 'repopy.fisheye', 'repopy.descriptor')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        script = ('import sys\n'
+                  'import repopy.shell, repopy.config\n'
+                  'print repopy.config.SVNADMIN\n'
+                  'print " ".join([m for m in %r if sys.modules.get(m)])\n'
+                  % (HEAVY_MODULES,))
+        p = subprocess.Popen([sys.executable, '-c', script], cwd=ROOT,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             env=dict(os.environ, PYTHONPATH=ROOT))
+        out, err = p.communicate()
+        self.assertEqual(p.returncode, 0, err)
+        svnadmin, imported = out.split('\n')[:2]
+        self.assertEqual(svnadmin, 'None')
+        self.assertEqual(imported, '')
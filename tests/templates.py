@@ -1,5 +1,7 @@
+import os
+import shutil
 import unittest
-from tempfile import mktemp
+from tempfile import mktemp, mkdtemp
 
 import repopy.templates
 
@@ -21,3 +23,42 @@ class TemplateTestCase(unittest.TestCase):
         self.assertRaises(ValueError, non_existing_file)
 
 
+
+    def test_undeclared_parameter(self):
+        self.assertRaises(ValueError, repopy.templates.Template,
+                          template_string='%(foo)s %(bar)s', params=['foo'])
+        template = repopy.templates.Template(template_string='100%% %(foo)s',
+                                             params=['foo'])
+        self.assertEqual(template.process({'foo': 'bar'}), '100% bar')
+
+
+class WriteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.template = repopy.templates.Template(template_string='Foo: %(foo)s\n',
+                                                  params=['foo'])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_unchanged_not_written(self):
+        path = os.path.join(self.root, 'foo.conf')
+        self.failUnless(self.template.process_to_file(path, {'foo': 'bar'}))
+        os.chmod(path, 0640)
+        os.utime(path, (1000, 1000))
+
+        self.failIf(self.template.process_to_file(path, {'foo': 'bar'}))
+        self.assertEqual(os.stat(path).st_mtime, 1000)
+
+        self.failUnless(self.template.process_to_file(path, {'foo': 'baz'}))
+        self.assertEqual(open(path).read(), 'Foo: baz\n')
+        self.assertEqual(os.stat(path).st_mode & 0777, 0640)
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(self.root), ['foo.conf'])
+
+    def test_render_many(self):
+        items = [(os.path.join(self.root, '%d.conf' % i), {'foo': i}) for i in range(4)]
+        self.assertEqual(self.template.render_many(items), [path for path, data in items])
+        items[2][1]['foo'] = 'changed'
+        self.assertEqual(self.template.render_many(items), [items[2][0]])